@@ -1,345 +1,363 @@
+import time
+_PROCESS_START = time.perf_counter()
+
 import os
-import torch
-import torch.nn as nn
-import torchvision.transforms as transforms
-from torchvision import models
-from PIL import Image
 import numpy as np
-import cv2
-import matplotlib.pyplot as plt
-import base64
 from io import BytesIO
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
+from contextlib import contextmanager
+from collections import OrderedDict
+import functools
+import json
+import logging
 import sys
-from supabase import create_client, Client
+import threading
+import uuid
+import zipfile
 from dotenv import load_dotenv
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from inference_scheduler import BatchScheduler, QueueFullError
+from artifacts import data_uri_bytes, encode_jpeg, jpeg_data_uri
+from doctor_stats import DoctorStatsService, create_doctor_auth, create_stats_store
+from ingest import InMemoryRequest, decode_image
+from model_registry import ModelRegistry, ModelVersion
+from observability import (REGISTRY, REQUEST_SECONDS, RequestProfiler, begin_request_spans, configure_logging,
+                           end_request_spans, server_timing, stage)
+from overlay_renderer import OverlayRenderer
+from preprocess import InputPreprocessor
+from retinal_validator import retinal_roi, validate_retinal_region
+from sample_images import SampleImageCatalog
+from result_cache import ResultCache, fingerprint_file, image_digest
+from storage_queue import LocalStorageBackend, SupabaseStorageBackend, UploadQueue
 import glob
 
+# torch, torchvision, cv2 and the Supabase client are imported by load_runtime(),
+# so the process can answer /api/health before the model is ready.
+
 # Load environment variables
 load_dotenv()
 
-print("Python version:", sys.version)
-print("PyTorch version:", torch.__version__)
-print("Starting application...")
+# Leveled JSON logs written by a background thread, so request threads never block on stdout
+configure_logging(os.getenv('LOG_LEVEL', 'INFO'), os.getenv('LOG_FORMAT', 'json'))
+logger = logging.getLogger('optipro')
+
+logger.info("Starting application", extra={'python_version': sys.version.split()[0]})
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest  # Keep uploads off the disk
 CORS(app)  # Enable CORS for all routes
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload size
 
-# Initialize Supabase client
+# Report written by scripts/evaluate.py and served at /api/evaluation
+EVALUATION_RESULTS_PATH = os.getenv('EVALUATION_RESULTS_PATH', 'evaluation_results.json')
+
+# Oversized JPEGs are decoded at a reduced scale so their longest side is at least this
+MAX_DECODE_SIDE = int(os.getenv('MAX_DECODE_SIDE', '2048'))
+
+# Original and heatmap JPEGs are encoded once, at most this large, for upload and inline display
+DISPLAY_MAX_SIDE = int(os.getenv('DISPLAY_MAX_SIDE', '1024'))
+
+# How uploads become model input: `torchvision` (the original PIL pipeline), `fast` (one cv2
+# INTER_AREA resize of the uint8 image) or `roi` (the same, cropped to the retinal region found
+# during validation). Switch only once scripts/evaluate.py --compare-preprocessing shows parity.
+PREPROCESS_MODE = os.getenv('PREPROCESS_MODE', 'torchvision')
+
+# How long a streamed prediction waits for its uploads before sending the `stored` line anyway
+STREAM_UPLOAD_WAIT = float(os.getenv('STREAM_UPLOAD_WAIT_S', '30'))
+
+# `full` inlines both images as base64 (the original response shape); `compact` inlines
+# the original once and points the client at /api/artifacts for the heatmap
+RESPONSE_MODE = os.getenv('RESPONSE_MODE', 'full')
+
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_ANON_KEY')
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Server-side reads of the RLS-protected stats tables; never sent to clients
+SUPABASE_SERVICE_ROLE_KEY = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+
+# Weights file; a .safetensors file is also accepted
+MODEL_WEIGHTS_PATH = os.getenv('MODEL_WEIGHTS', 'best_model.pth')
+
+# Serve randomly initialized weights when MODEL_WEIGHTS is missing (local development only)
+ALLOW_UNTRAINED_MODEL = os.getenv('ALLOW_UNTRAINED_MODEL', '0') == '1'
+UNTRAINED_FINGERPRINT = 'untrained'
+
+# Set by load_runtime()
+supabase = None
+storage_backend = None
+upload_queue = None
+transform = None
+preprocessor = None
+device = None
+model = None
+MODEL_FINGERPRINT = None
+explainer = None
+inference_backend = None
+RESULT_FINGERPRINT = None
+scheduler = None
+
+runtime_ready = threading.Event()
+runtime_error = None
+_runtime_lock = threading.Lock()
+
+# Seconds spent in each startup stage, logged on every boot
+STARTUP_TIMINGS = OrderedDict()
+
+@contextmanager
+def startup_stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - start, 3)
 
 # Defined the classes 
 CLASSES = ['CNV', 'DME', 'DRUSEN', 'NORMAL']
 
-def upload_image_to_supabase(image_array, filename, bucket_name='retinal-images'):
-    """Upload image to Supabase storage and return public URL"""
+def upload_image_to_supabase(image_bytes, filename, bucket_name='retinal-images'):
+    """Queue already-encoded JPEG bytes for background upload; returns its public URL"""
     try:
-        # Convert numpy array to PIL Image
-        if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-            pil_image = Image.fromarray(image_array.astype('uint8'), 'RGB')
-        else:
-            pil_image = Image.fromarray(image_array.astype('uint8'), 'L')
-        
-        # Convert to bytes
-        buffer = BytesIO()
-        pil_image.save(buffer, format='JPEG', quality=90)
-        image_bytes = buffer.getvalue()
-        
-        # Upload to Supabase storage
-        response = supabase.storage.from_(bucket_name).upload(filename, image_bytes, {
-            'content-type': 'image/jpeg'
-        })
-        
-        if response.error:
-            print(f"Error uploading to Supabase: {response.error}")
-            return None
-        
-        # Get public URL
-        public_url = supabase.storage.from_(bucket_name).get_public_url(filename)
-        return public_url
+        # Spool and hand off to the write-behind queue; the URL is known up front
+        return upload_queue.enqueue(bucket_name, filename, image_bytes, 'image/jpeg')
         
     except Exception as e:
-        print(f"Error in upload_image_to_supabase: {e}")
+        logger.error("Error queueing upload", extra={'key': filename, 'error': str(e)})
         return None
 
+def artifact_filenames(scan_id):
+    """Object keys for a scan's original and heatmap images"""
+    return f"original_{scan_id}.jpg", f"heatmap_{scan_id}.jpg"
+
 def image_to_base64(image_array):
     """Convert numpy image array to base64 string"""
-    # Convert numpy array to PIL Image
-    if len(image_array.shape) == 3 and image_array.shape[2] == 3:
-        # RGB image
-        pil_image = Image.fromarray(image_array.astype('uint8'), 'RGB')
-    else:
-        # Grayscale image
-        pil_image = Image.fromarray(image_array.astype('uint8'), 'L')
-    
-    # Convert to base64
-    buffer = BytesIO()
-    pil_image.save(buffer, format='JPEG', quality=90)
-    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-    return f"data:image/jpeg;base64,{img_base64}"
+    return jpeg_data_uri(encode_jpeg(image_array, max_side=DISPLAY_MAX_SIDE))
 
-def file_to_base64(file_path):
-    """Convert image file to base64 string"""
-    try:
-        with Image.open(file_path) as img:
-            img = img.convert('RGB')
-            buffer = BytesIO()
-            img.save(buffer, format='JPEG', quality=90)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            return f"data:image/jpeg;base64,{img_base64}"
-    except Exception as e:
-        print(f"Error converting file to base64: {e}")
-        return None
+# Sample scan files served by /api/samples; the build copy is used when the sources are not deployed
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_IMAGE_PATHS = [
+    os.path.join(APP_DIR, 'frontend', folder, 'assets', filename)
+    for folder in ('public', 'build')
+    for filename in ('Sample Retina.jpeg', 'Sample Retina 2.jpeg', 'Sample Retina 3.jpeg')
+]
+
+# Encoded once by start_services() and served by /api/samples; rejected uploads only get references
+sample_images = SampleImageCatalog(
+    SAMPLE_IMAGE_PATHS,
+    name='Valid Retinal Scan Example',
+    description='A valid retinal scan shows a circular view of the back of the eye with visible blood vessels radiating from the optic disc. The image has an orange-red color with dark edges.',
+    check_interval=float(os.getenv('SAMPLE_IMAGES_CHECK_S', '30')),
+)
+
+def sample_image_path(sample_id):
+    return f"/api/samples/{sample_id}.jpg"
 
-def validate_retinal_image(image_path):
-    """Validate if the image is a retinal scan using balanced heuristics for both OCT and fundus images"""
+def build_transform():
+    """Define the transformation for input images"""
+    import torchvision.transforms as transforms
+    return transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+
+def load_weights(path, mmap=True):
+    """Load a state_dict, memory-mapped by default so the page cache is shared by every worker process.
+    
+    A mapped file must never be rewritten in place while the model is serving;
+    replacing it with os.replace (or mv) leaves the mapping on the old file.
+    With mmap=False the weights are read into memory and the file is not used
+    once this returns.
+    """
+    import torch
+    if path.endswith('.safetensors'):
+        from safetensors.torch import load, load_file
+        if not mmap:
+            with open(path, 'rb') as f:
+                return {name: tensor.to(device) for name, tensor in load(f.read()).items()}
+        return load_file(path, device=str(device))
     try:
-        img = Image.open(image_path).convert('RGB')
-        img_np = np.array(img)
-        
-        # Check 1: Image should be reasonably sized
-        height, width = img_np.shape[:2]
-        if width < 100 or height < 100:
-            return False, "Image resolution too low for retinal analysis"
-        
-        # Convert to grayscale for analysis
-        gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
-        
-        # Check 2: Dark background check (relaxed for OCT images)
-        dark_pixels = np.sum(gray < 40) / gray.size
-        if dark_pixels < 0.15:  # At least 15% should be dark (lowered from 30%)
-            return False, "Image lacks the characteristic dark background of retinal scans"
-        
-        # Check 3: Verify there's some bright content (not completely dark)
-        bright_mask = gray > 40
-        bright_ratio = np.sum(bright_mask) / gray.size
-        
-        if bright_ratio < 0.05:  # At least 5% should be visible
-            return False, "Image is too dark to be a valid retinal scan"
-        
-        # Check 4: Color analysis (more lenient for OCT which can be grayscale/bluish)
-        red_channel = img_np[:, :, 0].astype(float)
-        green_channel = img_np[:, :, 1].astype(float)
-        blue_channel = img_np[:, :, 2].astype(float)
-        
-        if np.sum(bright_mask) > 0:
-            red_mean = np.mean(red_channel[bright_mask])
-            green_mean = np.mean(green_channel[bright_mask])
-            blue_mean = np.mean(blue_channel[bright_mask])
-            
-            # Check if image is too colorful/vibrant (like wallpapers)
-            color_std = np.std([red_mean, green_mean, blue_mean])
-            if color_std > 60:  # High color variation suggests non-medical image
-                return False, "Color variation too high for medical imaging"
-            
-            # Reject images with dominant blue AND green (nature photos, etc.)
-            if blue_mean > red_mean * 1.2 and green_mean > red_mean * 1.2:
-                return False, "Color profile does not match retinal imaging (too much blue/green)"
-        
-        # Check 5: Look for significant contoured regions
-        _, thresh = cv2.threshold(gray, 25, 255, cv2.THRESH_BINARY)
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        if len(contours) == 0:
-            return False, "No retinal structure detected in image"
-        
-        # Find the largest contour
-        largest_contour = max(contours, key=cv2.contourArea)
-        contour_area = cv2.contourArea(largest_contour)
-        image_area = width * height
-        
-        # The main region should occupy a reasonable portion (more lenient)
-        area_ratio = contour_area / image_area
-        if area_ratio < 0.08:  # At least 8% (was 15%)
-            return False, "No significant retinal region found"
-        
-        if area_ratio > 0.92:  # Should have some dark borders (was 85%)
-            return False, "Image lacks typical retinal scan framing"
-        
-        # Check 6: Brightness distribution
-        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
-        hist = hist.flatten() / hist.sum()
-        
-        # Should have some concentration in dark and medium ranges
-        dark_region = np.sum(hist[0:40])
-        medium_region = np.sum(hist[40:180])
-        
-        if dark_region < 0.1:  # Some dark background (lowered from 20%)
-            return False, "Brightness distribution does not match retinal imaging"
-        
-        if medium_region < 0.1:  # Some visible content (lowered from 15%)
-            return False, "Missing characteristic retinal brightness pattern"
-        
-        # Check 7: Edge analysis (relaxed - OCT has different edge patterns)
-        edges = cv2.Canny(gray, 20, 80)
-        edge_density = np.sum(edges > 0) / edges.size
-        
-        # More lenient edge density range
-        if edge_density < 0.01 or edge_density > 0.4:
-            return False, "Edge pattern does not match retinal imaging"
-        
-        # Check 8: Reject highly saturated colorful images (wallpapers, photos)
-        hsv = cv2.cvtColor(img_np, cv2.COLOR_RGB2HSV)
-        saturation = hsv[:, :, 1]
-        high_saturation = np.sum(saturation > 100) / saturation.size
-        
-        if high_saturation > 0.3:  # More than 30% highly saturated = likely not medical
-            return False, "Image appears to be a photograph rather than medical scan"
-        
-        # If all checks pass, it's likely a retinal image
-        return True, "Valid retinal image detected"
-        
-    except Exception as e:
-        print(f"Error validating retinal image: {e}")
-        return False, f"Error processing image: {str(e)}"
-
-def get_sample_retinal_images():
-    """Get sample retinal images to show users"""
-    sample_images = []
-    
-    # Embedded base64 sample image (fallback - always available)
-    EMBEDDED_SAMPLE_IMAGE = "data:image/jpeg;base64,/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAMCAgICAgMCAgIDAwMDBAYEBAQEBAgGBgUGCQgKCgkICQkKDA8MCgsOCwkJDRENDg8QEBEQCgwSExIQEw8QEBD/2wBDAQMDAwQDBAgEBAgQCwkLEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBD/wAARCAEsASwDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwD9U6KKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigAooooAKKKKACiiigD//Z"
-    
-    # Try to find sample images in multiple locations
-    possible_paths = [
-        os.path.join('frontend', 'public', 'assets', 'sample-retina.jpeg'),
-        os.path.join('frontend', 'build', 'assets', 'sample-retina.jpeg'),
-        os.path.join('sample_retinal_images', 'sample-retina.jpeg'),
-    ]
-    
-    # Check each path
-    for path in possible_paths:
-        if os.path.exists(path) and os.path.getsize(path) > 1000:  # Must be larger than 1KB to be a real image
-            print(f"Found sample image at: {path}")
-            base64_img = file_to_base64(path)
-            if base64_img:
-                sample_images.append({
-                    'name': 'Valid Retinal Scan Example',
-                    'data': base64_img,
-                    'description': 'A valid retinal scan shows a circular view of the back of the eye with visible blood vessels radiating from the optic disc. The image has an orange-red color with dark edges.'
-                })
-                print(f"Successfully loaded sample image from {path}")
-                return sample_images  # Return immediately if found
-    
-    # If no file samples found, use the embedded base64 image
-    print("Using embedded base64 sample image")
-    sample_images.append({
-        'name': 'Valid Retinal Scan Example',
-        'data': EMBEDDED_SAMPLE_IMAGE,
-        'description': 'A valid retinal scan shows a circular view of the back of the eye with visible blood vessels radiating from the optic disc. The image has an orange-red color with dark edges.'
-    })
-    
-    return sample_images
-
-# Define the transformation for input images
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
-
-# Load the model
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"Using device: {device}")
-
-def load_model():
-    print("Loading model...")
+        return torch.load(path, map_location=device, mmap=mmap, weights_only=True)
+    except TypeError:
+        # Older torch without mmap support
+        return torch.load(path, map_location=device)
+
+def load_model(path=None, mmap=True):
+    """Build the ResNet-101 classifier and load the weights at `path` (default MODEL_WEIGHTS).
+    
+    A missing or unreadable weights file is an error. With ALLOW_UNTRAINED_MODEL=1
+    a missing file gives a randomly initialized model instead; nothing is written
+    to disk. `mmap` is passed to load_weights.
+    """
+    import torch.nn as nn
+    from torchvision import models
+    
+    path = path or MODEL_WEIGHTS_PATH
+    logger.info("Loading model", extra={'path': path})
     # Create ResNet model
     model = models.resnet101(weights=None)  # Changed from pretrained=False to fix deprecation warning
     num_ftrs = model.fc.in_features
     model.fc = nn.Linear(num_ftrs, len(CLASSES))
     
-    # Try to load the saved state_dict, otherwise use a mock model for testing
-    try:
-        # Check if model file exists
-        if not os.path.exists('best_model.pth'):
-            print("Model file not found, creating a mock model")
-            # Save a mock model for testing
-            create_mock_model(model)
-            
+    if os.path.exists(path):
         # Load the saved state_dict
-        state_dict = torch.load('best_model.pth', map_location=device)
+        state_dict = load_weights(path, mmap=mmap)
         
-        # Apply the loaded state_dict to the model
-        model.load_state_dict(state_dict)
-        
-        model.to(device)
-        model.eval()
-        print("Model loaded successfully!")
-        return model
-    except Exception as e:
-        print(f"Error loading model: {e}")
-        # For testing purposes, just return the model without weights
-        model.to(device)
-        model.eval()
-        print("Using initialized model without weights for testing")
-        return model
-
-def create_mock_model(model):
-    """Create a mock model with random weights for testing"""
-    print("Creating mock model for testing...")
-    # Save the initialized model for testing purposes
-    torch.save(model.state_dict(), 'best_model.pth')
-    print("Mock model saved to best_model.pth")
+        # Apply the loaded state_dict to the model, keeping the loaded (possibly mmapped) storage
+        try:
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(state_dict)
+        logger.info("Model loaded", extra={'path': path})
+    elif ALLOW_UNTRAINED_MODEL:
+        logger.warning("Model file not found, serving untrained weights (ALLOW_UNTRAINED_MODEL=1)",
+                       extra={'path': path})
+    else:
+        raise FileNotFoundError(f"Model weights not found at {path} (set MODEL_WEIGHTS, "
+                                f"or ALLOW_UNTRAINED_MODEL=1 for local testing)")
+    
+    model.to(device)
+    model.eval()
     return model
 
-model = load_model()
-
 class GradCAM:
+    """Grad-CAM explainer that owns its hook for the life of the process.
+
+    The hook is registered once when the explainer is built next to the model,
+    and every call gets the logits, softmax confidence and CAM from a single
+    forward pass plus a single backward pass down to the target layer.
+    """
     def __init__(self, model, target_layer):
         self.model = model
         self.target_layer = target_layer
-        self.gradients = None
         self.activations = None
+        # Forward/backward passes share self.activations, so serialize them
+        self._lock = threading.Lock()
         
-        # Register hooks
-        target_layer.register_forward_hook(self.save_activation)
-        target_layer.register_full_backward_hook(self.save_gradient)
+        # Register hooks once; handles are kept so they can be removed
+        self._hook_handles = [
+            target_layer.register_forward_hook(self.save_activation),
+        ]
         
     def save_activation(self, module, input, output):
-        self.activations = output.detach()
-        
-    def save_gradient(self, module, grad_input, grad_output):
-        if grad_output[0] is not None:
-            self.gradients = grad_output[0].detach()
-        
-    def generate_heatmap(self, input_image, class_idx=None):
-        # Forward pass
-        output = self.model(input_image)
-        
-        if class_idx is None:
-            class_idx = torch.argmax(output).item()
+        # Keep the graph attached so gradients can be taken w.r.t. the activations
+        self.activations = output
+    
+    @property
+    def hook_count(self):
+        """Number of hooks currently registered on the target layer"""
+        return len(self.target_layer._forward_hooks) + len(self.target_layer._backward_hooks)
+    
+    def remove_hooks(self):
+        for handle in self._hook_handles:
+            handle.remove()
+        self._hook_handles = []
+    
+    def explain(self, input_image, class_idx=None):
+        """Return (class_idx, confidence, heatmap) from one forward and one backward pass"""
+        class_indices = None if class_idx is None else [class_idx]
+        results = self.explain_batch(input_image, class_indices)
+        return results[0]
+    
+    def explain_batch(self, input_batch, class_indices=None, on_diagnosis=None):
+        """Return a (class_idx, confidence, heatmap) tuple per sample in the batch.
         
-        # Zero gradients
-        self.model.zero_grad()
+        The model is in eval mode, so samples do not interact and the gradient of
+        the summed target logits gives each sample its own Grad-CAM gradients.
+        `on_diagnosis(class_indices, confidences)` is called after the forward
+        pass; if it returns False the backward pass is skipped and the heatmaps
+        are None.
+        """
+        import torch
+        with self._lock, torch.enable_grad():
+            self.activations = None
+            with stage('forward'):
+                output = self.model(input_batch)
+            activations = self.activations
+            # Drop the reference so the graph is freed with this call
+            self.activations = None
+            
+            probabilities = torch.nn.functional.softmax(output.detach(), dim=1)
+            if class_indices is None:
+                class_indices = torch.argmax(probabilities, dim=1).tolist()
+            rows = torch.arange(len(class_indices))
+            confidences = (probabilities[rows, class_indices] * 100).tolist()
+            if on_diagnosis is not None and not on_diagnosis(class_indices, confidences):
+                return [(idx, conf, None) for idx, conf in zip(class_indices, confidences)]
+            
+            # Check if activations were captured with a graph attached
+            if activations is None or not activations.requires_grad:
+                # If not, return blank heatmaps
+                blank = np.zeros((7, 7))  # ResNet's last layer size
+                return [(idx, conf, blank) for idx, conf in zip(class_indices, confidences)]
+            
+            # Backward pass only down to the target layer
+            with stage('gradcam_backward'):
+                gradients, = torch.autograd.grad(output[rows, class_indices].sum(), activations)
         
-        # Target for backprop
-        one_hot = torch.zeros_like(output)
-        one_hot[0, class_idx] = 1
+        activations = activations.detach()
+        return [
+            (idx, conf, self._compute_heatmap(activations[i:i + 1], gradients[i:i + 1]))
+            for i, (idx, conf) in enumerate(zip(class_indices, confidences))
+        ]
+    
+    def predict_batch(self, input_batch):
+        """Return a (class_idx, confidence) tuple per sample from a forward pass only (no graph, no heatmap)"""
+        import torch
+        with self._lock, torch.inference_mode():
+            output = self.model(input_batch)
+            # The hook saw this pass too; an inference tensor is of no use to explain_batch
+            self.activations = None
+            probabilities = torch.nn.functional.softmax(output, dim=1)
+            confidences, class_indices = probabilities.max(dim=1)
+        return list(zip(class_indices.tolist(), (confidences * 100).tolist()))
+    
+    def class_heatmaps(self, input_batch):
+        """Return a (num_classes, h, w) stack of heatmaps per sample, one per class.
         
-        # Backward pass
-        output.backward(gradient=one_hot, retain_graph=True)
+        All classes share one forward pass; each class adds a backward pass down
+        to the target layer only.
+        """
+        import torch
+        with self._lock, torch.enable_grad():
+            self.activations = None
+            output = self.model(input_batch)
+            activations = self.activations
+            self.activations = None
+            
+            if activations is None or not activations.requires_grad:
+                return [np.zeros((output.shape[1], 7, 7)) for _ in range(len(input_batch))]
+            
+            num_classes = output.shape[1]
+            gradients = [
+                torch.autograd.grad(output[:, c].sum(), activations, retain_graph=c < num_classes - 1)[0]
+                for c in range(num_classes)
+            ]
         
-        # Check if gradients were properly captured
-        if self.gradients is None:
-            # If gradients are None, return a blank heatmap
-            return np.zeros((7, 7))  # ResNet's last layer size
+        activations = activations.detach()
+        return [
+            np.stack([self._compute_heatmap(activations[i:i + 1], grads[i:i + 1]) for grads in gradients])
+            for i in range(len(input_batch))
+        ]
+    
+    def generate_heatmap(self, input_image, class_idx=None):
+        _, _, heatmap = self.explain(input_image, class_idx)
+        return heatmap
+    
+    @staticmethod
+    def _compute_heatmap(activations, gradients):
+        import torch
         
         # Get weights
-        gradients = self.gradients.mean(dim=[2, 3], keepdim=True)
+        weights = gradients.mean(dim=[2, 3], keepdim=True)
         
         # Weight the activations
-        activations = self.activations
-        weighted_activations = gradients * activations
+        weighted_activations = weights * activations
         
         # Generate heatmap
-        heatmap = torch.mean(weighted_activations, dim=1).squeeze().cpu().detach().numpy()
+        heatmap = torch.mean(weighted_activations, dim=1).squeeze().cpu().numpy()
         
         # ReLU on heatmap
         heatmap = np.maximum(heatmap, 0)
@@ -349,75 +367,359 @@ class GradCAM:
         
         return heatmap
 
-def predict_image(image_path):
-    print(f"Predicting image: {image_path}")
-    original_image = Image.open(image_path).convert('RGB')
-    transformed_image = transform(original_image).unsqueeze(0).to(device)
-    
-    # Get the layer to use for Grad-CAM
+def get_target_layer(model):
+    """Get the layer to use for Grad-CAM"""
     try:
-        target_layer = model.layer4[-1].conv3  # Use the last convolutional layer of ResNet
+        return model.layer4[-1].conv3  # Use the last convolutional layer of ResNet
     except AttributeError:
         # Fallback to another layer if conv3 is not available
-        target_layer = model.layer4[-1]
+        return model.layer4[-1]
+
+def weights_fingerprint(path):
+    return fingerprint_file(path) if os.path.exists(path) else UNTRAINED_FINGERPRINT
+
+def create_inference_backend(version):
+    """Build the INFERENCE_BACKEND (eager, torchscript, onnx or quantized) for a model version; falls back to eager"""
+    from inference_backends import EagerBackend, create_backend, load_calibration_batches
+    
+    backend_name = os.getenv('INFERENCE_BACKEND', 'eager')
+    try:
+        return create_backend(
+            backend_name,
+            version.model,
+            version.explainer,
+            cam_mode=os.getenv('INFERENCE_CAM_MODE', 'cam'),
+            onnx_path=os.path.join(os.getenv('MODEL_CACHE_DIR', 'model_cache'), f"resnet101_{version.fingerprint}.onnx"),
+            calibration_batches=load_calibration_batches(os.getenv('QUANT_CALIBRATION_DIR'), transform)
+            if backend_name == 'quantized' else None,
+        )
+    except Exception as e:
+        logger.warning("Error creating inference backend, falling back to eager",
+                       extra={'backend': backend_name, 'error': str(e)})
+        return EagerBackend(version.explainer)
+
+def build_model_version(path):
+    """Load a weights file into a new model, explainer and inference backend (for hot reloads and shadows).
+    
+    Reloaded weights are copied into memory rather than mapped: the file being
+    watched is the one that gets replaced next, and a worker's private copy is
+    not shared with its siblings anyway.
+    """
+    loaded = load_model(path, mmap=False)
+    version = ModelVersion(path, weights_fingerprint(path), loaded, GradCAM(loaded, get_target_layer(loaded)),
+                           preprocess_mode=preprocessor.mode)
+    version.backend = create_inference_backend(version)
+    return version
+
+# Hot reloads and shadow evaluation; see ModelRegistry
+model_registry = ModelRegistry(
+    build_model_version,
+    warmup_iterations=int(os.getenv('MODEL_WARMUP_ITERATIONS', '3')),
+    shadow_sample_rate=float(os.getenv('SHADOW_SAMPLE_RATE', '0.1')),
+)
+
+@model_registry.on_activate
+def use_model_version(version):
+    """Point the module-level model globals at the newly active version"""
+    global model, explainer, inference_backend, MODEL_FINGERPRINT, RESULT_FINGERPRINT
+    model, explainer, inference_backend = version.model, version.explainer, version.backend
+    MODEL_FINGERPRINT, RESULT_FINGERPRINT = version.fingerprint, version.result_fingerprint
+
+def load_runtime(start=True):
+    """Import the heavy dependencies and build the model and explainer.
     
-    # Initialize Grad-CAM
-    grad_cam = GradCAM(model, target_layer)
+    With start=True the per-process services (inference backend, batcher and
+    upload workers) are started too. Pre-fork servers pass start=False in the
+    master so the model is shared copy-on-write, then call start_services() in
+    each worker. Safe to call from several threads.
+    """
+    global supabase, storage_backend, upload_queue, transform, preprocessor, device, model, MODEL_FINGERPRINT
+    global explainer, runtime_error
     
-    with torch.no_grad():
-        outputs = model(transformed_image)
-        _, predicted = torch.max(outputs, 1)
+    with _runtime_lock:
+        if model is None:
+            start_time = time.perf_counter()
+            try:
+                with startup_stage('import_torch'):
+                    import torch
+                    import torchvision  # noqa: F401
+                    logger.info("Imported PyTorch", extra={'torch_version': torch.__version__})
+                
+                with startup_stage('import_cv2'):
+                    import cv2  # noqa: F401
+                
+                with startup_stage('storage'):
+                    # Artifact uploads go through a write-behind queue spooled to local disk.
+                    # STORAGE_BACKEND=local writes to LOCAL_STORAGE_DIR instead of Supabase (for local runs/tests).
+                    if os.getenv('STORAGE_BACKEND', 'supabase') == 'local':
+                        storage_backend = LocalStorageBackend(os.getenv('LOCAL_STORAGE_DIR', 'local_storage'))
+                    else:
+                        from supabase import create_client
+                        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                        storage_backend = SupabaseStorageBackend(supabase, SUPABASE_URL)
+                    upload_queue = UploadQueue(
+                        storage_backend,
+                        spool_dir=os.getenv('UPLOAD_SPOOL_DIR', 'upload_spool'),
+                        workers=int(os.getenv('UPLOAD_WORKERS', '4')),
+                        max_retries=int(os.getenv('UPLOAD_MAX_RETRIES', '5')),
+                    )
+                
+                with startup_stage('load_model'):
+                    transform = build_transform()
+                    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                    logger.info("Using device", extra={'device': str(device)})
+                    preprocessor = InputPreprocessor(device, PREPROCESS_MODE, transform=transform)
+                    loaded = load_model()
+                
+                with startup_stage('fingerprint'):
+                    MODEL_FINGERPRINT = weights_fingerprint(MODEL_WEIGHTS_PATH)
+                    logger.info("Model weights fingerprint", extra={'fingerprint': MODEL_FINGERPRINT})
+                
+                explainer = GradCAM(loaded, get_target_layer(loaded))
+                model = loaded
+            except Exception as e:
+                runtime_error = str(e)
+                logger.exception("Error loading runtime")
+                raise
+            STARTUP_TIMINGS['model_total'] = round(time.perf_counter() - start_time, 3)
+    
+    if start:
+        start_services()
+
+def start_services(recover_uploads=True, start_uploads=True):
+    """Start this process's inference backend, batcher and upload workers, then mark it ready.
+    
+    The ASGI server passes start_uploads=False and runs the upload workers on its event loop.
+    """
+    global scheduler, runtime_error
+    
+    with _runtime_lock:
+        if runtime_ready.is_set():
+            return
+        try:
+            with startup_stage('inference_backend'):
+                version = ModelVersion(MODEL_WEIGHTS_PATH, MODEL_FINGERPRINT, model, explainer,
+                                       preprocess_mode=preprocessor.mode)
+                version.backend = create_inference_backend(version)
+                logger.info("Using inference backend", extra={'backend': version.backend.name})
+                model_registry.activate(version)
+                
+                # Micro-batch concurrent requests into one forward/backward pass
+                scheduler = BatchScheduler(
+                    version,
+                    max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '8')),
+                    max_wait_ms=float(os.getenv('INFERENCE_MAX_WAIT_MS', '10')),
+                    max_queue_size=int(os.getenv('INFERENCE_MAX_QUEUE_SIZE', '64')),
+                ).start()
+                model_registry.attach(scheduler)
+            
+            # MODEL_RELOAD_POLL_S > 0 hot-reloads MODEL_WEIGHTS when the file is replaced;
+            # SHADOW_MODEL_WEIGHTS is loaded in the background as a shadow candidate
+            reload_poll = float(os.getenv('MODEL_RELOAD_POLL_S', '0'))
+            if reload_poll > 0:
+                model_registry.watch(MODEL_WEIGHTS_PATH, reload_poll)
+            if os.getenv('SHADOW_MODEL_WEIGHTS'):
+                model_registry.load(os.getenv('SHADOW_MODEL_WEIGHTS'), shadow=True)
+            
+            with startup_stage('sample_images'):
+                sample_images.refresh()
+            
+            if start_uploads:
+                with startup_stage('upload_workers'):
+                    upload_queue.start(recover=recover_uploads)
+        except Exception as e:
+            runtime_error = str(e)
+            logger.exception("Error starting services")
+            raise
         
-        # Get probabilities using softmax
-        probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-        confidence = probabilities[predicted].item() * 100
+        STARTUP_TIMINGS['import_to_ready'] = round(time.perf_counter() - _PROCESS_START, 3)
+        logger.info("Runtime ready", extra={'startup_timings': dict(STARTUP_TIMINGS)})
+        runtime_ready.set()
+
+def shutdown_services(timeout=5):
+    """Stop the batcher and upload workers; pending uploads stay in the spool for the next start"""
+    runtime_ready.clear()
+    model_registry.stop()
+    if scheduler is not None:
+        scheduler.stop(timeout)
+    if upload_queue is not None:
+        upload_queue.stop(timeout)
+
+def start_background_loading():
+    """Load the runtime on a daemon thread so the server can answer health checks meanwhile"""
+    def run():
+        try:
+            load_runtime()
+        except Exception:
+            pass  # Already logged by load_runtime; /api/ready reports runtime_error
+    thread = threading.Thread(target=run, name='runtime-loader', daemon=True)
+    thread.start()
+    return thread
+
+def requires_runtime(view):
+    """Answer 503 with Retry-After until the model and its services are loaded"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not runtime_ready.is_set():
+            response = jsonify({'error': 'Model is still loading', 'success': False})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        return view(*args, **kwargs)
+    return wrapper
+
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT_S', '30'))
+
+# Results keyed by decoded pixels + weights fingerprint, so repeat uploads skip all the work
+result_cache = ResultCache(
+    max_entries=int(os.getenv('RESULT_CACHE_SIZE', '256')),
+    ttl_seconds=float(os.getenv('RESULT_CACHE_TTL_S', '3600')),
+    max_bytes=int(float(os.getenv('RESULT_CACHE_MAX_MB', '256')) * 1024 * 1024),
+    disk_dir=os.getenv('RESULT_CACHE_DIR') or None,
+)
+
+# Doctor dashboard stats: STATS_BACKEND=supabase reads the trigger-maintained aggregates,
+# sqlite keeps the schema and aggregates in a local file (for local runs/tests)
+doctor_stats = DoctorStatsService(
+    create_stats_store(
+        os.getenv('STATS_BACKEND', 'supabase'),
+        supabase_url=SUPABASE_URL,
+        supabase_key=SUPABASE_SERVICE_ROLE_KEY,
+        sqlite_path=os.getenv('STATS_SQLITE_PATH', 'doctor_stats.db'),
+    ),
+    ttl_seconds=float(os.getenv('STATS_CACHE_TTL_S', '30')),
+)
+
+# The doctor behind a stats or scans request comes from their Supabase access token;
+# DOCTOR_AUTH=unverified takes the bearer token as the doctor id (local development only)
+doctor_auth = create_doctor_auth(os.getenv('DOCTOR_AUTH', 'supabase'), SUPABASE_URL, SUPABASE_KEY)
+
+overlay_renderer = OverlayRenderer(max_side=DISPLAY_MAX_SIDE)
+
+# Short-lived in-memory copy of each scan's encoded JPEGs, served by /api/artifacts
+# while (or instead of) the storage upload completes
+ARTIFACT_KINDS = ('original', 'heatmap') + tuple(f"heatmap_{name.lower()}" for name in CLASSES)
+ARTIFACT_TTL_S = int(os.getenv('ARTIFACT_TTL_S', '600'))
+artifact_store = ResultCache(
+    max_entries=int(os.getenv('ARTIFACT_STORE_SIZE', '512')),
+    ttl_seconds=ARTIFACT_TTL_S,
+    max_bytes=int(float(os.getenv('ARTIFACT_STORE_MAX_MB', '128')) * 1024 * 1024),
+)
+
+def store_artifacts(scan_id, **artifacts):
+    for kind, data in artifacts.items():
+        artifact_store.put(f"{scan_id}/{kind}", {'data': data})
+
+def artifact_path(scan_id, kind):
+    return f"/api/artifacts/{scan_id}/{kind}.jpg"
+
+def artifact_fields(scan_id, result, compact):
+    """Image fields of a prediction response.
+    
+    Full mode keeps the original shape, where a failed upload puts the same
+    base64 string in both the URL and the base64 field. Compact mode inlines only
+    the original (and only once); the heatmap is fetched from `heatmap_path`.
+    """
+    if not compact:
+        return {
+            'image_url': result['original_url'] or result['original_base64'],  # Use Supabase URL or fallback to base64
+            'heatmap_url': result['heatmap_url'] or result['heatmap_base64'],  # Use Supabase URL or fallback to base64
+            'image_base64': result['original_base64'],  # Always include base64 for immediate display
+            'heatmap_base64': result['heatmap_base64'],  # Always include base64 for immediate display
+        }
+    return {
+        'image_url': result['original_url'],
+        'image_base64': result['original_base64'],
+        'heatmap_url': result['heatmap_url'] or artifact_path(scan_id, 'heatmap'),
+        'heatmap_path': artifact_path(scan_id, 'heatmap'),
+    }
+
+# Fields of the tuple returned by predict_image/render_prediction, as stored in the result cache
+RESULT_FIELDS = ('prediction', 'confidence', 'original_url', 'heatmap_url', 'original_base64', 'heatmap_base64',
+                 'model_version')
+
+def prepare_input(decoded, roi=None):
+    """The DecodedImage with its model input filled in, cropped to `roi` in `roi` mode.
     
-    # Get class index 
-    class_idx = predicted.item()
-    print(f"Predicted class: {CLASSES[class_idx]} with confidence: {confidence:.2f}%")
+    Built only once validation has passed, so rejected uploads and cache hits skip it.
+    """
+    if decoded.tensor is not None:
+        return decoded
+    if roi is None and preprocessor.mode == 'roi':
+        roi = retinal_roi(decoded.rgb)
+    return decoded._replace(tensor=preprocessor(decoded.rgb, roi))
+
+def predict_image(decoded, scan_id):
+    """Classify a DecodedImage, render its Grad-CAM overlay and queue both for upload.
+    
+    Returns the render_prediction() fields and the ModelVersion that produced them.
+    """
+    logger.debug("Predicting image", extra={'scan_id': scan_id, 'size': decoded.original_size})
+    decoded = prepare_input(decoded)
     
+    # Batched forward + backward pass for class, confidence and Grad-CAM
+    future = scheduler.submit(decoded.tensor.to(device))
     try:
-        # Rerun to compute gradients (no longer in no_grad context)
-        print("Generating heatmap...")
-        heatmap = grad_cam.generate_heatmap(transformed_image, class_idx)
-        
-        # Convert the original image to numpy array
-        img_np = np.array(original_image)
-        
-        # Resize heatmap to match original image size
-        heatmap = cv2.resize(heatmap, (img_np.shape[1], img_np.shape[0]))
-        
-        # Apply colormap to heatmap
-        heatmap_colored = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
-        
-        # Convert BGR to RGB (cv2 uses BGR by default)
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-        
-        # Superimpose the heatmap onto the original image
-        superimposed_img = heatmap_colored * 0.4 + img_np
-        superimposed_img = np.clip(superimposed_img, 0, 255).astype(np.uint8)
-        
-        # Convert images to base64 and upload to Supabase
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        original_filename = f"original_{timestamp}.jpg"
-        heatmap_filename = f"heatmap_{timestamp}.jpg"
-        
-        # Upload to Supabase storage
-        original_url = upload_image_to_supabase(img_np, original_filename, 'retinal-images')
-        heatmap_url = upload_image_to_supabase(superimposed_img, heatmap_filename, 'heatmap-images')
+        with stage('inference_wait'):
+            class_idx, confidence, heatmap = future.result(timeout=INFERENCE_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+    fields = render_prediction(decoded, scan_id, class_idx, confidence, heatmap, future.explainer.fingerprint)
+    return fields, future.explainer
+
+def render_class_overlays(decoded, scan_id, version):
+    """Render an overlay for every class from one forward pass and keep them in the artifact store.
+    
+    `version` is the ModelVersion that diagnosed the scan; the pass runs on it
+    through the batcher. Returns {class name: artifact path}. These overlays are
+    on-demand views and are not uploaded to storage.
+    """
+    future = scheduler.submit_class_heatmaps(prepare_input(decoded).tensor.to(device), version)
+    try:
+        with stage('class_heatmaps_wait'):
+            cams = future.result(timeout=INFERENCE_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+    paths = {}
+    for name, overlay in zip(CLASSES, overlay_renderer.render_classes(decoded.rgb, cams)):
+        kind = f"heatmap_{name.lower()}"
+        store_artifacts(scan_id, **{kind: encode_jpeg(overlay, max_side=DISPLAY_MAX_SIDE)})
+        paths[name] = artifact_path(scan_id, kind)
+    return paths
+
+def render_prediction(decoded, scan_id, class_idx, confidence, heatmap, model_version=None):
+    """Overlay the heatmap on the decoded image and queue both for upload"""
+    logger.debug("Predicted class", extra={'scan_id': scan_id, 'prediction': CLASSES[class_idx],
+                                           'confidence': round(confidence, 2)})
+    
+    # The scan at display resolution, shared by the overlay and the stored original
+    with stage('display_resize'):
+        img_np = overlay_renderer.prepare(decoded.rgb)
+    
+    try:
+        # Colormap and blend the CAM at display resolution (uint8, reused buffers)
+        with stage('overlay'):
+            superimposed_img = overlay_renderer.blend(img_np, heatmap)
         
-        # Also create base64 for immediate display
-        original_base64 = image_to_base64(img_np)
-        heatmap_base64 = image_to_base64(superimposed_img)
+        # Encode each artifact once; the same bytes are uploaded, kept for
+        # /api/artifacts and inlined as base64
+        original_filename, heatmap_filename = artifact_filenames(scan_id)
+        with stage('encode'):
+            original_jpeg = encode_jpeg(img_np, max_side=DISPLAY_MAX_SIDE)
+            heatmap_jpeg = encode_jpeg(superimposed_img, max_side=DISPLAY_MAX_SIDE)
+            original_base64 = jpeg_data_uri(original_jpeg)
+            heatmap_base64 = jpeg_data_uri(heatmap_jpeg)
+        store_artifacts(scan_id, original=original_jpeg, heatmap=heatmap_jpeg)
         
-        print(f"Images uploaded to Supabase successfully")
-        print(f"Original URL: {original_url}")
-        print(f"Heatmap URL: {heatmap_url}")
+        # Queue for background upload (spooled to disk); URLs are returned immediately
+        with stage('upload_enqueue'):
+            original_url = upload_image_to_supabase(original_jpeg, original_filename, 'retinal-images')
+            heatmap_url = upload_image_to_supabase(heatmap_jpeg, heatmap_filename, 'heatmap-images')
         
     except Exception as e:
-        print(f"Error generating heatmap: {e}")
+        logger.exception("Error generating heatmap, using placeholder images", extra={'scan_id': scan_id})
         # If there's an error generating the heatmap, create placeholder images
-        img_np = np.array(original_image)
         placeholder = np.ones(img_np.shape, dtype=np.uint8) * 200  # Light gray
         
         # Use base64 for error cases
@@ -425,37 +727,450 @@ def predict_image(image_path):
         heatmap_url = None
         original_base64 = image_to_base64(img_np)
         heatmap_base64 = image_to_base64(placeholder)
-        print(f"Using placeholder images due to error")
     
-    return CLASSES[class_idx], confidence, original_url, heatmap_url, original_base64, heatmap_base64
+    return CLASSES[class_idx], confidence, original_url, heatmap_url, original_base64, heatmap_base64, model_version
+
+class StreamedPrediction:
+    """A scan submitted to the batcher whose diagnosis is delivered ahead of its explanation.
+    
+    The batcher hands over the class and confidence as soon as the batch's logits
+    exist. After abandon() (the client went away) the Grad-CAM backward pass is
+    skipped unless another scan in the batch needs it, and nothing is rendered or
+    uploaded. Raises QueueFullError like scheduler.submit().
+    """
+    def __init__(self, decoded, scan_id):
+        self.decoded = decoded
+        self.scan_id = scan_id
+        self.result = None
+        self.diagnosis = Future()
+        self._abandoned = threading.Event()
+        self.future = scheduler.submit(decoded.tensor.to(device), on_diagnosis=self._diagnosed)
+    
+    def _diagnosed(self, class_idx, confidence):
+        self.diagnosis.set_result((class_idx, confidence))
+        return not self._abandoned.is_set()
+    
+    @property
+    def abandoned(self):
+        return self._abandoned.is_set()
+    
+    def abandon(self):
+        """Stop whatever work is still pending; a no-op once the prediction has finished"""
+        self._abandoned.set()
+        self.future.cancel()
+
+def diagnosis_line(scan_id, prediction, confidence, model_version, cache_status):
+    return {
+        'type': 'diagnosis',
+        'success': True,
+        'scan_id': scan_id,
+        'prediction': prediction,
+        'confidence': f"{confidence:.2f}%",
+        'model_version': model_version,
+        'cache': cache_status,
+        'timestamp': datetime.now().isoformat(),
+    }
+
+def heatmap_line(scan_id, result, compact):
+    return dict(type='heatmap', scan_id=scan_id, **artifact_fields(scan_id, result, compact))
+
+# How often a WSGI stream waiting on the batcher checks whether its client is still there
+DISCONNECT_POLL_S = 0.25
+
+def client_disconnected(environ):
+    """Whether the client of a WSGI request has closed its connection.
+    
+    A WSGI app only learns of a disconnect when a write fails, so this peeks at
+    the connection gunicorn or werkzeug put in the environ: readable with no data
+    means the peer sent FIN. Servers that expose no socket, and TLS sockets
+    (which cannot be peeked), always count as connected.
+    """
+    import select
+    import socket
+    import ssl
+    
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None or isinstance(sock, ssl.SSLSocket):
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+def wait_connected(futures, disconnected):
+    """wait() for the first of `futures` up to INFERENCE_TIMEOUT; None if `disconnected()` turns true first"""
+    if disconnected is None:
+        done, _ = wait(futures, timeout=INFERENCE_TIMEOUT, return_when=FIRST_COMPLETED)
+        return done
+    deadline = time.monotonic() + INFERENCE_TIMEOUT
+    while True:
+        remaining = deadline - time.monotonic()
+        done, _ = wait(futures, timeout=max(0.0, min(remaining, DISCONNECT_POLL_S)), return_when=FIRST_COMPLETED)
+        if done or remaining <= 0:
+            return done
+        if disconnected():
+            return None
+
+def prediction_events(prediction, version, compact, disconnected=None):
+    """Yield a streamed prediction's `diagnosis` line when the logits exist, then its `heatmap` line.
+    
+    The rendered result is left in prediction.result (and cached like /api/predict does).
+    `disconnected()` is polled while waiting on the batcher (see client_disconnected);
+    once it is true the prediction is abandoned and no further lines are produced.
+    """
+    done = wait_connected([prediction.diagnosis, prediction.future], disconnected)
+    if done is None:
+        prediction.abandon()
+        return
+    if not done:
+        prediction.abandon()
+        raise FutureTimeoutError("Prediction timed out")
+    if prediction.diagnosis.done():
+        class_idx, confidence = prediction.diagnosis.result()
+    else:
+        class_idx, confidence, _ = prediction.future.result()  # The batch failed: raises
+    model_version = prediction.future.explainer.fingerprint
+    yield diagnosis_line(prediction.scan_id, CLASSES[class_idx], confidence, model_version, 'miss')
+    
+    with stage('inference_wait'):
+        done = wait_connected([prediction.future], disconnected)
+    if done is None or (disconnected is not None and disconnected()):
+        prediction.abandon()
+        return
+    _, _, heatmap = prediction.future.result(timeout=0)
+    if heatmap is None or prediction.abandoned:
+        return
+    result = dict(zip(RESULT_FIELDS, render_prediction(prediction.decoded, prediction.scan_id, class_idx, confidence,
+                                                       heatmap, model_version)))
+    if result['heatmap_url'] is not None and result['model_version'] == version.fingerprint:
+        result_cache.put(prediction.scan_id, result)
+    prediction.result = result
+    yield heatmap_line(prediction.scan_id, result, compact)
+
+def cached_prediction_events(scan_id, result, version, compact):
+    """The `diagnosis` and `heatmap` lines of a cached result, both available at once"""
+    yield diagnosis_line(scan_id, result['prediction'], result['confidence'],
+                         result.get('model_version') or version.fingerprint, 'hit')
+    yield heatmap_line(scan_id, result, compact)
+
+def stored_line(scan_id, result, timeout=STREAM_UPLOAD_WAIT):
+    """The `stored` line: the artifact URLs once their uploads have finished, failed or timed out.
+    
+    Upload states are null when this process has no record of the upload (e.g. a
+    cache hit from long ago) or the heatmap could not be rendered.
+    """
+    deadline = time.monotonic() + timeout
+    uploads = {}
+    for name, bucket, key in zip(('original', 'heatmap'), ('retinal-images', 'heatmap-images'),
+                                 artifact_filenames(scan_id)):
+        status = None
+        if result[f"{name}_url"] is not None:
+            with stage('upload_wait'):
+                status = upload_queue.wait(bucket, key, max(0.0, deadline - time.monotonic()))
+        uploads[name] = status['state'] if status else None
+    return {'type': 'stored', 'scan_id': scan_id, 'original_url': result['original_url'],
+            'heatmap_url': result['heatmap_url'], 'uploads': uploads}
+
+# Opt-in per-request profiling: with PROFILING_ENABLED=1, a request carrying
+# `X-Profile: cprofile` or `X-Profile: torch` writes a trace file to PROFILE_DIR
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '0') == '1'
+request_profiler = RequestProfiler(os.getenv('PROFILE_DIR', 'profiles'))
+
+def _model_bytes():
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+def _cuda_allocated_bytes():
+    if device is None or device.type != 'cuda':
+        return None
+    import torch
+    return torch.cuda.memory_allocated(device)
+
+REGISTRY.gauge('optipro_ready', 'Whether the model is loaded and serving', lambda: int(runtime_ready.is_set()))
+REGISTRY.gauge('optipro_model_bytes', 'Memory held by model parameters and buffers', _model_bytes)
+REGISTRY.gauge('optipro_torch_cuda_allocated_bytes', 'CUDA memory allocated by torch', _cuda_allocated_bytes)
+REGISTRY.gauge('optipro_inference_queue_depth', 'Scans waiting for the batcher', lambda: scheduler.stats()['queue_depth'])
+REGISTRY.gauge('optipro_upload_pending', 'Artifacts waiting for upload', lambda: upload_queue.stats()['pending'])
+REGISTRY.gauge('optipro_result_cache_bytes', 'Payload bytes held by the result cache', lambda: result_cache.stats()['bytes'])
+REGISTRY.gauge('optipro_shadow_agreement_ratio', 'Share of sampled scans where the shadow model agrees with the active one',
+               model_registry.shadow_agreement)
+REGISTRY.gauge('optipro_artifact_store_bytes', 'Bytes held by the artifact store', lambda: artifact_store.stats()['bytes'])
+
+@app.before_request
+def start_request_instrumentation():
+    g.request_start = time.perf_counter()
+    g.spans_token = begin_request_spans()
+    g.profile = None
+    mode = request.headers.get('X-Profile')
+    if PROFILING_ENABLED and mode:
+        try:
+            g.profile = request_profiler.start(mode)
+        except Exception as e:
+            logger.warning("Could not start profiler", extra={'mode': mode, 'error': str(e)})
+
+@app.after_request
+def finish_request_instrumentation(response):
+    # For streamed responses (batch NDJSON) this covers the time to the first byte
+    if 'request_start' not in g:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=response.status_code)
+    timing = server_timing(end_request_spans(g.pop('spans_token')))
+    if timing:
+        response.headers['Server-Timing'] = timing
+    if g.profile is not None:
+        path = request_profiler.stop(g.pop('profile'), request.endpoint or 'request')
+        response.headers['X-Profile-Trace'] = os.path.basename(path)
+        logger.info("Wrote request profile", extra={'path': path, 'endpoint': endpoint})
+    return response
+
+@app.teardown_request
+def cleanup_request_instrumentation(exc):
+    # after_request is skipped when a view raises; never leave the profiler locked
+    if g.get('profile') is not None:
+        request_profiler.stop(g.pop('profile'), request.endpoint or 'request')
+    if 'spans_token' in g:
+        end_request_spans(g.pop('spans_token'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for this process (each gunicorn worker reports its own)"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def health_status():
+    response = {'status': 'healthy', 'ready': runtime_ready.is_set()}
+    if runtime_ready.is_set():
+        response['inference_backend'] = inference_backend.name
+        response['model_version'] = MODEL_FINGERPRINT
+        response['gradcam_hooks'] = explainer.hook_count
+    return response
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'})
+    # Liveness only: answers as soon as Flask is up, before the model has loaded
+    return jsonify(health_status())
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    if runtime_ready.is_set():
+        return jsonify({'status': 'ready', 'startup_timings': STARTUP_TIMINGS})
+    status = 'error' if runtime_error else 'loading'
+    return jsonify({'status': status, 'error': runtime_error, 'startup_timings': STARTUP_TIMINGS}), 503
+
+@app.route('/api/inference/stats', methods=['GET'])
+@requires_runtime
+def inference_stats():
+    return jsonify(scheduler.stats())
+
+# Model admin endpoints are disabled unless MODEL_ADMIN_TOKEN is set. They act on the
+# worker process that receives the request; use MODEL_RELOAD_POLL_S to reload every worker.
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')
+
+def requires_admin_token(view):
+    """Answer 403 unless the request carries `Authorization: Bearer <MODEL_ADMIN_TOKEN>`"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not MODEL_ADMIN_TOKEN:
+            return jsonify({'error': 'Model admin API is disabled (set MODEL_ADMIN_TOKEN)'}), 403
+        if request.headers.get('Authorization') != f"Bearer {MODEL_ADMIN_TOKEN}":
+            return jsonify({'error': 'Invalid admin token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/models', methods=['GET'])
+@requires_runtime
+def model_status():
+    """Active and shadow model versions of this worker, with shadow agreement and latency deltas"""
+    return jsonify(model_registry.stats())
+
+@app.route('/api/models/reload', methods=['POST'])
+@requires_runtime
+@requires_admin_token
+def reload_model():
+    """Load `path` (default MODEL_WEIGHTS) in the background and swap it in, or run it as a shadow"""
+    data = request.get_json(silent=True) or {}
+    path = data.get('path') or MODEL_WEIGHTS_PATH
+    if not os.path.exists(path):
+        return jsonify({'error': f"Weights file not found: {path}"}), 400
+    if not model_registry.load(path, shadow=bool(data.get('shadow'))):
+        return jsonify({'error': 'A model is already loading', 'loading': model_registry.stats()['loading']}), 409
+    return jsonify({'status': 'loading', 'path': path, 'shadow': bool(data.get('shadow'))}), 202
+
+@app.route('/api/models/promote', methods=['POST'])
+@requires_runtime
+@requires_admin_token
+def promote_shadow_model():
+    version = model_registry.promote_shadow()
+    if version is None:
+        return jsonify({'error': 'No shadow model to promote'}), 409
+    return jsonify({'status': 'active', **version.describe()})
+
+@app.route('/api/models/shadow', methods=['DELETE'])
+@requires_runtime
+@requires_admin_token
+def drop_shadow_model():
+    model_registry.set_shadow(None)
+    return jsonify({'status': 'removed'})
+
+@app.route('/api/uploads/<bucket>/<path:key>', methods=['GET'])
+@requires_runtime
+def upload_status(bucket, key):
+    status = upload_queue.status(bucket, key)
+    if status is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    return jsonify(status)
+
+@app.route('/api/artifacts/<scan_id>/<kind>.jpg', methods=['GET'])
+def get_artifact(scan_id, kind):
+    """Serve a scan's encoded JPEG from the artifact store (or the result cache).
+    
+    Artifacts are addressed by content, so the ETag never changes for a given
+    URL; conditional and Range requests are answered by send_file.
+    """
+    if kind not in ARTIFACT_KINDS:
+        return jsonify({'error': 'Unknown artifact'}), 404
+    entry = artifact_store.get(f"{scan_id}/{kind}")
+    if entry is not None:
+        data = entry['data']
+    else:
+        result = result_cache.get(scan_id)
+        if result is None or not result.get(f"{kind}_base64"):
+            return jsonify({'error': 'Artifact not found or expired'}), 404
+        data = data_uri_bytes(result[f"{kind}_base64"])
+    return send_file(BytesIO(data), mimetype='image/jpeg', etag=f"{scan_id}-{kind}",
+                     conditional=True, max_age=ARTIFACT_TTL_S)
+
+@app.route('/api/samples', methods=['GET'])
+def list_samples():
+    """Example scans referenced by rejected uploads; revalidated with the catalog's ETag"""
+    response = jsonify({'sample_images': sample_images.references(sample_image_path)})
+    response.set_etag(sample_images.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
+@app.route('/api/samples/<sample_id>.jpg', methods=['GET'])
+def get_sample(sample_id):
+    sample = sample_images.get(sample_id)
+    if sample is None:
+        return jsonify({'error': 'Unknown sample image'}), 404
+    return send_file(BytesIO(sample['data']), mimetype='image/jpeg', etag=sample['etag'],
+                     conditional=True, max_age=300)
+
+@app.route('/api/evaluation', methods=['GET'])
+def get_evaluation():
+    """Latest offline evaluation report written by scripts/evaluate.py"""
+    if not os.path.exists(EVALUATION_RESULTS_PATH):
+        return jsonify({'error': 'No evaluation results yet; run scripts/evaluate.py'}), 404
+    return send_file(os.path.abspath(EVALUATION_RESULTS_PATH), mimetype='application/json', conditional=True, max_age=60)
 
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = result_cache.stats()
+    stats['artifacts'] = artifact_store.stats()
+    return jsonify(stats)
+
+@app.route('/api/uploads', methods=['GET'])
+@requires_runtime
+def upload_stats():
+    return jsonify(upload_queue.stats())
+
+def authenticate_doctor(authorization):
+    """Doctor id for an `Authorization: Bearer <access token>` header value, or None"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return doctor_auth.doctor_id(token.strip())
+
+def requires_doctor(view):
+    """Answer 401 unless the request carries a valid doctor access token; sets g.doctor_id"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            doctor_id = authenticate_doctor(request.headers.get('Authorization'))
+        except Exception:
+            logger.exception("Error verifying doctor token")
+            return jsonify({'error': 'Could not verify access token'}), 503
+        if doctor_id is None:
+            return jsonify({'error': 'Sign in required'}), 401
+        g.doctor_id = doctor_id
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/doctor/stats', methods=['GET'])
 @app.route('/api/doctor/stats/<doctor_id>', methods=['GET'])
-def get_doctor_stats(doctor_id):
-  
+@requires_doctor
+def get_doctor_stats(doctor_id=None):
+    # The path id is optional and must match the token; served from the per-doctor
+    # aggregates (O(1) in the doctor's history) via a short TTL cache
+    if doctor_id is not None and doctor_id != g.doctor_id:
+        return jsonify({'error': "Cannot read another doctor's stats"}), 403
     try:
-        
-        stats = {
-            'total_patients': 15,
-            'total_scans': 42,
-            'recent_analysis': 8,
-            'scan_distribution': {
-                'CNV': 8,
-                'DME': 12,
-                'DRUSEN': 15,
-                'NORMAL': 7
-            }
-        }
-        return jsonify(stats)
+        return jsonify(doctor_stats.get(g.doctor_id))
     except Exception as e:
+        logger.exception("Error loading doctor stats", extra={'doctor_id': g.doctor_id})
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/scans', methods=['POST'])
+@requires_doctor
+def record_scan():
+    """Record a scan result for the signed-in doctor; their aggregates are updated in the same write"""
+    data = request.get_json(silent=True) or {}
+    missing = [field for field in ('patient_id', 'diagnosis') if not data.get(field)]
+    if missing:
+        return jsonify({'error': f"Missing fields: {', '.join(missing)}"}), 400
+    if data.get('doctor_id') and data['doctor_id'] != g.doctor_id:
+        return jsonify({'error': "Cannot record scans for another doctor"}), 403
+    if data['diagnosis'] not in CLASSES:
+        return jsonify({'error': f"diagnosis must be one of {', '.join(CLASSES)}"}), 400
+    
+    fields = ('patient_id', 'diagnosis', 'confidence', 'image_url', 'heatmap_url', 'doctor_notes', 'scan_date')
+    scan = {field: data[field] for field in fields if data.get(field) is not None}
+    scan['doctor_id'] = g.doctor_id
+    scan['id'] = data.get('id') or str(uuid.uuid4())
+    try:
+        doctor_stats.record_scan(scan)
+    except PermissionError as e:
+        return jsonify({'error': str(e), 'success': False}), 403
+    except Exception as e:
+        logger.exception("Error recording scan")
+        return jsonify({'error': str(e), 'success': False}), 500
+    return jsonify({'success': True, 'id': scan['id']}), 201
+
+def invalid_image_body(validation_message):
+    """400 body for an upload that is not a retinal scan; the samples are referenced, not inlined"""
+    return {
+        'success': False,
+        'error': 'Invalid retinal image',
+        'message': validation_message,
+        'details': 'Please upload a valid retinal scan image. Retinal images should show a circular view of the back of the eye with visible blood vessels.',
+        'sample_images': sample_images.references(sample_image_path),
+        'samples_url': '/api/samples',
+    }
+
+def prediction_body(scan_id, result, cache_status, version, compact):
+    """/api/predict response body for a prediction result (fresh or cached)"""
+    original_filename, heatmap_filename = artifact_filenames(scan_id)
+    body = {
+        'success': True,
+        'prediction': result['prediction'],
+        'confidence': f"{result['confidence']:.2f}%",
+        'timestamp': datetime.now().isoformat(),
+        'scan_id': scan_id,
+        'model_version': result.get('model_version') or version.fingerprint,
+        'cache': cache_status,
+        'uploads': {
+            'original': f"/api/uploads/retinal-images/{original_filename}",
+            'heatmap': f"/api/uploads/heatmap-images/{heatmap_filename}",
+        },
+    }
+    body.update(artifact_fields(scan_id, result, compact))
+    return body
+
 @app.route('/api/predict', methods=['POST'])
+@requires_runtime
 def predict():
-    print("Received prediction request")
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -468,51 +1183,50 @@ def predict():
     
     if file:
         try:
-            # Create temporary file for processing (no permanent storage)
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-                file.save(temp_file.name)
-                temp_path = temp_file.name
+            # Decode the upload once, in memory (no filesystem I/O)
+            try:
+                decoded = decode_image(file.stream, max_side=MAX_DECODE_SIDE)
+            except Exception as e:
+                logger.info("Error decoding uploaded image", extra={'error': str(e)})
+                decoded = None
+                is_valid, validation_message = False, f"Error processing image: {str(e)}"
             
-            print(f"Processing temporary file: {temp_path}")
+            # Identical pixels under the same weights always give the same result
+            version = scan_version = model_registry.active
+            if decoded is not None:
+                scan_id = image_digest(decoded.rgb, version.result_fingerprint)
+                result = result_cache.get(scan_id)
+            else:
+                result = None
+            cache_status = 'hit' if result is not None else 'miss'
             
-            # VALIDATE: Check if the image is a retinal scan
-            is_valid, validation_message = validate_retinal_image(temp_path)
+            # VALIDATE: Check if the image is a retinal scan (cached results were already valid)
+            if result is None and decoded is not None:
+                with stage('validate'):
+                    is_valid, validation_message, roi = validate_retinal_region(decoded.rgb)
             
-            if not is_valid:
-                print(f"Invalid retinal image: {validation_message}")
-                # Clean up temporary file
-                os.unlink(temp_path)
-                
-                # Get sample images to show user
-                sample_images = get_sample_retinal_images()
-                
-                return jsonify({
-                    'success': False,
-                    'error': 'Invalid retinal image',
-                    'message': validation_message,
-                    'details': 'Please upload a valid retinal scan image. Retinal images should show a circular view of the back of the eye with visible blood vessels.',
-                    'sample_images': sample_images
-                }), 400
+            if result is None and not is_valid:
+                logger.info("Invalid retinal image", extra={'reason': validation_message})
+                return jsonify(invalid_image_body(validation_message)), 400
             
-            print(f"Valid retinal image: {validation_message}")
+            if result is None:
+                decoded = prepare_input(decoded, roi)
+                # Get prediction, URLs, and base64 images
+                fields, scan_version = predict_image(decoded, scan_id)
+                result = dict(zip(RESULT_FIELDS, fields))
+                # Placeholder results (heatmap failed) are not worth keeping, nor are results
+                # from a version that was swapped in after scan_id was computed
+                if result['heatmap_url'] is not None and result['model_version'] == version.fingerprint:
+                    result_cache.put(scan_id, result)
+            else:
+                logger.debug("Serving cached result", extra={'scan_id': scan_id})
             
-            # Get prediction, URLs, and base64 images
-            prediction, confidence, original_url, heatmap_url, original_base64, heatmap_base64 = predict_image(temp_path)
+            compact = request.values.get('response_mode', RESPONSE_MODE) == 'compact'
+            response_data = prediction_body(scan_id, result, cache_status, version, compact)
             
-            # Clean up temporary file
-            os.unlink(temp_path)
-            
-            response_data = {
-                'success': True,
-                'prediction': prediction,
-                'confidence': f"{confidence:.2f}%",
-                'image_url': original_url or original_base64,  # Use Supabase URL or fallback to base64
-                'heatmap_url': heatmap_url or heatmap_base64,  # Use Supabase URL or fallback to base64
-                'image_base64': original_base64,  # Always include base64 for immediate display
-                'heatmap_base64': heatmap_base64,  # Always include base64 for immediate display
-                'timestamp': datetime.now().isoformat()
-            }
+            # Optional per-class overlays, fetched from /api/artifacts
+            if request.values.get('overlays') == 'all':
+                response_data['class_heatmaps'] = render_class_overlays(decoded, scan_id, scan_version)
             
             # Add patient info if provided
             if patient_id:
@@ -522,12 +1236,331 @@ def predict():
                 
             return jsonify(response_data)
             
+        except QueueFullError as e:
+            logger.warning("Inference queue full, rejecting request", extra={'retry_after': e.retry_after})
+            response = jsonify({'error': 'Server is busy, please retry shortly', 'success': False})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
         except Exception as e:
-            print(f"Error during prediction: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error during prediction")
             return jsonify({'error': str(e), 'success': False}), 500
 
+@app.route('/api/predict/stream', methods=['POST'])
+@requires_runtime
+def predict_stream():
+    """/api/predict as NDJSON lines, each written as soon as its stage finishes.
+    
+    `diagnosis` (prediction and confidence, right after the forward pass), then
+    `heatmap` (the images, as /api/predict returns them), then `stored` (the
+    artifact URLs once uploaded). Errors after the stream has started arrive as an
+    `error` line. The client's connection is checked while the scan waits on the
+    batcher, since a WSGI server only notices a disconnect when a write fails: a
+    client gone before its diagnosis skips the Grad-CAM pass, and one gone before
+    its heatmap skips rendering and uploads.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    extra = {field: request.form[field] for field in ('patient_id', 'doctor_id') if request.form.get(field)}
+    compact = request.values.get('response_mode', RESPONSE_MODE) == 'compact'
+    
+    try:
+        decoded = decode_image(file.stream, max_side=MAX_DECODE_SIDE)
+    except Exception as e:
+        logger.info("Error decoding uploaded image", extra={'error': str(e)})
+        return jsonify(invalid_image_body(f"Error processing image: {str(e)}")), 400
+    
+    version = model_registry.active
+    scan_id = image_digest(decoded.rgb, version.result_fingerprint)
+    result = result_cache.get(scan_id)
+    prediction = None
+    if result is None:
+        with stage('validate'):
+            is_valid, validation_message, roi = validate_retinal_region(decoded.rgb)
+        if not is_valid:
+            logger.info("Invalid retinal image", extra={'reason': validation_message})
+            return jsonify(invalid_image_body(validation_message)), 400
+        try:
+            prediction = StreamedPrediction(prepare_input(decoded, roi), scan_id)
+        except QueueFullError as e:
+            logger.warning("Inference queue full, rejecting request", extra={'retry_after': e.retry_after})
+            response = jsonify({'error': 'Server is busy, please retry shortly', 'success': False})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 503
+    
+    environ = request.environ
+    
+    def generate():
+        try:
+            if prediction is None:
+                lines = cached_prediction_events(scan_id, result, version, compact)
+            else:
+                lines = prediction_events(prediction, version, compact,
+                                          disconnected=functools.partial(client_disconnected, environ))
+            for line in lines:
+                yield json.dumps(dict(line, **extra)) + '\n'
+            final = result if prediction is None else prediction.result
+            if final is not None:
+                yield json.dumps(dict(stored_line(scan_id, final), **extra)) + '\n'
+        except Exception as e:
+            logger.exception("Error during streamed prediction", extra={'scan_id': scan_id})
+            yield json.dumps({'type': 'error', 'success': False, 'scan_id': scan_id, 'error': str(e)}) + '\n'
+        finally:
+            # Reached early (GeneratorExit) when the client has gone away
+            if prediction is not None:
+                prediction.abandon()
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Bulk study processing: many B-scans per request, streamed back as NDJSON
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '500'))
+BATCH_MAX_IMAGE_BYTES = 32 * 1024 * 1024  # Uncompressed size limit for a single archive entry
+app.config['ENDPOINT_MAX_CONTENT_LENGTH'] = {
+    'predict_batch': int(os.getenv('BATCH_MAX_UPLOAD_MB', '256')) * 1024 * 1024,
+}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+def read_batch_uploads(files):
+    """(filename, bytes) for every non-empty uploaded file.
+    
+    Taken before the response starts streaming: Werkzeug closes the request's
+    files once the view returns, long before the generator gets to them.
+    InMemoryRequest parses each part into a BytesIO, whose getvalue() hands
+    over its buffer without a copy (read() would copy up to the batch cap).
+    """
+    uploads = []
+    for file in files:
+        if not file or file.filename == '':
+            continue
+        try:
+            if isinstance(file.stream, BytesIO):
+                uploads.append((file.filename, file.stream.getvalue()))
+            else:
+                uploads.append((file.filename, file.read()))
+        except (OSError, ValueError) as e:
+            uploads.append((file.filename, e))
+    return uploads
+
+def iter_batch_uploads(uploads):
+    """Yield (filename, stream, error) for every uploaded image, expanding zip archives.
+    
+    A file or archive entry that cannot be read gets an error instead of ending the study.
+    """
+    for filename, data in uploads:
+        if isinstance(data, Exception):
+            yield filename, None, f"Could not read upload: {str(data)}"
+            continue
+        if not filename.lower().endswith('.zip'):
+            yield filename, BytesIO(data), None
+            continue
+        try:
+            archive = zipfile.ZipFile(BytesIO(data))
+            entries = archive.infolist()
+        except (zipfile.BadZipFile, ValueError, OSError) as e:
+            yield filename, None, f"Invalid zip archive: {str(e)}"
+            continue
+        with archive:
+            for info in entries:
+                name = info.filename
+                if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                    continue
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                if info.file_size > BATCH_MAX_IMAGE_BYTES:
+                    yield name, None, "Image too large"
+                    continue
+                try:
+                    data = archive.read(info)
+                except Exception as e:  # Corrupt, encrypted or unsupported entries
+                    yield name, None, f"Could not read archive entry: {str(e)}"
+                    continue
+                yield name, BytesIO(data), None
+
+def batch_result_line(index, filename, scan_id, result, cache_status, include_images):
+    line = {
+        'type': 'result',
+        'index': index,
+        'filename': filename,
+        'success': True,
+        'scan_id': scan_id,
+        'prediction': result['prediction'],
+        'confidence': f"{result['confidence']:.2f}%",
+        'image_url': result['original_url'] or artifact_path(scan_id, 'original'),
+        'heatmap_url': result['heatmap_url'] or artifact_path(scan_id, 'heatmap'),
+        'heatmap_path': artifact_path(scan_id, 'heatmap'),
+        'model_version': result.get('model_version'),
+        'cache': cache_status,
+    }
+    if include_images:
+        line['image_base64'] = result['original_base64']
+        line['heatmap_base64'] = result['heatmap_base64']
+    return line, result['confidence']
+
+def batch_error_line(index, filename, message):
+    return {'type': 'result', 'index': index, 'filename': filename, 'success': False, 'error': message}, None
+
+@app.route('/api/predict/batch', methods=['POST'])
+@requires_runtime
+def predict_batch():
+    """Process a study (several files and/or zip archives) and stream one NDJSON line per image.
+    
+    Scans are validated as they are decoded and handed to the batcher, so they run
+    in batched tensors; each line is written as soon as its scan finishes. Failed
+    images get an error line and do not stop the study. The final line is a
+    summary with the class distribution and the highest-confidence finding
+    (the most confident non-NORMAL prediction).
+    """
+    uploads = read_batch_uploads(request.files.getlist('files') + request.files.getlist('file'))
+    if not uploads:
+        return jsonify({'error': 'No files uploaded'}), 400
+    include_images = request.form.get('include_images', '').lower() in ('1', 'true', 'yes')
+    patient_id = request.form.get('patient_id', None)
+    doctor_id = request.form.get('doctor_id', None)
+    logger.info("Received batch prediction request", extra={'uploads': len(uploads)})
+    
+    def generate():
+        summary = {
+            'type': 'summary',
+            'total': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'class_distribution': {name: 0 for name in CLASSES},
+            'max_confidence_finding': None,
+        }
+        best_confidence = -1.0
+        version = model_registry.active  # The whole study is keyed to one version
+        pending = {}  # future -> (index, filename, decoded, scan_id)
+        window = max(1, scheduler.max_batch_size * 2)
+        
+        def record(entry):
+            nonlocal best_confidence
+            line, confidence = entry
+            summary['total'] += 1
+            if line['success']:
+                summary['succeeded'] += 1
+                summary['class_distribution'][line['prediction']] += 1
+                if line['prediction'] != 'NORMAL' and confidence > best_confidence:
+                    best_confidence = confidence
+                    summary['max_confidence_finding'] = {
+                        key: line[key] for key in ('index', 'filename', 'scan_id', 'prediction', 'confidence')
+                    }
+            else:
+                summary['failed'] += 1
+            return json.dumps(line) + '\n'
+        
+        def finish(future):
+            index, filename, decoded, scan_id = pending.pop(future)
+            try:
+                class_idx, confidence, heatmap = future.result()
+                result = dict(zip(RESULT_FIELDS, render_prediction(decoded, scan_id, class_idx, confidence, heatmap,
+                                                                   future.explainer.fingerprint)))
+                if result['heatmap_url'] is not None and result['model_version'] == version.fingerprint:
+                    result_cache.put(scan_id, result)
+                return batch_result_line(index, filename, scan_id, result, 'miss', include_images)
+            except Exception as e:
+                return batch_error_line(index, filename, str(e))
+        
+        def drain(limit):
+            """Emit finished scans, blocking until at most `limit` are still in flight"""
+            while pending:
+                done = [future for future in pending if future.done()]
+                if not done and len(pending) > limit:
+                    done, _ = wait(list(pending), timeout=INFERENCE_TIMEOUT, return_when=FIRST_COMPLETED)
+                    if not done:
+                        for future in list(pending):
+                            future.cancel()
+                            index, filename, _, _ = pending.pop(future)
+                            yield record(batch_error_line(index, filename, 'Inference timed out'))
+                        return
+                if not done:
+                    return
+                for future in done:
+                    yield record(finish(future))
+        
+        for index, (filename, stream, error) in enumerate(iter_batch_uploads(uploads)):
+            if index >= BATCH_MAX_IMAGES:
+                yield record(batch_error_line(index, filename, f"Study exceeds {BATCH_MAX_IMAGES} images; remaining images skipped"))
+                break
+            
+            decoded = None
+            if error is None:
+                try:
+                    decoded = decode_image(stream, max_side=MAX_DECODE_SIDE)
+                except Exception as e:
+                    error = f"Error processing image: {str(e)}"
+            if error is not None:
+                yield record(batch_error_line(index, filename, error))
+                continue
+            
+            scan_id = image_digest(decoded.rgb, version.result_fingerprint)
+            cached = result_cache.get(scan_id)
+            if cached is not None:
+                cached = dict(cached, model_version=cached.get('model_version') or version.fingerprint)
+                yield record(batch_result_line(index, filename, scan_id, cached, 'hit', include_images))
+                continue
+            
+            with stage('validate'):
+                is_valid, validation_message, roi = validate_retinal_region(decoded.rgb)
+            if not is_valid:
+                yield record(batch_error_line(index, filename, validation_message))
+                continue
+            decoded = prepare_input(decoded, roi)
+            
+            # Hand the scan to the batcher; if the queue is full, wait for our own scans to drain
+            deadline = time.monotonic() + INFERENCE_TIMEOUT
+            future = None
+            while future is None:
+                try:
+                    future = scheduler.submit(decoded.tensor.to(device))
+                except QueueFullError:
+                    if time.monotonic() > deadline:
+                        break
+                    if pending:
+                        yield from drain(len(pending) - 1)
+                    else:
+                        time.sleep(0.05)
+            if future is None:
+                yield record(batch_error_line(index, filename, 'Server is busy, scan was not processed'))
+                continue
+            pending[future] = (index, filename, decoded, scan_id)
+            
+            yield from drain(window - 1)
+        
+        yield from drain(0)
+        
+        if patient_id:
+            summary['patient_id'] = patient_id
+        if doctor_id:
+            summary['doctor_id'] = doctor_id
+        summary['timestamp'] = datetime.now().isoformat()
+        logger.info("Batch finished", extra={'succeeded': summary['succeeded'], 'failed': summary['failed']})
+        yield json.dumps(summary) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'  # Let reverse proxies pass lines through as they are written
+    return response
+
+STARTUP_TIMINGS['app_import'] = round(time.perf_counter() - _PROCESS_START, 3)
+
+# MODEL_LOAD_MODE=sync loads the model during import (scripts), prefork loads it
+# without starting any threads (see gunicorn.conf.py), manual leaves loading to the
+# importer (offline tools), and the default loads it in the background so health
+# checks answer immediately.
+MODEL_LOAD_MODE = os.getenv('MODEL_LOAD_MODE', 'background')
+if MODEL_LOAD_MODE == 'sync':
+    load_runtime()
+elif MODEL_LOAD_MODE == 'prefork':
+    load_runtime(start=False)
+elif MODEL_LOAD_MODE == 'manual':
+    pass
+else:
+    start_background_loading()
+
 if __name__ == '__main__':
-    print("Starting Flask API server...")
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    logger.info("Starting Flask API server")
+    # The reloader would re-import this module in a child process and load the model twice
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', use_reloader=False, host='0.0.0.0', port=5000)
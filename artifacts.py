@@ -0,0 +1,39 @@
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+# Artifacts are encoded at most this large on their longest side
+DISPLAY_MAX_SIDE = 1024
+JPEG_QUALITY = 90
+
+
+def encode_jpeg(image_array, max_side=DISPLAY_MAX_SIDE, quality=JPEG_QUALITY):
+    """Encode a uint8 RGB or grayscale array as JPEG bytes, shrunk to max_side first.
+
+    The same bytes are spooled for upload and, when needed, inlined as a data
+    URI, so every artifact is encoded exactly once per prediction.
+    """
+    if image_array.ndim == 3 and image_array.shape[2] == 3:
+        pil_image = Image.fromarray(image_array.astype('uint8'), 'RGB')
+    else:
+        pil_image = Image.fromarray(image_array.astype('uint8'), 'L')
+
+    if max_side and max(pil_image.size) > max_side:
+        scale = max_side / float(max(pil_image.size))
+        size = (max(1, int(round(pil_image.width * scale))), max(1, int(round(pil_image.height * scale))))
+        pil_image = pil_image.resize(size, Image.BILINEAR)
+
+    buffer = BytesIO()
+    pil_image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def jpeg_data_uri(data):
+    """Inline JPEG bytes as a data URI for immediate display"""
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode('ascii')
+
+
+def data_uri_bytes(uri):
+    """Inverse of jpeg_data_uri"""
+    return base64.b64decode(uri.split(',', 1)[1])
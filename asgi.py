@@ -0,0 +1,412 @@
+"""ASGI serving mode: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+Serves /api/health, /api/predict, /api/predict/stream and
+/api/doctor/stats/<doctor_id> natively on an event loop, with the same request
+and response contract as the Flask app:
+
+  * uploads are parsed from the request stream into memory as they arrive, so
+    a slow client holds a coroutine rather than a worker thread
+  * decoding, validation, rendering and encoding run on a bounded thread pool
+    (ASYNC_CPU_WORKERS); inference goes through the same micro-batcher
+  * artifact uploads are drained by asyncio tasks through an httpx client
+  * each request has a deadline (ASYNC_REQUEST_TIMEOUT_S), and a client that
+    disconnects cancels its request, including its queued inference
+
+Every other route is served by the Flask app on a thread. Needs the optional
+starlette, uvicorn, httpx and python-multipart packages.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager
+from io import BytesIO
+
+os.environ.setdefault('MODEL_LOAD_MODE', 'manual')
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware import Middleware  # noqa: E402
+from starlette.middleware.cors import CORSMiddleware  # noqa: E402
+from starlette.responses import JSONResponse, Response, StreamingResponse  # noqa: E402
+from starlette.routing import Mount, Route  # noqa: E402
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header  # noqa: E402
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header  # noqa: E402
+
+try:
+    from a2wsgi import WSGIMiddleware  # noqa: E402
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware  # noqa: E402
+
+import app as service  # noqa: E402
+from inference_scheduler import QueueFullError  # noqa: E402
+from observability import (REQUEST_SECONDS, begin_request_spans, end_request_spans, observe_stage,  # noqa: E402
+                           server_timing)
+from storage_queue import AsyncSupabaseStorageBackend  # noqa: E402
+
+logger = logging.getLogger('optipro.asgi')
+
+ASYNC_CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', str(os.cpu_count() or 4)))
+ASYNC_REQUEST_TIMEOUT = float(os.getenv('ASYNC_REQUEST_TIMEOUT_S', '60'))
+DISCONNECT_POLL_S = 0.25
+
+cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class UploadForm:
+    """A multipart form read into memory: text fields and (filename, bytes) files"""
+
+    def __init__(self):
+        self.fields = {}
+        self.files = {}
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+
+async def read_multipart(request, max_bytes):
+    """Parse a multipart body chunk by chunk as it arrives, enforcing `max_bytes`"""
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in params:
+        raise RequestError(400, 'No file part')
+    declared = request.headers.get('content-length')
+    if declared and declared.isdigit() and int(declared) > max_bytes:
+        raise RequestError(413, 'Upload too large')
+
+    form = UploadForm()
+    part = {}
+    header = {'field': b'', 'value': b''}
+
+    def on_part_begin():
+        part.clear()
+        part['headers'] = {}
+        part['data'] = BytesIO()
+
+    def on_header_field(data, start, end):
+        header['field'] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header['value'] += data[start:end]
+
+    def on_header_end():
+        part['headers'][header['field'].lower()] = header['value']
+        header['field'], header['value'] = b'', b''
+
+    def on_part_data(data, start, end):
+        part['data'].write(data[start:end])
+
+    def on_part_end():
+        _, options = parse_options_header(part['headers'].get(b'content-disposition', b''))
+        name = options.get(b'name', b'').decode('utf-8', 'replace')
+        if b'filename' in options:
+            form.files[name] = (options[b'filename'].decode('utf-8', 'replace'), part['data'].getvalue())
+        else:
+            form.fields[name] = part['data'].getvalue().decode('utf-8', 'replace')
+
+    parser = MultipartParser(params[b'boundary'], {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise RequestError(413, 'Upload too large')
+        parser.write(chunk)
+    parser.finalize()
+    return form
+
+
+async def run_cpu(fn, *args):
+    """Run blocking work on the bounded CPU pool, keeping the request's stage spans"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, functools.partial(context.run, fn, *args))
+
+
+def validate_scan(decoded):
+    """Validate an upload; returns (is_valid, message, decoded with its model input prepared)"""
+    with service.stage('validate'):
+        is_valid, message, roi = service.validate_retinal_region(decoded.rgb)
+    if is_valid:
+        decoded = service.prepare_input(decoded, roi)
+    return is_valid, message, decoded
+
+
+async def cancel_on_disconnect(request, coro):
+    """Await `coro`, cancelling it if the client goes away first; returns None in that case"""
+    task = asyncio.ensure_future(coro)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            logger.info("Client disconnected, cancelled request", extra={'path': request.url.path})
+            return None
+
+
+def instrumented(endpoint):
+    """Request latency histogram and Server-Timing header, as in the Flask app"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            start = time.perf_counter()
+            token = begin_request_spans()
+            try:
+                response = await handler(request)
+            finally:
+                spans = end_request_spans(token)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=response.status_code)
+            timing = server_timing(spans)
+            if timing:
+                response.headers['Server-Timing'] = timing
+            return response
+        return wrapper
+    return decorator
+
+
+def not_ready():
+    return JSONResponse({'error': 'Model is still loading', 'success': False}, 503, headers={'Retry-After': '5'})
+
+
+@instrumented('/api/health')
+async def health(request):
+    return JSONResponse(service.health_status())
+
+
+@instrumented('/api/doctor/stats/<doctor_id>')
+async def doctor_stats(request):
+    try:
+        doctor_id = await asyncio.to_thread(service.authenticate_doctor, request.headers.get('authorization'))
+    except Exception:
+        logger.exception("Error verifying doctor token")
+        return JSONResponse({'error': 'Could not verify access token'}, 503)
+    if doctor_id is None:
+        return JSONResponse({'error': 'Sign in required'}, 401)
+    if request.path_params.get('doctor_id', doctor_id) != doctor_id:
+        return JSONResponse({'error': "Cannot read another doctor's stats"}, 403)
+    try:
+        stats = await asyncio.to_thread(service.doctor_stats.get, doctor_id)
+    except Exception as e:
+        logger.exception("Error loading doctor stats", extra={'doctor_id': doctor_id})
+        return JSONResponse({'error': str(e)}, 500)
+    return JSONResponse(stats)
+
+
+async def predict_upload(form, data):
+    """Decode, validate, infer and render one upload; returns (status, body)"""
+    try:
+        decoded = await run_cpu(functools.partial(service.decode_image, BytesIO(data),
+                                                  max_side=service.MAX_DECODE_SIDE))
+    except Exception as e:
+        logger.info("Error decoding uploaded image", extra={'error': str(e)})
+        return 400, service.invalid_image_body(f"Error processing image: {str(e)}")
+
+    version = scan_version = service.model_registry.active
+    scan_id = service.image_digest(decoded.rgb, version.result_fingerprint)
+    result = service.result_cache.get(scan_id)
+    cache_status = 'hit' if result is not None else 'miss'
+
+    if result is None:
+        is_valid, validation_message, decoded = await run_cpu(validate_scan, decoded)
+        if not is_valid:
+            logger.info("Invalid retinal image", extra={'reason': validation_message})
+            return 400, service.invalid_image_body(validation_message)
+
+        # Cancelling this coroutine (timeout or disconnect) cancels the queued inference too
+        future = service.scheduler.submit(decoded.tensor.to(service.device))
+        start = time.perf_counter()
+        try:
+            class_idx, confidence, heatmap = await asyncio.wrap_future(future)
+        finally:
+            observe_stage('inference_wait', time.perf_counter() - start)
+        result = dict(zip(service.RESULT_FIELDS, await run_cpu(
+            service.render_prediction, decoded, scan_id, class_idx, confidence, heatmap,
+            future.explainer.fingerprint)))
+        scan_version = future.explainer
+        if result['heatmap_url'] is not None and result['model_version'] == version.fingerprint:
+            service.result_cache.put(scan_id, result)
+
+    compact = form.get('response_mode', service.RESPONSE_MODE) == 'compact'
+    body = service.prediction_body(scan_id, result, cache_status, version, compact)
+    if form.get('overlays') == 'all':
+        body['class_heatmaps'] = await run_cpu(service.render_class_overlays, decoded, scan_id, scan_version)
+    for field in ('patient_id', 'doctor_id'):
+        if form.get(field):
+            body[field] = form.get(field)
+    return 200, body
+
+
+async def read_upload(request):
+    """(form, file bytes) of a prediction request; raises RequestError for a missing or oversized file"""
+    form = await read_multipart(request, service.app.config['MAX_CONTENT_LENGTH'])
+    if 'file' not in form.files:
+        raise RequestError(400, 'No file part')
+    filename, data = form.files['file']
+    if filename == '':
+        raise RequestError(400, 'No selected file')
+    return form, data
+
+
+def queue_full(e):
+    logger.warning("Inference queue full, rejecting request", extra={'retry_after': e.retry_after})
+    return JSONResponse({'error': 'Server is busy, please retry shortly', 'success': False}, 503,
+                        headers={'Retry-After': str(e.retry_after)})
+
+
+@instrumented('/api/predict')
+async def predict(request):
+    if not service.runtime_ready.is_set():
+        return not_ready()
+    try:
+        form, data = await read_upload(request)
+    except RequestError as e:
+        return JSONResponse({'error': e.message}, e.status)
+
+    try:
+        outcome = await cancel_on_disconnect(
+            request, asyncio.wait_for(predict_upload(form, data), ASYNC_REQUEST_TIMEOUT))
+    except asyncio.TimeoutError:
+        logger.warning("Prediction timed out", extra={'timeout_s': ASYNC_REQUEST_TIMEOUT})
+        return JSONResponse({'error': 'Prediction timed out', 'success': False}, 504)
+    except QueueFullError as e:
+        return queue_full(e)
+    except Exception as e:
+        logger.exception("Error during prediction")
+        return JSONResponse({'error': str(e), 'success': False}, 500)
+
+    if outcome is None:
+        return Response(status_code=499)  # Client closed the request; nobody reads this
+    status, body = outcome
+    return JSONResponse(body, status)
+
+
+async def stream_lines(prediction, scan_id, result, version, compact, extra):
+    """NDJSON lines of a streamed prediction (see app.predict_stream).
+
+    Waits for the batcher happen on plain threads and rendering on the CPU pool.
+    When the client disconnects, Starlette cancels this generator and the
+    prediction is abandoned, so explanation work not yet started is skipped.
+    """
+    if prediction is None:
+        lines = service.cached_prediction_events(scan_id, result, version, compact)
+    else:
+        lines = service.prediction_events(prediction, version, compact)
+        pending = [prediction.diagnosis, prediction.future]  # The diagnosis first, then the heatmap
+    try:
+        while True:
+            if prediction is not None:
+                await asyncio.to_thread(wait, pending, service.INFERENCE_TIMEOUT, FIRST_COMPLETED)
+                pending = [prediction.future]
+            line = await run_cpu(next, lines, None)
+            if line is None:
+                break
+            yield json.dumps(dict(line, **extra)) + '\n'
+        final = result if prediction is None else prediction.result
+        if final is not None:
+            stored = await asyncio.to_thread(service.stored_line, scan_id, final)
+            yield json.dumps(dict(stored, **extra)) + '\n'
+    except Exception as e:
+        logger.exception("Error during streamed prediction", extra={'scan_id': scan_id})
+        yield json.dumps({'type': 'error', 'success': False, 'scan_id': scan_id, 'error': str(e)}) + '\n'
+    finally:
+        if prediction is not None:
+            prediction.abandon()
+
+
+@instrumented('/api/predict/stream')
+async def predict_stream(request):
+    if not service.runtime_ready.is_set():
+        return not_ready()
+    try:
+        form, data = await read_upload(request)
+    except RequestError as e:
+        return JSONResponse({'error': e.message}, e.status)
+    extra = {field: form.get(field) for field in ('patient_id', 'doctor_id') if form.get(field)}
+    compact = form.get('response_mode', service.RESPONSE_MODE) == 'compact'
+
+    try:
+        decoded = await run_cpu(functools.partial(service.decode_image, BytesIO(data),
+                                                  max_side=service.MAX_DECODE_SIDE))
+    except Exception as e:
+        logger.info("Error decoding uploaded image", extra={'error': str(e)})
+        return JSONResponse(service.invalid_image_body(f"Error processing image: {str(e)}"), 400)
+
+    version = service.model_registry.active
+    scan_id = service.image_digest(decoded.rgb, version.result_fingerprint)
+    result = service.result_cache.get(scan_id)
+    prediction = None
+    if result is None:
+        is_valid, validation_message, decoded = await run_cpu(validate_scan, decoded)
+        if not is_valid:
+            logger.info("Invalid retinal image", extra={'reason': validation_message})
+            return JSONResponse(service.invalid_image_body(validation_message), 400)
+        try:
+            prediction = service.StreamedPrediction(decoded, scan_id)
+        except QueueFullError as e:
+            return queue_full(e)
+
+    return StreamingResponse(stream_lines(prediction, scan_id, result, version, compact, extra),
+                             media_type='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+
+async def load_runtime():
+    """Load the model off the event loop, start the upload tasks on it, then the batcher"""
+    try:
+        await asyncio.to_thread(service.load_runtime, False)
+        backend = None
+        if os.getenv('STORAGE_BACKEND', 'supabase') != 'local':
+            backend = AsyncSupabaseStorageBackend(service.SUPABASE_URL, service.SUPABASE_KEY)
+        service.upload_queue.start_async(backend)
+        await asyncio.to_thread(service.start_services, True, False)
+    except Exception:
+        pass  # Already logged by load_runtime/start_services; /api/ready reports runtime_error
+
+
+@asynccontextmanager
+async def lifespan(_):
+    # Health checks answer while the model loads in the background
+    loader = asyncio.create_task(load_runtime())
+    try:
+        yield
+    finally:
+        loader.cancel()
+        service.runtime_ready.clear()
+        if service.upload_queue is not None:
+            await service.upload_queue.stop_async()
+        await asyncio.to_thread(service.shutdown_services)
+        cpu_executor.shutdown(wait=False, cancel_futures=True)
+
+
+# The Flask app adds its own CORS headers, so only the native routes get the middleware
+cors = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health, methods=['GET', 'OPTIONS'], middleware=cors),
+        Route('/api/predict', predict, methods=['POST', 'OPTIONS'], middleware=cors),
+        Route('/api/predict/stream', predict_stream, methods=['POST', 'OPTIONS'], middleware=cors),
+        Route('/api/doctor/stats', doctor_stats, methods=['GET', 'OPTIONS'], middleware=cors),
+        Route('/api/doctor/stats/{doctor_id}', doctor_stats, methods=['GET', 'OPTIONS'], middleware=cors),
+        Mount('/', app=WSGIMiddleware(service.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,344 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+CLASSES = ['CNV', 'DME', 'DRUSEN', 'NORMAL']
+
+# Scans recorded within this many days count as recent analyses
+RECENT_DAYS = 7
+
+
+def empty_stats():
+    return {
+        'total_patients': 0,
+        'total_scans': 0,
+        'recent_analysis': 0,
+        'scan_distribution': {name: 0 for name in CLASSES},
+    }
+
+
+def _day(value):
+    """ISO date (UTC) of a datetime or ISO timestamp string"""
+    if value is None:
+        return datetime.now(timezone.utc).date().isoformat()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date().isoformat()
+
+
+def _recent_since(recent_days):
+    return (datetime.now(timezone.utc).date() - timedelta(days=recent_days - 1)).isoformat()
+
+
+class SQLiteStatsStore:
+    """Local stand-in for the Supabase schema, with the doctor_stats aggregates.
+
+    `patients` and `retinal_scans` mirror the columns of supabase_schema.sql that
+    the stats need. Recording a scan or a patient updates the per-doctor totals
+    and the per-day scan counts in the same transaction, which is what the
+    Postgres triggers do in Supabase. Reading stats touches only the aggregate
+    rows, however long a doctor's history is.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS patients (
+            id TEXT PRIMARY KEY,
+            doctor_id TEXT NOT NULL,
+            full_name TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS retinal_scans (
+            id TEXT PRIMARY KEY,
+            patient_id TEXT NOT NULL,
+            doctor_id TEXT NOT NULL,
+            diagnosis TEXT NOT NULL,
+            confidence REAL,
+            image_url TEXT,
+            heatmap_url TEXT,
+            doctor_notes TEXT,
+            scan_date TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_retinal_scans_doctor_id ON retinal_scans(doctor_id);
+        CREATE TABLE IF NOT EXISTS doctor_stats (
+            doctor_id TEXT PRIMARY KEY,
+            total_patients INTEGER NOT NULL DEFAULT 0,
+            total_scans INTEGER NOT NULL DEFAULT 0,
+            cnv_count INTEGER NOT NULL DEFAULT 0,
+            dme_count INTEGER NOT NULL DEFAULT 0,
+            drusen_count INTEGER NOT NULL DEFAULT 0,
+            normal_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS doctor_daily_scans (
+            doctor_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            scan_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (doctor_id, day)
+        );
+    '''
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def record_patient(self, patient_id, doctor_id, full_name=None):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT INTO patients (id, doctor_id, full_name) VALUES (?, ?, ?)',
+                               (patient_id, doctor_id, full_name))
+            self._ensure_row(doctor_id)
+            self._conn.execute('UPDATE doctor_stats SET total_patients = total_patients + 1 WHERE doctor_id = ?',
+                               (doctor_id,))
+
+    def record_scan(self, scan):
+        """Insert a retinal_scans row and apply it to the doctor's aggregates.
+        
+        Raises PermissionError if the patient is not one of the doctor's.
+        """
+        diagnosis = scan['diagnosis']
+        if diagnosis not in CLASSES:
+            raise ValueError(f"Unknown diagnosis: {diagnosis}")
+        scan_date = scan.get('scan_date') or datetime.now(timezone.utc).isoformat()
+        with self._lock, self._conn:
+            owned = self._conn.execute('SELECT id FROM patients WHERE id = ? AND doctor_id = ?',
+                                       (scan['patient_id'], scan['doctor_id'])).fetchone()
+            if owned is None:
+                raise PermissionError(f"Patient {scan['patient_id']} does not belong to this doctor")
+            self._conn.execute(
+                'INSERT INTO retinal_scans (id, patient_id, doctor_id, diagnosis, confidence, image_url, '
+                'heatmap_url, doctor_notes, scan_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (scan['id'], scan['patient_id'], scan['doctor_id'], diagnosis, scan.get('confidence'),
+                 scan.get('image_url'), scan.get('heatmap_url'), scan.get('doctor_notes'), scan_date))
+            self._ensure_row(scan['doctor_id'])
+            column = f"{diagnosis.lower()}_count"
+            self._conn.execute(
+                f'UPDATE doctor_stats SET total_scans = total_scans + 1, {column} = {column} + 1 WHERE doctor_id = ?',
+                (scan['doctor_id'],))
+            self._conn.execute(
+                'INSERT INTO doctor_daily_scans (doctor_id, day, scan_count) VALUES (?, ?, 1) '
+                'ON CONFLICT (doctor_id, day) DO UPDATE SET scan_count = scan_count + 1',
+                (scan['doctor_id'], _day(scan_date)))
+
+    def fetch_stats(self, doctor_id, recent_days=RECENT_DAYS):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT total_patients, total_scans, cnv_count, dme_count, drusen_count, normal_count '
+                'FROM doctor_stats WHERE doctor_id = ?', (doctor_id,)).fetchone()
+            recent, = self._conn.execute(
+                'SELECT COALESCE(SUM(scan_count), 0) FROM doctor_daily_scans WHERE doctor_id = ? AND day >= ?',
+                (doctor_id, _recent_since(recent_days))).fetchone()
+        stats = empty_stats()
+        if row is not None:
+            stats['total_patients'], stats['total_scans'] = row[0], row[1]
+            stats['scan_distribution'] = dict(zip(CLASSES, row[2:]))
+        stats['recent_analysis'] = recent
+        return stats
+
+    def rebuild(self, doctor_id=None):
+        """Recompute the aggregates from patients/retinal_scans (all doctors if doctor_id is None)"""
+        where, params = ('WHERE doctor_id = ?', (doctor_id,)) if doctor_id else ('', ())
+        with self._lock, self._conn:
+            self._conn.execute(f'DELETE FROM doctor_stats {where}', params)
+            self._conn.execute(f'DELETE FROM doctor_daily_scans {where}', params)
+            self._conn.execute(f'''
+                INSERT INTO doctor_stats (doctor_id, total_patients, total_scans, cnv_count, dme_count,
+                                          drusen_count, normal_count)
+                SELECT doctor_id,
+                       (SELECT COUNT(*) FROM patients p WHERE p.doctor_id = d.doctor_id),
+                       (SELECT COUNT(*) FROM retinal_scans s WHERE s.doctor_id = d.doctor_id),
+                       (SELECT COUNT(*) FROM retinal_scans s WHERE s.doctor_id = d.doctor_id AND diagnosis = 'CNV'),
+                       (SELECT COUNT(*) FROM retinal_scans s WHERE s.doctor_id = d.doctor_id AND diagnosis = 'DME'),
+                       (SELECT COUNT(*) FROM retinal_scans s WHERE s.doctor_id = d.doctor_id AND diagnosis = 'DRUSEN'),
+                       (SELECT COUNT(*) FROM retinal_scans s WHERE s.doctor_id = d.doctor_id AND diagnosis = 'NORMAL')
+                FROM (SELECT doctor_id FROM patients {where}
+                      UNION SELECT doctor_id FROM retinal_scans {where}) d
+            ''', params * 2)
+            self._conn.execute(f'''
+                INSERT INTO doctor_daily_scans (doctor_id, day, scan_count)
+                SELECT doctor_id, date(scan_date), COUNT(*) FROM retinal_scans {where}
+                GROUP BY doctor_id, date(scan_date)
+            ''', params)
+            count, = self._conn.execute(f'SELECT COUNT(*) FROM doctor_stats {where}', params).fetchone()
+        return count
+
+    def _ensure_row(self, doctor_id):
+        self._conn.execute('INSERT OR IGNORE INTO doctor_stats (doctor_id) VALUES (?)', (doctor_id,))
+
+
+class SupabaseStatsStore:
+    """Reads the doctor_stats aggregates that Postgres triggers maintain in Supabase.
+
+    The triggers in supabase_schema.sql update doctor_stats and
+    doctor_daily_scans on every insert, update or delete of patients and
+    retinal_scans. So scans the frontend writes directly are counted too, and
+    recording a scan here is a plain insert. The client is created on first use.
+
+    `key` must be the service-role key: the server has no user session, so under
+    the anon key the `doctor_id = auth.uid()` policies hide every row. The service
+    role bypasses RLS, so callers pass a doctor_id taken from a verified token,
+    and record_scan checks that the patient belongs to that doctor.
+    """
+
+    def __init__(self, url, key):
+        self.url = url
+        self.key = key
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if not self.url or not self.key:
+                    raise RuntimeError("Supabase stats need SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY")
+                from supabase import create_client
+                self._client = create_client(self.url, self.key)
+            return self._client
+
+    def record_scan(self, scan):
+        if scan['diagnosis'] not in CLASSES:
+            raise ValueError(f"Unknown diagnosis: {scan['diagnosis']}")
+        owned = (self.client.table('patients').select('id')
+                 .eq('id', scan['patient_id']).eq('doctor_id', scan['doctor_id']).execute().data)
+        if not owned:
+            raise PermissionError(f"Patient {scan['patient_id']} does not belong to this doctor")
+        self.client.table('retinal_scans').insert(scan).execute()
+
+    def fetch_stats(self, doctor_id, recent_days=RECENT_DAYS):
+        stats = empty_stats()
+        rows = self.client.table('doctor_stats').select('*').eq('doctor_id', doctor_id).execute().data
+        if rows:
+            row = rows[0]
+            stats['total_patients'] = row['total_patients']
+            stats['total_scans'] = row['total_scans']
+            stats['scan_distribution'] = {name: row[f"{name.lower()}_count"] for name in CLASSES}
+        days = (self.client.table('doctor_daily_scans').select('scan_count')
+                .eq('doctor_id', doctor_id).gte('day', _recent_since(recent_days)).execute().data)
+        stats['recent_analysis'] = sum(day['scan_count'] for day in days)
+        return stats
+
+    def rebuild(self, doctor_id=None):
+        response = self.client.rpc('rebuild_doctor_stats', {'target_doctor_id': doctor_id}).execute()
+        return response.data
+
+
+class DoctorStatsService:
+    """Per-doctor stats from a store's aggregates, behind an in-process TTL cache.
+
+    Recording a scan through the service invalidates that doctor's entry, so
+    the dashboard reflects it on the next load. Writes made elsewhere (e.g. by
+    the frontend directly) show up once the TTL expires.
+    """
+
+    def __init__(self, store, ttl_seconds=30, recent_days=RECENT_DAYS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.recent_days = recent_days
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, doctor_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(doctor_id)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                return entry[1]
+        stats = self.store.fetch_stats(doctor_id, self.recent_days)
+        with self._lock:
+            self._cache[doctor_id] = (now, stats)
+        return stats
+
+    def record_scan(self, scan):
+        self.store.record_scan(scan)
+        self.invalidate(scan['doctor_id'])
+
+    def rebuild(self, doctor_id=None):
+        result = self.store.rebuild(doctor_id)
+        self.invalidate(doctor_id)
+        return result
+
+    def invalidate(self, doctor_id=None):
+        with self._lock:
+            if doctor_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(doctor_id, None)
+
+
+class SupabaseTokenVerifier:
+    """Maps a Supabase access token (the frontend session's JWT) to the signed-in user's id.
+
+    Tokens are checked with Supabase Auth, so expired and revoked sessions are
+    refused. A verified token is remembered for `ttl_seconds`, which keeps
+    dashboard refreshes off the auth server.
+    """
+
+    def __init__(self, url, key, ttl_seconds=60, max_entries=1024):
+        self.url = url
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._client = None
+        self._verified = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if not self.url or not self.key:
+                    raise RuntimeError("Doctor authentication needs SUPABASE_URL and SUPABASE_ANON_KEY")
+                from supabase import create_client
+                self._client = create_client(self.url, self.key)
+            return self._client
+
+    def doctor_id(self, token):
+        """User id the token was issued to, or None if Supabase does not accept it"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._verified.get(token)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                return entry[1]
+        from supabase import AuthApiError
+
+        try:
+            response = self.client.auth.get_user(token)
+        except AuthApiError:
+            return None
+        user = response.user if response is not None else None
+        if user is None:
+            return None
+        with self._lock:
+            if len(self._verified) >= self.max_entries:
+                self._verified.clear()
+            self._verified[token] = (now, str(user.id))
+        return str(user.id)
+
+
+class UnverifiedDoctorAuth:
+    """Local development only: the bearer token is taken to be the doctor id itself"""
+
+    def doctor_id(self, token):
+        return token
+
+
+def create_doctor_auth(mode, supabase_url=None, supabase_key=None):
+    """Build the token check named by DOCTOR_AUTH: `supabase` or `unverified`"""
+    if mode == 'supabase':
+        return SupabaseTokenVerifier(supabase_url, supabase_key)
+    if mode == 'unverified':
+        return UnverifiedDoctorAuth()
+    raise ValueError(f"Unknown doctor auth mode: {mode}")
+
+
+def create_stats_store(backend, supabase_url=None, supabase_key=None, sqlite_path='doctor_stats.db'):
+    """Build the store named by STATS_BACKEND: `supabase` or `sqlite`"""
+    if backend == 'sqlite':
+        return SQLiteStatsStore(sqlite_path)
+    if backend == 'supabase':
+        return SupabaseStatsStore(supabase_url, supabase_key)
+    raise ValueError(f"Unknown stats backend: {backend}")
@@ -35,20 +35,17 @@ const ImageUploader = ({ patientId, onScanComplete, showDetailedMetrics = false
   const [doctorNotes, setDoctorNotes] = useState('');
   const [isGeneratingPDF, setIsGeneratingPDF] = useState(false);
 
-  // Sample confusion matrix data (in a real app, this would come from the backend)
+  // Confusion matrix from the latest offline evaluation (scripts/evaluate.py)
   useEffect(() => {
-    // This simulates fetching confusion matrix data
-    const sampleConfusionMatrix = {
-      labels: ['CNV', 'DME', 'DRUSEN', 'NORMAL'],
-      matrix: [
-        [95, 2, 1, 2],    // CNV
-        [3, 92, 3, 2],    // DME
-        [2, 4, 90, 4],    // DRUSEN
-        [1, 2, 2, 95]     // NORMAL
-      ]
-    };
-    
-    setConfusionMatrix(sampleConfusionMatrix);
+    axios.get(`${API_URL}/api/evaluation`)
+      .then((response) => {
+        const { labels, matrix } = response.data;
+        setConfusionMatrix({ labels, matrix });
+      })
+      .catch(() => {
+        // No evaluation has been run yet; hide the matrix
+        setConfusionMatrix(null);
+      });
   }, []);
 
   const handleFileChange = async (e) => {
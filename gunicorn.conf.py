@@ -0,0 +1,65 @@
+"""Production serving config: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master with MODEL_LOAD_MODE=prefork, so the
+ResNet-101 weights (memory-mapped) are loaded before fork and shared
+copy-on-write by every worker. No threads are started in the master; each
+worker starts its own batcher and upload threads after fork, with torch's
+thread pool sized so the workers together don't oversubscribe the cores.
+Every worker, including replacements, takes over the spooled uploads whose
+owning process has exited (see UploadQueue.recover).
+Workers are recycled after GUNICORN_MAX_REQUESTS requests (with jitter) and
+given GUNICORN_GRACEFUL_TIMEOUT seconds to finish in-flight scans.
+"""
+import gc
+import multiprocessing
+import os
+
+os.environ.setdefault('MODEL_LOAD_MODE', 'prefork')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(max(1, multiprocessing.cpu_count() // 2))))
+# Threads let concurrent requests in one worker share a micro-batch
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+
+def torch_threads_per_worker():
+    configured = os.getenv('TORCH_THREADS_PER_WORKER')
+    if configured:
+        return int(configured)
+    return max(1, multiprocessing.cpu_count() // workers)
+
+
+def when_ready(server):
+    # Everything allocated while loading the app is long-lived; keep the garbage
+    # collector from touching (and so copying) those pages in the workers
+    gc.freeze()
+    server.log.info("Model preloaded, forking %s workers", workers)
+
+
+def post_fork(server, worker):
+    import torch
+    import app as service
+
+    torch.set_num_threads(torch_threads_per_worker())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already set in this process
+
+    # Uploads still owned by a live sibling are skipped, so each spooled job is
+    # re-queued by exactly one worker, including jobs a recycled worker left behind
+    service.start_services(recover_uploads=True)
+    server.log.info("Worker %s ready with %s torch threads", worker.pid, torch.get_num_threads())
+
+
+def worker_exit(server, worker):
+    import app as service
+
+    service.shutdown_services(timeout=graceful_timeout)
@@ -0,0 +1,286 @@
+import glob
+import logging
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+from observability import stage
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['eager', 'torchscript', 'onnx', 'quantized']
+
+
+def normalize_cam(cam):
+    """ReLU and min-max normalize a 2D class activation map to [0, 1]"""
+    cam = np.maximum(cam, 0)
+    return (cam - cam.min()) / (cam.max() - cam.min() + 1e-10)
+
+
+def unhooked_copy(model):
+    """A fresh ResNet-101 with `model`'s weights, on the same device.
+
+    The serving model carries the Grad-CAM hook, a bound method of an explainer
+    holding a lock, so it can be neither deep-copied nor traced as is.
+    """
+    from torchvision.models import resnet101
+
+    device = next(model.parameters()).device
+    clone = resnet101(weights=None, num_classes=model.fc.out_features)
+    clone.load_state_dict(model.state_dict())
+    return clone.to(device).eval()
+
+
+class FeatureClassifier(nn.Module):
+    """ResNet wrapper returning (logits, layer4 features).
+
+    ResNet ends in global average pooling followed by a single linear layer, so
+    the class activation map for class c is just fc.weight[c] applied to the
+    layer4 features. Exporting both outputs lets compiled backends produce a
+    heatmap without a backward pass.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        m = self.model
+        x = m.maxpool(m.relu(m.bn1(m.conv1(x))))
+        features = m.layer4(m.layer3(m.layer2(m.layer1(x))))
+        logits = m.fc(torch.flatten(m.avgpool(features), 1))
+        return logits, features
+
+
+class InferenceBackend:
+    """Base class for backends that run a forward pass returning logits and layer4 features.
+
+    Heatmaps are gradient-free CAMs by default. If `fallback_explainer` is set,
+    heatmaps come from the float Grad-CAM explainer instead, using the classes
+    this backend predicted.
+    """
+    name = 'base'
+
+    def __init__(self, fc_weight, fallback_explainer=None):
+        self.fc_weight = fc_weight.detach().float().cpu()
+        self.fallback_explainer = fallback_explainer
+
+    @property
+    def cam_mode(self):
+        return 'gradcam' if self.fallback_explainer is not None else 'cam'
+
+    @property
+    def result_key(self):
+        """Identifies what this backend computes, for result caching: the backend and its heatmap method"""
+        return f"{self.name}+{self.cam_mode}"
+
+    @property
+    def hook_count(self):
+        return self.fallback_explainer.hook_count if self.fallback_explainer is not None else 0
+
+    def forward(self, batch):
+        raise NotImplementedError
+
+    def explain_batch(self, input_batch, class_indices=None, on_diagnosis=None):
+        with stage('forward'):
+            logits, features = self.forward(input_batch)
+        probabilities = torch.nn.functional.softmax(logits.float(), dim=1)
+        if class_indices is None:
+            class_indices = torch.argmax(probabilities, dim=1).tolist()
+        rows = torch.arange(len(class_indices))
+        confidences = (probabilities[rows, class_indices] * 100).tolist()
+        if on_diagnosis is not None and not on_diagnosis(class_indices, confidences):
+            return [(idx, conf, None) for idx, conf in zip(class_indices, confidences)]
+
+        if self.fallback_explainer is not None:
+            explained = self.fallback_explainer.explain_batch(input_batch, class_indices)
+            heatmaps = [heatmap for _, _, heatmap in explained]
+        else:
+            with stage('cam'):
+                cams = torch.einsum('nk,nkhw->nhw', self.fc_weight[class_indices], features.float().cpu())
+                heatmaps = [normalize_cam(cam.numpy()) for cam in cams]
+        return list(zip(class_indices, confidences, heatmaps))
+
+    def explain(self, input_image, class_idx=None):
+        class_indices = None if class_idx is None else [class_idx]
+        return self.explain_batch(input_image, class_indices)[0]
+
+    def predict_batch(self, input_batch):
+        """(class_idx, confidence) per sample from the forward pass alone, whatever the CAM mode"""
+        logits, _ = self.forward(input_batch)
+        confidences, class_indices = torch.nn.functional.softmax(logits.float(), dim=1).max(dim=1)
+        return list(zip(class_indices.tolist(), (confidences * 100).tolist()))
+
+    def class_heatmaps(self, input_batch):
+        """A (num_classes, h, w) stack of heatmaps per sample, from one forward pass"""
+        if self.fallback_explainer is not None:
+            return self.fallback_explainer.class_heatmaps(input_batch)
+        _, features = self.forward(input_batch)
+        cams = torch.einsum('ck,nkhw->nchw', self.fc_weight, features.float().cpu()).numpy()
+        return [np.stack([normalize_cam(cam) for cam in sample]) for sample in cams]
+
+
+class EagerBackend:
+    """Float32 eager PyTorch with Grad-CAM; the reference every other backend is compared to"""
+    name = 'eager'
+    cam_mode = 'gradcam'
+    result_key = 'eager'
+
+    def __init__(self, explainer):
+        self.explainer = explainer
+
+    @property
+    def hook_count(self):
+        return self.explainer.hook_count
+
+    def explain_batch(self, input_batch, class_indices=None, on_diagnosis=None):
+        return self.explainer.explain_batch(input_batch, class_indices, on_diagnosis)
+
+    def explain(self, input_image, class_idx=None):
+        return self.explainer.explain(input_image, class_idx)
+
+    def predict_batch(self, input_batch):
+        return self.explainer.predict_batch(input_batch)
+
+    def class_heatmaps(self, input_batch):
+        return self.explainer.class_heatmaps(input_batch)
+
+
+class TorchScriptBackend(InferenceBackend):
+    """Traced, frozen TorchScript graph run in channels_last memory format"""
+    name = 'torchscript'
+
+    def __init__(self, model, channels_last=True, fallback_explainer=None):
+        super().__init__(model.fc.weight, fallback_explainer)
+        self.channels_last = channels_last
+        self.device = next(model.parameters()).device
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+
+        wrapper = FeatureClassifier(unhooked_copy(model)).eval().to(memory_format=self.memory_format)
+        example = torch.zeros(1, 3, 224, 224, device=self.device).contiguous(memory_format=self.memory_format)
+        with torch.no_grad():
+            traced = torch.jit.trace(wrapper, example)
+            self.module = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def forward(self, batch):
+        batch = batch.to(self.device).contiguous(memory_format=self.memory_format)
+        with torch.inference_mode():
+            return self.module(batch)
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    """ONNX export of the model run through ONNX Runtime on CPU (needs the optional onnxruntime package)"""
+    name = 'onnx'
+
+    def __init__(self, model, onnx_path, num_threads=0, fallback_explainer=None):
+        super().__init__(model.fc.weight, fallback_explainer)
+        import onnxruntime as ort
+
+        if not os.path.exists(onnx_path):
+            export_onnx(model, onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def forward(self, batch):
+        logits, features = self.session.run(None, {'input': batch.detach().cpu().numpy()})
+        return torch.from_numpy(logits), torch.from_numpy(features)
+
+
+class QuantizedBackend(InferenceBackend):
+    """Static post-training INT8 quantization calibrated on sample batches.
+
+    Uses torchvision's quantizable ResNet (fused conv/bn/relu, quantized
+    residual adds). Dynamic quantization alone would only cover the final
+    linear layer of a ResNet, so the convolutions are calibrated statically.
+    """
+    name = 'quantized'
+
+    def __init__(self, model, calibration_batches, fallback_explainer=None):
+        super().__init__(model.fc.weight, fallback_explainer)
+        from torchvision.models.quantization.resnet import QuantizableBottleneck, QuantizableResNet
+
+        engines = torch.backends.quantized.supported_engines
+        torch.backends.quantized.engine = 'x86' if 'x86' in engines else 'fbgemm'
+
+        # ResNet-101 block layout
+        qmodel = QuantizableResNet(QuantizableBottleneck, [3, 4, 23, 3], num_classes=model.fc.out_features)
+        qmodel.load_state_dict({k: v.cpu() for k, v in model.state_dict().items()})
+        qmodel.eval()
+        qmodel.fuse_model()
+        qmodel.qconfig = torch.ao.quantization.get_default_qconfig(torch.backends.quantized.engine)
+        torch.ao.quantization.prepare(qmodel, inplace=True)
+        with torch.no_grad():
+            for batch in calibration_batches:
+                qmodel(batch.cpu())
+        torch.ao.quantization.convert(qmodel, inplace=True)
+        self.module = qmodel
+
+    def forward(self, batch):
+        # QuantizableResNet.forward, keeping the layer4 features; no shared state, so
+        # request threads and the batcher can call this concurrently
+        m = self.module
+        with torch.inference_mode():
+            x = m.quant(batch.cpu())
+            x = m.maxpool(m.relu(m.bn1(m.conv1(x))))
+            features = m.layer4(m.layer3(m.layer2(m.layer1(x))))
+            logits = m.dequant(m.fc(torch.flatten(m.avgpool(features), 1)))
+            return logits, features.dequantize()
+
+
+def export_onnx(model, onnx_path):
+    """Export FeatureClassifier(model) to ONNX with a dynamic batch dimension"""
+    os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+    wrapper = FeatureClassifier(unhooked_copy(model).cpu()).eval()
+    example = torch.zeros(1, 3, 224, 224)
+    tmp_path = onnx_path + '.tmp'
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper, example, tmp_path,
+            input_names=['input'],
+            output_names=['logits', 'features'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}, 'features': {0: 'batch'}},
+            opset_version=18,
+        )
+    os.replace(tmp_path, onnx_path)
+    logger.info("Exported ONNX model", extra={'path': onnx_path})
+
+
+def load_calibration_batches(directory, transform, limit=64, batch_size=8):
+    """Load up to `limit` images from a directory tree as transformed batches for INT8 calibration"""
+    paths = []
+    if directory:
+        for pattern in ('*.jpg', '*.jpeg', '*.png'):
+            paths.extend(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+    paths = sorted(paths)[:limit]
+
+    if not paths:
+        logger.warning("No calibration images found, calibrating INT8 model on random inputs (accuracy will suffer)")
+        generator = torch.Generator().manual_seed(0)
+        return [torch.randn(batch_size, 3, 224, 224, generator=generator) for _ in range(max(1, limit // batch_size))]
+
+    tensors = []
+    for path in paths:
+        with Image.open(path) as img:
+            tensors.append(transform(img.convert('RGB')))
+    return [torch.stack(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+
+
+def create_backend(name, model, explainer, cam_mode='cam', onnx_path=None, calibration_batches=None):
+    """Build the named backend. cam_mode='gradcam' keeps float Grad-CAM heatmaps for non-eager backends."""
+    fallback = explainer if cam_mode == 'gradcam' else None
+    if name == 'eager':
+        return EagerBackend(explainer)
+    if name == 'torchscript':
+        return TorchScriptBackend(model, fallback_explainer=fallback)
+    if name == 'onnx':
+        return OnnxRuntimeBackend(model, onnx_path or os.path.join('model_cache', 'model.onnx'), fallback_explainer=fallback)
+    if name == 'quantized':
+        return QuantizedBackend(model, calibration_batches or [], fallback_explainer=fallback)
+    raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}")
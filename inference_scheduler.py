@@ -0,0 +1,228 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class QueueFullError(Exception):
+    """Raised when the inference queue is at capacity"""
+
+    def __init__(self, retry_after):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class BatchScheduler:
+    """Background worker that micro-batches inference requests.
+
+    Tensors submitted by concurrent requests are collected until either
+    `max_batch_size` samples are waiting or `max_wait_ms` has passed since the
+    first one arrived. They are then run through the explainer as one batch and
+    each caller's future gets its own (class_idx, confidence, heatmap) tuple.
+
+    The explainer can be swapped while running; the swap takes effect at the
+    next batch, and each future's `explainer` attribute records which one
+    produced its result. `on_batch(explainer, batch, results, seconds)` is
+    called after every batch's futures have been resolved.
+
+    A caller can pass `on_diagnosis(class_idx, confidence)` to submit() to hear
+    about its prediction as soon as the batch's logits exist, before the
+    heatmaps are computed. Returning False from it says the heatmap is no longer
+    needed; when no sample in the batch needs one, the explanation is skipped
+    and the results carry None heatmaps.
+
+    submit_class_heatmaps() queues a request for every class's heatmap from a
+    given explainer. Those requests share the queue and its capacity, and are
+    batched with the other class-heatmap requests for the same explainer.
+    """
+
+    def __init__(self, explainer, max_batch_size=8, max_wait_ms=10, max_queue_size=64):
+        self.explainer = explainer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._total_requests = 0
+        self._rejected_requests = 0
+        self._busy_seconds = 0.0
+        self._last_batch_ms = 0.0
+        self._thread = None
+        self._stopping = threading.Event()
+        self.on_batch = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='inference-batcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Stop the worker; requests still queued fail with RuntimeError instead of waiting forever"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        while True:
+            try:
+                future = self._queue.get_nowait()[1]
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("Inference scheduler stopped"))
+
+    def swap_explainer(self, explainer):
+        """Run batches through `explainer` from the next batch on"""
+        self.explainer = explainer
+
+    def submit(self, tensor, on_diagnosis=None):
+        """Queue a (1, C, H, W) tensor and return a Future for its result"""
+        future = Future()
+        try:
+            self._queue.put_nowait((tensor, future, on_diagnosis, None))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected_requests += 1
+            raise QueueFullError(self.retry_after())
+        return future
+
+    def submit_class_heatmaps(self, tensor, explainer):
+        """Queue a (1, C, H, W) tensor and return a Future for `explainer.class_heatmaps` of it"""
+        future = Future()
+        try:
+            self._queue.put_nowait((tensor, future, None, explainer))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected_requests += 1
+            raise QueueFullError(self.retry_after())
+        return future
+
+    def retry_after(self):
+        """Rough number of seconds until the current queue drains"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            per_batch = self._busy_seconds / batches if batches else 1.0
+        pending_batches = self._queue.qsize() / float(self.max_batch_size) + 1
+        return max(1, int(round(pending_batches * per_batch)))
+
+    def stats(self):
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_queue_size,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'total_requests': self._total_requests,
+                'rejected_requests': self._rejected_requests,
+                'total_batches': batches,
+                'mean_batch_size': self._total_requests / batches if batches else 0.0,
+                'batch_size_counts': {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                'last_batch_ms': self._last_batch_ms,
+            }
+
+    def _collect_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _diagnosis_callback(listeners):
+        """Fan a batch's predictions out to its listeners; True if any sample still needs a heatmap"""
+        def diagnosed(class_indices, confidences):
+            wanted = False
+            for listener, class_idx, confidence in zip(listeners, class_indices, confidences):
+                if listener is None:
+                    wanted = True
+                    continue
+                try:
+                    wanted = listener(class_idx, confidence) is not False or wanted
+                except Exception:
+                    wanted = True  # A broken listener must not cost its request the heatmap
+            return wanted
+        return diagnosed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect_batch()
+            # Skip requests whose caller has already given up
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            explain = [item[:3] for item in batch if item[3] is None]
+            if explain:
+                self._run_explain(explain)
+            # Class-heatmap requests run as one batch per explainer they asked for
+            groups = {}
+            for tensor, future, _, explainer in batch:
+                if explainer is not None:
+                    groups.setdefault(id(explainer), (explainer, []))[1].append((tensor, future))
+            for explainer, items in groups.values():
+                self._run_class_heatmaps(explainer, items)
+
+    def _run_explain(self, batch):
+        import torch
+
+        explainer = self.explainer
+        for _, future, _ in batch:
+            future.explainer = explainer
+        listeners = [listener for _, _, listener in batch]
+        start = time.perf_counter()
+        results = None
+        try:
+            inputs = torch.cat([tensor for tensor, _, _ in batch])
+            if any(listeners):
+                results = explainer.explain_batch(inputs, on_diagnosis=self._diagnosis_callback(listeners))
+            else:
+                results = explainer.explain_batch(inputs)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        elapsed = time.perf_counter() - start
+
+        if results is not None and self.on_batch is not None:
+            try:
+                self.on_batch(explainer, inputs, results, elapsed)
+            except Exception:
+                pass  # Observers must never take down the batcher
+
+        self._record_batch(len(batch), elapsed)
+
+    def _run_class_heatmaps(self, explainer, batch):
+        import torch
+
+        for _, future in batch:
+            future.explainer = explainer
+        start = time.perf_counter()
+        try:
+            results = explainer.class_heatmaps(torch.cat([tensor for tensor, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        self._record_batch(len(batch), time.perf_counter() - start)
+
+    def _record_batch(self, size, elapsed):
+        with self._stats_lock:
+            self._batch_sizes[size] += 1
+            self._total_requests += size
+            self._busy_seconds += elapsed
+            self._last_batch_ms = elapsed * 1000
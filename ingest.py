@@ -0,0 +1,61 @@
+from collections import namedtuple
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from flask import Request, current_app
+
+from observability import stage
+
+
+# An upload decoded exactly once: the RGB pixels shared by validation and
+# rendering, the normalized (1, 3, 224, 224) model input (None until it is
+# prepared, which the app does only for images that pass validation), and the
+# size of the image as stored in the file (before any reduced decoding).
+DecodedImage = namedtuple('DecodedImage', ['rgb', 'tensor', 'original_size'])
+
+
+class InMemoryRequest(Request):
+    """Flask request that keeps uploaded files in memory instead of spooling to disk.
+
+    Uploads are already capped by MAX_CONTENT_LENGTH, so holding them in a
+    BytesIO is bounded and avoids the temp file werkzeug would otherwise create
+    for anything above 500KB.
+    """
+
+    @property
+    def max_content_length(self):
+        # Endpoints listed in ENDPOINT_MAX_CONTENT_LENGTH (e.g. bulk uploads) get their own cap
+        limits = current_app.config.get('ENDPOINT_MAX_CONTENT_LENGTH', {}) if current_app else {}
+        if self.endpoint in limits:
+            return limits[self.endpoint]
+        return current_app.config['MAX_CONTENT_LENGTH'] if current_app else None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return BytesIO()
+
+
+def decode_image(stream, transform=None, max_side=2048):
+    """Decode an image stream once into a DecodedImage.
+
+    JPEGs larger than `max_side` are decoded at a reduced scale through PIL's
+    draft mode, which skips most of the IDCT work instead of decoding the full
+    image and resizing afterwards. The model input is only built here when a
+    torchvision `transform` is given.
+    """
+    if hasattr(stream, 'seek'):
+        stream.seek(0)
+    with stage('decode'):
+        with Image.open(stream) as img:
+            original_size = img.size
+            if img.format == 'JPEG' and max(img.size) > max_side:
+                scale = max_side / float(max(img.size))
+                img.draft('RGB', (int(img.width * scale), int(img.height * scale)))
+            img = img.convert('RGB')
+        rgb = np.asarray(img)
+
+    if transform is None:
+        return DecodedImage(rgb, None, original_size)
+    with stage('transform'):
+        tensor = transform(img).unsqueeze(0)
+    return DecodedImage(rgb, tensor, original_size)
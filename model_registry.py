@@ -0,0 +1,284 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ModelVersion:
+    """One loaded set of weights with its Grad-CAM explainer and inference backend.
+
+    Exposes the explainer interface (explain_batch, class_heatmaps, hook_count)
+    so the batcher can run it directly, plus a forward-only predict_batch.
+    """
+
+    def __init__(self, path, fingerprint, model, explainer, backend=None, preprocess_mode=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.model = model
+        self.explainer = explainer
+        self.backend = backend
+        self.preprocess_mode = preprocess_mode
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+
+    @property
+    def result_fingerprint(self):
+        """Cached results are only valid for the same weights, backend, CAM mode and input preprocessing"""
+        return f"{self.fingerprint}:{self.backend.result_key}:{self.preprocess_mode}"
+
+    @property
+    def hook_count(self):
+        return self.backend.hook_count
+
+    def explain_batch(self, input_batch, class_indices=None, on_diagnosis=None):
+        return self.backend.explain_batch(input_batch, class_indices, on_diagnosis)
+
+    def predict_batch(self, input_batch):
+        return self.backend.predict_batch(input_batch)
+
+    def class_heatmaps(self, input_batch):
+        return self.backend.class_heatmaps(input_batch)
+
+    def describe(self):
+        return {
+            'fingerprint': self.fingerprint,
+            'path': self.path,
+            'backend': self.backend.name if self.backend is not None else None,
+            'cam_mode': self.backend.cam_mode if self.backend is not None else None,
+            'preprocess_mode': self.preprocess_mode,
+            'loaded_at': self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """The serving model version, hot reloads and an optional shadow candidate.
+
+    `build(path)` returns a ready ModelVersion. Reloads build and warm up the new
+    version on a background thread while the current one keeps serving, then
+    hand it to the batcher, which picks it up at the start of its next batch;
+    in-flight batches finish on the version they started with.
+
+    A shadow version sees a sampled fraction of the batches the active version
+    has already answered. It runs on its own thread after the callers have their
+    results, so it adds no client latency, and only its agreement with the
+    active predictions and the latency difference are recorded. Only
+    predictions are compared, so the shadow runs a forward pass with no
+    heatmap; its latency is that forward pass, against the active version's
+    whole batch.
+
+    Reloads follow the file at `path`, which must be replaced atomically (write
+    a temporary file, then os.replace or mv it over the old one), never
+    rewritten in place: the serving model may be memory-mapped from it.
+    """
+
+    def __init__(self, build, warmup_iterations=3, shadow_sample_rate=0.1, shadow_queue_size=16):
+        self.build = build
+        self.warmup_iterations = warmup_iterations
+        self.shadow_sample_rate = shadow_sample_rate
+        self.active = None
+        self.shadow = None
+        self.scheduler = None
+        self._listeners = []
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._loading = None
+        self._last_error = None
+        self._history = []
+        self._shadow_queue = queue.Queue(maxsize=shadow_queue_size)
+        self._shadow_thread = None
+        self._shadow_stats = self._empty_shadow_stats()
+        self._watch_thread = None
+        self._stopping = threading.Event()
+
+    @staticmethod
+    def _empty_shadow_stats():
+        return {'samples': 0, 'agreements': 0, 'dropped_batches': 0, 'errors': 0,
+                'active_seconds': 0.0, 'shadow_seconds': 0.0}
+
+    def on_activate(self, callback):
+        """Call `callback(version)` whenever a version becomes active (usable as a decorator)"""
+        self._listeners.append(callback)
+        return callback
+
+    def attach(self, scheduler):
+        """Serve the active version through `scheduler` and feed it batches for shadow evaluation"""
+        self.scheduler = scheduler
+        scheduler.on_batch = self.observe_batch
+        if self.active is not None:
+            scheduler.swap_explainer(self.active)
+
+    def activate(self, version):
+        previous = self.active
+        self.active = version
+        if self.scheduler is not None:
+            self.scheduler.swap_explainer(version)
+        for callback in self._listeners:
+            callback(version)
+        with self._stats_lock:
+            self._history.append({'event': 'activated', 'at': datetime.now(timezone.utc).isoformat(),
+                                  **version.describe()})
+            del self._history[:-20]
+        if previous is not None:
+            logger.info("Activated model version",
+                        extra={'fingerprint': version.fingerprint, 'previous': previous.fingerprint})
+
+    def warm_up(self, version):
+        """Run a few zero batches so lazy init and kernel selection happen before traffic arrives"""
+        import torch
+
+        device = next(version.model.parameters()).device
+        batch = torch.zeros(1, 3, 224, 224, device=device)
+        for _ in range(self.warmup_iterations):
+            (_, confidence, _), = version.explain_batch(batch)
+        if confidence != confidence:  # NaN
+            raise ValueError("Model produced NaN confidences during warm-up")
+
+    def load(self, path, shadow=False, wait=False):
+        """Build and warm up the weights at `path` in the background, then activate or shadow them.
+
+        Returns False if another load is already running.
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return False
+        self._loading = {'path': path, 'shadow': shadow, 'started_at': datetime.now(timezone.utc).isoformat()}
+        thread = threading.Thread(target=self._load, args=(path, shadow), name='model-loader', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return True
+
+    def _load(self, path, shadow):
+        start = time.perf_counter()
+        try:
+            version = self.build(path)
+            self.warm_up(version)
+            if shadow:
+                self.set_shadow(version)
+            else:
+                self.activate(version)
+            self._last_error = None
+            logger.info("Loaded model version", extra={'path': path, 'fingerprint': version.fingerprint,
+                                                       'shadow': shadow,
+                                                       'seconds': round(time.perf_counter() - start, 3)})
+        except Exception as e:
+            self._last_error = {'path': path, 'error': str(e), 'at': datetime.now(timezone.utc).isoformat()}
+            logger.exception("Error loading model version, keeping the current one", extra={'path': path})
+        finally:
+            self._loading = None
+            self._load_lock.release()
+
+    def set_shadow(self, version):
+        self.shadow = version
+        with self._stats_lock:
+            self._shadow_stats = self._empty_shadow_stats()
+        if version is not None and (self._shadow_thread is None or not self._shadow_thread.is_alive()):
+            self._shadow_thread = threading.Thread(target=self._run_shadow, name='model-shadow', daemon=True)
+            self._shadow_thread.start()
+
+    def promote_shadow(self):
+        """Make the shadow version active; returns it, or None if there is no shadow"""
+        version = self.shadow
+        if version is not None:
+            self.shadow = None
+            self.activate(version)
+        return version
+
+    def observe_batch(self, explainer, batch, results, seconds):
+        """Batcher callback after a batch's futures are resolved; samples it for the shadow"""
+        if self.shadow is None or explainer is not self.active or random.random() >= self.shadow_sample_rate:
+            return
+        try:
+            self._shadow_queue.put_nowait((batch, [result[0] for result in results], seconds))
+        except queue.Full:
+            with self._stats_lock:
+                self._shadow_stats['dropped_batches'] += 1
+
+    def _run_shadow(self):
+        while not self._stopping.is_set():
+            try:
+                batch, active_classes, active_seconds = self._shadow_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            version = self.shadow
+            if version is None:
+                continue
+            start = time.perf_counter()
+            try:
+                shadow_classes = [result[0] for result in version.predict_batch(batch)]
+            except Exception as e:
+                with self._stats_lock:
+                    self._shadow_stats['errors'] += 1
+                logger.warning("Shadow model failed", extra={'fingerprint': version.fingerprint, 'error': str(e)})
+                continue
+            shadow_seconds = time.perf_counter() - start
+
+            agreements = sum(a == b for a, b in zip(active_classes, shadow_classes))
+            with self._stats_lock:
+                stats = self._shadow_stats
+                stats['samples'] += len(active_classes)
+                stats['agreements'] += agreements
+                stats['active_seconds'] += active_seconds
+                stats['shadow_seconds'] += shadow_seconds
+            logger.info("Shadow comparison", extra={
+                'fingerprint': version.fingerprint,
+                'batch_size': len(active_classes),
+                'agreements': agreements,
+                'latency_delta_ms': round((shadow_seconds - active_seconds) * 1000, 2),
+            })
+
+    def shadow_agreement(self):
+        with self._stats_lock:
+            samples = self._shadow_stats['samples']
+            return self._shadow_stats['agreements'] / samples if samples else None
+
+    def watch(self, path, interval):
+        """Reload `path` whenever it is replaced; the file must be stable for one interval first"""
+        def signature():
+            try:
+                stat = os.stat(path)
+                return stat.st_ino, stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return None
+
+        def run():
+            last = signature()
+            while not self._stopping.wait(interval):
+                current = signature()
+                if current is None or current == last:
+                    continue
+                # Let a copy in progress finish before loading
+                if self._stopping.wait(interval) or signature() != current:
+                    continue
+                if last is not None and current[0] == last[0]:
+                    # Same inode: written in place, under any mapping of the old weights
+                    logger.error("Model weights were rewritten in place; replace the file atomically "
+                                 "(write a temporary file, then os.replace or mv it)", extra={'path': path})
+                last = current
+                self.load(path)
+
+        self._watch_thread = threading.Thread(target=run, name='model-watcher', daemon=True)
+        self._watch_thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        with self._stats_lock:
+            shadow = dict(self._shadow_stats)
+            history = list(self._history)
+        samples = shadow['samples']
+        shadow['agreement'] = shadow['agreements'] / samples if samples else None
+        shadow['mean_latency_delta_ms'] = (
+            (shadow['shadow_seconds'] - shadow['active_seconds']) * 1000 / samples if samples else None)
+        return {
+            'active': self.active.describe() if self.active is not None else None,
+            'shadow': dict(self.shadow.describe(), sample_rate=self.shadow_sample_rate, **shadow)
+            if self.shadow is not None else None,
+            'loading': self._loading,
+            'last_error': self._last_error,
+            'history': history,
+        }
@@ -0,0 +1,298 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+# Latency buckets (seconds) shared by the stage and request histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with optional labels (thread-safe)"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time, or set explicitly"""
+
+    def __init__(self, name, documentation, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.callback() if self.callback is not None else self.value
+        except Exception:
+            return []  # The source is not ready yet (e.g. the model is still loading)
+        if value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback=None):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'optipro_stage_seconds', 'Time spent in each processing stage (batched stages are per batch)', ['stage'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'optipro_request_seconds', 'HTTP request latency', ['endpoint', 'status'])
+
+
+def process_resident_bytes():
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+REGISTRY.gauge('process_resident_memory_bytes', 'Resident memory size in bytes', process_resident_bytes)
+
+# Spans of the current request, for the Server-Timing header
+_request_spans = ContextVar('request_spans', default=None)
+
+
+def observe_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a processing stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def begin_request_spans():
+    return _request_spans.set([])
+
+
+def end_request_spans(token):
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans):
+    """Server-Timing header value, summing repeated stages"""
+    totals = {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items())
+
+
+class RequestProfiler:
+    """Opt-in per-request profiling that writes a trace file per profiled request.
+
+    `cprofile` captures the request thread as a pstats file. `torch` uses
+    torch.profiler and writes a Chrome trace; it also records the batched model
+    ops, which run on the scheduler thread. Only one request is profiled at a
+    time; concurrent attempts are skipped.
+    """
+
+    MODES = ('cprofile', 'torch')
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+    def start(self, mode):
+        if mode not in self.MODES or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if mode == 'cprofile':
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                from torch.profiler import ProfilerActivity, profile
+                profiler = profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+                profiler.__enter__()
+        except Exception:
+            self._lock.release()
+            raise
+        return mode, profiler
+
+    def stop(self, handle, name):
+        """Finish profiling and return the trace file path"""
+        mode, profiler = handle
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+            if mode == 'cprofile':
+                profiler.disable()
+                path = os.path.join(self.output_dir, f"{name}_{stamp}.prof")
+                profiler.dump_stats(path)
+            else:
+                profiler.__exit__(None, None, None)
+                path = os.path.join(self.output_dir, f"{name}_{stamp}.trace.json")
+                profiler.export_chrome_trace(path)
+            return path
+        finally:
+            self._lock.release()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields are included as top-level keys"""
+
+    STANDARD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.STANDARD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RecordQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with the message and traceback rendered, so `extra=` fields survive to the formatter"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_logging_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_output_handler = None
+
+
+def _start_listener():
+    global _listener
+    _queue_handler.queue = queue.Queue(-1)
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, _output_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def _flush_logs():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging(level='INFO', fmt='json'):
+    """Route all logging through a queue drained by a background writer thread.
+
+    Request threads only enqueue records; formatting and the stdout write
+    happen on the listener thread. Forked children (gunicorn workers) get a
+    fresh queue and listener automatically. Safe to call more than once; later
+    calls only change the level.
+    """
+    global _queue_handler, _output_handler
+    root = logging.getLogger()
+    with _logging_lock:
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        if _queue_handler is not None:
+            return
+        _output_handler = logging.StreamHandler(sys.stdout)
+        _output_handler.setFormatter(
+            JsonFormatter() if fmt == 'json' else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        _queue_handler = _RecordQueueHandler(queue.Queue(-1))
+        root.handlers = [_queue_handler]
+        _start_listener()
+        atexit.register(_flush_logs)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_start_listener)
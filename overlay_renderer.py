@@ -0,0 +1,79 @@
+import threading
+
+import numpy as np
+
+# Weight of the colored heatmap added on top of the scan
+HEATMAP_ALPHA = 0.4
+
+
+class OverlayRenderer:
+    """Blends class activation maps onto scans at a bounded output resolution.
+
+    The scan is shrunk once to at most `max_side`, so a large fundus image never
+    gets full-resolution intermediates. The CAM is upsampled straight to that
+    size and mapped through a JET lookup table that already holds the
+    alpha-scaled colors, truncated to uint8, so the blend is a single
+    saturating uint8 add. Since the scan is integer, that equals the original
+    `clip(jet * alpha + image).astype(uint8)`, which truncates after the float64
+    add; only the CAM upsampling (float32, at output size) differs. The float and
+    index buffers are reused per thread for as long as the output size stays the
+    same.
+    """
+
+    def __init__(self, max_side=1024, alpha=HEATMAP_ALPHA):
+        self.max_side = max_side
+        self.alpha = alpha
+        self._lut = None
+        self._local = threading.local()
+
+    @property
+    def lut(self):
+        """(256, 3) uint8 RGB JET colors, pre-multiplied by alpha and truncated like the float path"""
+        if self._lut is None:
+            import cv2
+
+            jet = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_JET)
+            self._lut = (jet.reshape(256, 3)[:, ::-1] * self.alpha).astype(np.uint8)
+        return self._lut
+
+    def prepare(self, rgb):
+        """The scan at output resolution (the input itself if it is already small enough)"""
+        import cv2
+
+        height, width = rgb.shape[:2]
+        scale = self.max_side / float(max(height, width)) if self.max_side else 1.0
+        if scale >= 1:
+            return rgb
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+
+    def blend(self, base, cam):
+        """Overlay a [0, 1] CAM of any size onto a prepared scan; returns a new uint8 RGB image"""
+        import cv2
+
+        cam_buffer, index_buffer, tint_buffer = self._buffers(base.shape[:2])
+        cv2.resize(np.asarray(cam, dtype=np.float32), (base.shape[1], base.shape[0]), dst=cam_buffer)
+        np.multiply(cam_buffer, 255, out=cam_buffer)
+        np.copyto(index_buffer, cam_buffer, casting='unsafe')
+        np.take(self.lut, index_buffer, axis=0, out=tint_buffer)
+        return cv2.add(base, tint_buffer)
+
+    def render(self, rgb, cam):
+        return self.blend(self.prepare(rgb), cam)
+
+    def render_classes(self, rgb, cams):
+        """One overlay per CAM (e.g. every class), sharing a single downsample of the scan"""
+        base = self.prepare(rgb)
+        return [self.blend(base, cam) for cam in cams]
+
+    def _buffers(self, shape):
+        cached = getattr(self._local, 'buffers', None)
+        if cached is None or cached[0] != shape:
+            height, width = shape
+            cached = (shape, (
+                np.empty((height, width), dtype=np.float32),
+                np.empty((height, width), dtype=np.uint8),
+                np.empty((height, width, 3), dtype=np.uint8),
+            ))
+            self._local.buffers = cached
+        return cached[1]
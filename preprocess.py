@@ -0,0 +1,104 @@
+import threading
+
+import numpy as np
+
+from observability import stage
+
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# `torchvision`: the original PIL Resize + ToTensor + Normalize pipeline
+# `fast`: one cv2 resize of the uint8 image, normalized straight into the input tensor
+# `roi`: like `fast`, after cropping to the retinal region found by the validator
+PREPROCESS_MODES = ('torchvision', 'fast', 'roi')
+
+
+def crop_to_roi(rgb, roi, margin=0.03):
+    """Crop to an (x, y, w, h) box grown by `margin` of its size on each side (a view, no copy)"""
+    x, y, w, h = roi
+    pad_x, pad_y = int(round(w * margin)), int(round(h * margin))
+    height, width = rgb.shape[:2]
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+    if x1 - x0 < 16 or y1 - y0 < 16:
+        return rgb
+    return rgb[y0:y1, x0:x1]
+
+
+class InputPreprocessor:
+    """Turns a decoded uint8 RGB image into the normalized (1, 3, size, size) model input.
+
+    In `fast` and `roi` modes the image is resized in a single cv2 step on
+    uint8 (INTER_AREA when shrinking) and scaled and shifted per channel
+    directly into the output tensor, with no PIL round trip or float
+    intermediates at full resolution. On CUDA the tensor is written into a
+    per-thread pinned staging buffer and copied to the device asynchronously;
+    the buffer is reused once that copy has completed. On CPU every call gets
+    its own tensor, since the batcher holds on to it until the batch runs.
+    """
+
+    def __init__(self, device, mode='fast', size=224, roi_margin=0.03, transform=None):
+        import torch
+
+        if mode not in PREPROCESS_MODES:
+            raise ValueError(f"Unknown preprocessing mode '{mode}', expected one of {PREPROCESS_MODES}")
+        if mode == 'torchvision' and transform is None:
+            raise ValueError("torchvision preprocessing needs the torchvision transform")
+        self.device = torch.device(device)
+        self.mode = mode
+        self.size = size
+        self.roi_margin = roi_margin
+        self.transform = transform
+        # x / 255 / std - mean / std, as one multiply and one subtract per channel
+        self._scale = (1.0 / (255.0 * IMAGENET_STD))[:, None, None]
+        self._offset = (IMAGENET_MEAN / IMAGENET_STD)[:, None, None]
+        self._pinned = self.device.type == 'cuda'
+        self._local = threading.local()
+
+    def resize(self, rgb):
+        import cv2
+
+        height, width = rgb.shape[:2]
+        shrinking = height >= self.size and width >= self.size
+        return cv2.resize(np.ascontiguousarray(rgb), (self.size, self.size),
+                          interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+    def normalize_into(self, resized, out):
+        """Write the normalized CHW float32 image into `out` (a (3, size, size) array)"""
+        np.multiply(resized.transpose(2, 0, 1), self._scale, out=out, casting='unsafe')
+        np.subtract(out, self._offset, out=out)
+
+    def _staging_buffer(self):
+        import torch
+
+        local = self._local
+        if getattr(local, 'buffer', None) is None:
+            local.buffer = torch.empty((1, 3, self.size, self.size), dtype=torch.float32, pin_memory=True)
+            local.copied = None
+        elif local.copied is not None:
+            local.copied.synchronize()  # The previous async copy out of this buffer has finished
+        return local
+
+    def __call__(self, rgb, roi=None):
+        import torch
+        from PIL import Image
+
+        with stage('transform'):
+            if self.mode == 'torchvision':
+                return self.transform(Image.fromarray(rgb)).unsqueeze(0).to(self.device)
+
+            if self.mode == 'roi' and roi is not None:
+                rgb = crop_to_roi(rgb, roi, self.roi_margin)
+            resized = self.resize(rgb)
+
+            if not self._pinned:
+                tensor = torch.empty((1, 3, self.size, self.size), dtype=torch.float32)
+                self.normalize_into(resized, tensor.numpy()[0])
+                return tensor
+
+            local = self._staging_buffer()
+            self.normalize_into(resized, local.buffer.numpy()[0])
+            tensor = local.buffer.to(self.device, non_blocking=True)
+            local.copied = torch.cuda.Event()
+            local.copied.record()
+            return tensor
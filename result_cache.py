@@ -0,0 +1,135 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint_file(path, chunk_size=1024 * 1024):
+    """Short content hash of a file, used to tie cached results to a weights version"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_digest(rgb, weights_fingerprint):
+    """Content address of a decoded image under a given set of model weights"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(weights_fingerprint.encode('utf-8'))
+    digest.update(repr(rgb.shape).encode('utf-8'))
+    digest.update(np.ascontiguousarray(rgb).data)
+    return digest.hexdigest()
+
+
+def _entry_size(entry):
+    return sum(len(value) for value in entry.values() if isinstance(value, (str, bytes)))
+
+
+class ResultCache:
+    """LRU/TTL cache of prediction results keyed by image_digest().
+
+    Entries are plain JSON-serializable dicts. The in-memory tier is bounded by
+    both entry count and total payload size; if `disk_dir` is set, entries are
+    also written there and promoted back into memory on a memory miss.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                created, entry = item
+                if now - created <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self._evict(key)
+
+        item = self._read_disk(key)
+        with self._lock:
+            if key in self._entries:
+                # Put or promoted by another thread while this one read the disk
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][1]
+            if item is not None and now - item[0] <= self.ttl_seconds:
+                self._insert(key, item[0], item[1])
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        created = time.time()
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._insert(key, created, entry)
+        self._write_disk(key, created, entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_tier': bool(self.disk_dir),
+            }
+
+    def _insert(self, key, created, entry):
+        self._entries[key] = (created, entry)
+        self._bytes += _entry_size(entry)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, entry = self._entries.pop(key)
+        self._bytes -= _entry_size(entry)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key + '.json')
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key)) as f:
+                data = json.load(f)
+            return data['created'], data['entry']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, created, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        # A temporary name per writer: concurrent puts of one key must not share it
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'created': created, 'entry': entry}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Error writing result cache entry to disk", extra={'key': key, 'error': str(e)})
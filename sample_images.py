@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from artifacts import JPEG_QUALITY
+
+logger = logging.getLogger(__name__)
+
+# Files smaller than this are placeholders, not real scans
+MIN_SAMPLE_BYTES = 1000
+
+
+class SampleImageCatalog:
+    """Example scans shown with rejected uploads, encoded once and served by reference.
+
+    Every candidate path holding a real image is read and re-encoded as JPEG
+    once, under an id derived from its file name ("Sample Retina 2.jpeg" is
+    `sample-retina-2`). Missing, placeholder and unreadable files are logged and
+    skipped; with none left the catalog is simply empty. Lookups re-check the
+    candidates' (mtime, size) at most every `check_interval` seconds and rebuild
+    only when they changed, so replacing a sample file is picked up without a
+    restart. invalidate() forces a rebuild on the next lookup.
+    """
+
+    def __init__(self, paths, name, description, check_interval=30):
+        self.paths = list(paths)
+        self.name = name
+        self.description = description
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._samples = {}
+        self._etag = None
+
+    def _source_signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    @staticmethod
+    def sample_id(path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return re.sub(r'[^a-z0-9]+', '-', stem.lower()).strip('-')
+
+    def _build(self, signature):
+        samples = {}
+        for path, _, size in signature:
+            sample_id = self.sample_id(path)
+            if size <= MIN_SAMPLE_BYTES or sample_id in samples:
+                continue
+            try:
+                with Image.open(path) as img:
+                    buffer = BytesIO()
+                    img.convert('RGB').save(buffer, format='JPEG', quality=JPEG_QUALITY)
+            except Exception as e:
+                logger.warning("Skipping unreadable sample image", extra={'path': path, 'error': str(e)})
+                continue
+            data = buffer.getvalue()
+            samples[sample_id] = {'data': data, 'etag': hashlib.blake2b(data, digest_size=8).hexdigest()}
+
+        self._samples = samples
+        listing = ','.join(f"{sample_id}:{sample['etag']}" for sample_id, sample in sorted(samples.items()))
+        self._etag = hashlib.blake2b(listing.encode('utf-8'), digest_size=8).hexdigest()
+        if samples:
+            logger.info("Loaded sample images", extra={'samples': sorted(samples)})
+        else:
+            logger.warning("No sample images found", extra={'paths': self.paths})
+
+    def refresh(self, force=False):
+        """Rebuild the samples if a source file changed (or always, with force=True); returns them"""
+        now = time.monotonic()
+        with self._lock:
+            if force or self._signature is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                signature = self._source_signature()
+                if force or signature != self._signature:
+                    self._build(signature)
+                    self._signature = signature
+            return self._samples
+
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    @property
+    def etag(self):
+        """Version of the whole catalog, for the listing's ETag"""
+        self.refresh()
+        return self._etag
+
+    def get(self, sample_id):
+        """{'data': jpeg bytes, 'etag': ...} for a sample, or None"""
+        return self.refresh().get(sample_id)
+
+    def references(self, url_for):
+        """Sample descriptions with `url_for(sample_id)` in place of inline image data"""
+        return [
+            {'id': sample_id, 'name': self.name, 'description': self.description, 'url': url_for(sample_id)}
+            for sample_id in self.refresh()
+        ]
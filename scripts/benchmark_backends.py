@@ -0,0 +1,151 @@
+"""Benchmark and accuracy-drift report for the inference backends.
+
+Runs the same inputs through every backend in inference_backends.BACKENDS,
+times batched inference at several batch sizes, and compares each backend's
+predictions, confidences and heatmaps with the eager float32 reference.
+
+    python scripts/benchmark_backends.py --images path/to/labelled/images --json backends.json
+
+Without --images, random normalized tensors are used (fine for latency,
+meaningless for drift). The fastest backend that stays within the drift
+tolerances is printed as the recommendation.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from inference_backends import BACKENDS, create_backend, load_calibration_batches  # noqa: E402
+
+
+def load_inputs(directory, count):
+    paths = []
+    if directory:
+        for pattern in ('*.jpg', '*.jpeg', '*.png'):
+            paths.extend(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+    paths = sorted(paths)[:count]
+    if not paths:
+        generator = torch.Generator().manual_seed(0)
+        return torch.randn(count, 3, 224, 224, generator=generator)
+    tensors = []
+    for path in paths:
+        with Image.open(path) as img:
+            tensors.append(app.transform(img.convert('RGB')))
+    return torch.stack(tensors)
+
+
+def run_all(backend, inputs, batch_size):
+    results = []
+    for i in range(0, len(inputs), batch_size):
+        results.extend(backend.explain_batch(inputs[i:i + batch_size].to(app.device)))
+    return results
+
+
+def heatmap_correlation(a, b):
+    a, b = np.ravel(a), np.ravel(b)
+    if a.std() == 0 or b.std() == 0:
+        return 1.0 if np.allclose(a, b) else 0.0
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+def time_backend(backend, inputs, batch_size, iterations):
+    batch = inputs[:batch_size].to(app.device)
+    backend.explain_batch(batch)  # Warm-up
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        backend.explain_batch(batch)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return {
+        'batch_size': len(batch),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'images_per_sec': float(len(batch) * 1000 / timings.mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Directory of sample images (searched recursively)')
+    parser.add_argument('--count', type=int, default=32, help='Number of inputs compared across backends')
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--batch-sizes', default='1,8')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--cam-mode', default='cam', choices=['cam', 'gradcam'])
+    parser.add_argument('--calibration-dir', help='Images for INT8 calibration (defaults to --images)')
+    parser.add_argument('--max-confidence-drift', type=float, default=2.0, help='Max confidence difference, in percent points')
+    parser.add_argument('--min-agreement', type=float, default=0.99, help='Min top-1 agreement with eager')
+    parser.add_argument('--json', help='Write the report to this file')
+    args = parser.parse_args()
+
+    app.load_runtime()
+    inputs = load_inputs(args.images, args.count)
+    batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+    reference = run_all(create_backend('eager', app.model, app.explainer), inputs, max(batch_sizes))
+
+    report = {'inputs': len(inputs), 'source': args.images or 'random', 'backends': {}}
+    for name in args.backends.split(','):
+        print(f"Building {name} backend...")
+        start = time.perf_counter()
+        try:
+            backend = create_backend(
+                name, app.model, app.explainer,
+                cam_mode=args.cam_mode,
+                onnx_path=os.path.join('model_cache', f"resnet101_{app.MODEL_FINGERPRINT}.onnx"),
+                calibration_batches=load_calibration_batches(args.calibration_dir or args.images, app.transform)
+                if name == 'quantized' else None,
+            )
+        except Exception as e:
+            print(f"  skipped: {e}")
+            report['backends'][name] = {'error': str(e)}
+            continue
+        build_seconds = time.perf_counter() - start
+
+        results = run_all(backend, inputs, max(batch_sizes))
+        agreement = np.mean([r[0] == ref[0] for r, ref in zip(results, reference)])
+        confidence_drift = max(abs(r[1] - ref[1]) for r, ref in zip(results, reference))
+        correlation = np.mean([heatmap_correlation(r[2], ref[2]) for r, ref in zip(results, reference)])
+
+        report['backends'][name] = {
+            'build_seconds': build_seconds,
+            'top1_agreement': float(agreement),
+            'max_confidence_drift': float(confidence_drift),
+            'mean_heatmap_correlation': float(correlation),
+            'within_tolerance': bool(agreement >= args.min_agreement and confidence_drift <= args.max_confidence_drift),
+            'timings': [time_backend(backend, inputs, size, args.iterations) for size in batch_sizes],
+        }
+
+    print()
+    print(f"{'backend':12s} {'agree':>7s} {'conf drift':>10s} {'cam corr':>8s} " +
+          ' '.join(f"{'bs=' + str(size) + ' ms':>10s} {'img/s':>8s}" for size in batch_sizes))
+    for name, entry in report['backends'].items():
+        if 'error' in entry:
+            print(f"{name:12s} error: {entry['error']}")
+            continue
+        timings = ' '.join(f"{t['p50_ms']:10.1f} {t['images_per_sec']:8.1f}" for t in entry['timings'])
+        print(f"{name:12s} {entry['top1_agreement']:7.2%} {entry['max_confidence_drift']:10.2f} "
+              f"{entry['mean_heatmap_correlation']:8.3f} {timings}")
+
+    candidates = [(entry['timings'][-1]['images_per_sec'], name)
+                  for name, entry in report['backends'].items()
+                  if entry.get('within_tolerance')]
+    report['recommended'] = max(candidates)[1] if candidates else 'eager'
+    print(f"\nFastest backend within tolerance: {report['recommended']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Micro-benchmark of heatmap overlay rendering: per-request allocations and time.
+
+Compares the original rendering (a reference copy of what predict_image did:
+a full-resolution resize, applyColorMap, BGR->RGB and a float64 blend) with
+OverlayRenderer at the display resolution, on synthetic scans of several sizes.
+Peak allocation per call comes from tracemalloc, which sees numpy and OpenCV
+arrays.
+
+    python scripts/benchmark_overlay.py --sizes 1024,2048,4096 --json overlay.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from overlay_renderer import OverlayRenderer  # noqa: E402
+
+
+def legacy_render(img_np, heatmap):
+    heatmap = cv2.resize(heatmap, (img_np.shape[1], img_np.shape[0]))
+    heatmap_colored = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
+    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+    superimposed_img = heatmap_colored * 0.4 + img_np
+    return np.clip(superimposed_img, 0, 255).astype(np.uint8)
+
+
+def measure(render, iterations):
+    render()  # Warm-up: LUT, thread-local buffers
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - start)
+    return peak, float(np.median(timings) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1024,2048,4096', help='Comma-separated scan sizes (longest side)')
+    parser.add_argument('--max-side', type=int, default=1024, help='Renderer output resolution (DISPLAY_MAX_SIDE)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    cam = rng.random((7, 7))
+    renderer = OverlayRenderer(max_side=args.max_side)
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        rgb = rng.integers(0, 256, size=(size * 3 // 4, size, 3), dtype=np.uint8)
+        cams = [rng.random((7, 7)) for _ in range(4)]
+        cases = {
+            'legacy': lambda: legacy_render(rgb, cam),
+            'renderer': lambda: renderer.render(rgb, cam),
+            'legacy x4 classes': lambda: [legacy_render(rgb, c) for c in cams],
+            'renderer x4 classes': lambda: renderer.render_classes(rgb, cams),
+        }
+        for name, render in cases.items():
+            peak, median_ms = measure(render, args.iterations)
+            results.append({'size': size, 'renderer': name, 'peak_alloc_mb': peak / 2 ** 20, 'median_ms': median_ms})
+
+    print(f"{'size':>5s} {'renderer':>20s} {'peak alloc MB':>14s} {'median ms':>10s}")
+    for result in results:
+        print(f"{result['size']:5d} {result['renderer']:>20s} {result['peak_alloc_mb']:14.1f} {result['median_ms']:10.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""Offline, reproducible benchmark of the prediction service.
+
+Runs in-process against the local storage backend (a temp directory, no
+network) with the result cache off. It uses synthetic retinal-like scans at
+several resolutions and measures:
+
+  * each stage function in isolation: validate_retinal_image, the model input
+    preprocessing (PREPROCESS_MODE), predict_image, GradCAM.generate_heatmap,
+    image_to_base64 and upload_image_to_supabase
+  * POST /api/predict through the Flask app under concurrent load
+  * a leak check: thousands of requests, asserting that RSS growth stays under
+    --max-rss-growth-mb and that the Grad-CAM hook count does not change
+
+Reports throughput, p50/p95/p99 latency and peak RSS, and writes everything to
+--json. Pass a previous results file to --compare to print the change per
+benchmark.
+
+    python scripts/benchmark_suite.py --sizes 512,1024,2048 --json bench.json
+    python scripts/benchmark_suite.py --json new.json --compare bench.json
+
+Exits with status 1 if the leak check fails.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix='optipro-bench-')
+
+# Configure the app before importing it: offline storage, no result cache, bounded artifact store
+os.environ.update(
+    MODEL_LOAD_MODE='manual',
+    STORAGE_BACKEND='local',
+    LOCAL_STORAGE_DIR=os.path.join(SCRATCH, 'storage'),
+    UPLOAD_SPOOL_DIR=os.path.join(SCRATCH, 'spool'),
+    RESULT_CACHE_SIZE='0',
+    ARTIFACT_STORE_SIZE='32',
+    STATS_BACKEND='sqlite',
+    STATS_SQLITE_PATH=os.path.join(SCRATCH, 'stats.db'),
+)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('ALLOW_UNTRAINED_MODEL', '1')
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from observability import process_resident_bytes  # noqa: E402
+from load_test import synthetic_scans  # noqa: E402
+from retinal_validator import retinal_roi, validate_retinal_image  # noqa: E402
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def summarize(timings, elapsed=None):
+    timings = np.asarray(timings) * 1000 if len(timings) else np.zeros(1)
+    elapsed = elapsed if elapsed is not None else timings.sum() / 1000
+    return {
+        'iterations': int(len(timings)),
+        'throughput_per_sec': float(len(timings) / elapsed) if elapsed else 0.0,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'mean_ms': float(timings.mean()),
+    }
+
+
+def time_function(fn, args_for, iterations, warmup=3):
+    for i in range(warmup):
+        fn(*args_for(i))
+    timings = []
+    for i in range(iterations):
+        args = args_for(i)
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def decode_all(payloads):
+    return [app.prepare_input(app.decode_image(io.BytesIO(payload), max_side=app.MAX_DECODE_SIDE))
+            for payload in payloads]
+
+
+def function_benchmarks(sizes, images, iterations):
+    results = {}
+    for size in sizes:
+        payloads = synthetic_scans(images, size=size, seed=size)
+        decoded = decode_all(payloads)
+        pick = lambda i: decoded[i % len(decoded)]  # noqa: E731
+        digests = [app.image_digest(d.rgb, app.RESULT_FINGERPRINT) for d in decoded]
+        rois = [retinal_roi(d.rgb) for d in decoded]
+
+        cases = {
+            'validate_retinal_image': (validate_retinal_image, lambda i: (pick(i).rgb,)),
+            f"preprocess[{app.preprocessor.mode}]": (app.preprocessor, lambda i: (pick(i).rgb, rois[i % len(rois)])),
+            'predict_image': (app.predict_image, lambda i: (pick(i), digests[i % len(digests)])),
+            'GradCAM.generate_heatmap': (app.explainer.generate_heatmap, lambda i: (pick(i).tensor.to(app.device),)),
+            'image_to_base64': (app.image_to_base64, lambda i: (pick(i).rgb,)),
+            'upload_image_to_supabase': (
+                app.upload_image_to_supabase,
+                lambda i: (payloads[i % len(payloads)], f"bench_{size}_{i}.jpg", 'retinal-images')),
+        }
+        for name, (fn, args_for) in cases.items():
+            result = time_function(fn, args_for, iterations)
+            results[f"{name}@{size}"] = result
+            print(f"  {name:26s} {size:5d}px  p50 {result['p50_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms")
+    return results
+
+
+def post_scan(client, payload):
+    return client.post('/api/predict', data={'file': (io.BytesIO(payload), 'scan.jpg')},
+                       content_type='multipart/form-data')
+
+
+def endpoint_load(payloads, concurrency, requests_per_client):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def client_loop(index):
+        client = app.app.test_client()
+        for i in range(requests_per_client):
+            payload = payloads[(index + i * concurrency) % len(payloads)]
+            start = time.perf_counter()
+            response = post_scan(client, payload)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(latencies, time.perf_counter() - start)
+    result.update({'concurrency': concurrency, 'errors': len(errors), 'peak_rss_mb': peak_rss_bytes() / 2 ** 20})
+    return result
+
+
+def leak_check(payloads, requests, warmup, max_growth_mb, concurrency):
+    """RSS and hook count after warm-up vs after `requests` more requests"""
+    endpoint_load(payloads, concurrency, max(1, warmup // concurrency))
+    hooks_before = app.explainer.hook_count
+    rss_before = process_resident_bytes()
+
+    samples = []
+    per_round = max(1, requests // 10)
+    for _ in range(10):
+        endpoint_load(payloads, concurrency, max(1, per_round // concurrency))
+        samples.append(process_resident_bytes() / 2 ** 20)
+
+    growth_mb = (process_resident_bytes() - rss_before) / 2 ** 20
+    hooks_after = app.explainer.hook_count
+    return {
+        'requests': requests,
+        'rss_before_mb': rss_before / 2 ** 20,
+        'rss_samples_mb': samples,
+        'rss_growth_mb': growth_mb,
+        'max_rss_growth_mb': max_growth_mb,
+        'hook_count_before': hooks_before,
+        'hook_count_after': hooks_after,
+        'passed': growth_mb <= max_growth_mb and hooks_after == hooks_before,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline_path} ({baseline.get('git_revision', 'unknown')[:12]}):")
+    sections = [('functions', current['functions'], baseline.get('functions', {})),
+                ('endpoint', {'endpoint': current['endpoint']}, {'endpoint': baseline.get('endpoint', {})})]
+    for _, now, before in sections:
+        for name, result in now.items():
+            old = before.get(name)
+            if not old:
+                continue
+            delta = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+            print(f"  {name:38s} p50 {old['p50_ms']:8.2f} -> {result['p50_ms']:8.2f} ms ({delta:+6.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='512,1024,2048', help='Comma-separated scan resolutions (longest side)')
+    parser.add_argument('--images', type=int, default=8, help='Distinct synthetic scans per resolution')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed calls per function and resolution')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Endpoint requests in the load test')
+    parser.add_argument('--leak-requests', type=int, default=2000)
+    parser.add_argument('--leak-warmup', type=int, default=200)
+    parser.add_argument('--max-rss-growth-mb', type=float, default=64.0)
+    parser.add_argument('--skip-leak-check', action='store_true')
+    parser.add_argument('--json', help='Write results to this file')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    start = time.perf_counter()
+    app.load_runtime()
+    load_seconds = time.perf_counter() - start
+
+    print("Function benchmarks:")
+    functions = function_benchmarks(sizes, args.images, args.iterations)
+
+    payloads = synthetic_scans(args.images * 4, size=max(sizes), seed=1)
+    print(f"\nEndpoint load: {args.requests} requests, concurrency {args.concurrency}, {max(sizes)}px")
+    endpoint = endpoint_load(payloads, args.concurrency, max(1, args.requests // args.concurrency))
+    print(f"  {endpoint['throughput_per_sec']:.2f} req/s, p50 {endpoint['p50_ms']:.0f} ms, "
+          f"p95 {endpoint['p95_ms']:.0f} ms, p99 {endpoint['p99_ms']:.0f} ms, {endpoint['errors']} errors")
+
+    leak = None
+    if not args.skip_leak_check:
+        print(f"\nLeak check: {args.leak_requests} requests after {args.leak_warmup} warm-up")
+        leak = leak_check(payloads, args.leak_requests, args.leak_warmup, args.max_rss_growth_mb, args.concurrency)
+        print(f"  RSS growth {leak['rss_growth_mb']:.1f} MB (limit {leak['max_rss_growth_mb']:.0f}), "
+              f"hooks {leak['hook_count_before']} -> {leak['hook_count_after']}: "
+              f"{'PASS' if leak['passed'] else 'FAIL'}")
+
+    results = {
+        'generated_at': datetime.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'inference_backend': app.inference_backend.name,
+        'device': str(app.device),
+        'model_load_seconds': load_seconds,
+        'config': vars(args),
+        'functions': functions,
+        'endpoint': endpoint,
+        'leak_check': leak,
+        'peak_rss_mb': peak_rss_bytes() / 2 ** 20,
+    }
+    print(f"\nPeak RSS {results['peak_rss_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+    app.shutdown_services()
+    if leak is not None and not leak['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
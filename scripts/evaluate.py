@@ -0,0 +1,236 @@
+"""Offline evaluation of the model weights on a labelled image tree.
+
+The directory must have one sub-folder per class in app.CLASSES (CNV, DME,
+DRUSEN, NORMAL), searched recursively. Images are decoded and preprocessed by
+a multi-worker DataLoader the way the API does it (--preprocess, default
+PREPROCESS_MODE) and run in batches through app.load_model(). Only file paths
+and running counts are kept, so memory does not grow with the number of images.
+
+    python scripts/evaluate.py data/test --batch-size 64 --workers 8
+
+Writes the confusion matrix, per-class precision/recall/F1, and throughput
+and latency percentiles to --output. The default is EVALUATION_RESULTS_PATH,
+which the API serves at GET /api/evaluation.
+
+--compare-preprocessing evaluates the same images once per preprocessing mode
+(torchvision, fast, roi) and adds each mode's accuracy, macro F1 and
+per-image preprocessing latency to the report, relative to torchvision:
+
+    python scripts/evaluate.py data/test --compare-preprocessing
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+os.environ.setdefault('MODEL_LOAD_MODE', 'manual')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from preprocess import PREPROCESS_MODES, InputPreprocessor  # noqa: E402
+from result_cache import fingerprint_file  # noqa: E402
+from retinal_validator import retinal_roi  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+
+class LabelledScans(Dataset):
+    """(tensor, label, preprocess seconds) from class-named folders; only paths are held in memory.
+
+    Only the step from decoded pixels to model input is timed. In `roi` mode the
+    bounding box is found first and not counted, since the API reuses the one
+    validation already computed.
+    """
+
+    def __init__(self, root, classes, mode, limit=None):
+        self.mode = mode
+        self.preprocessor = None  # Built in each worker process on first use
+        self.samples = []
+        for label, name in enumerate(classes):
+            class_dir = os.path.join(root, name)
+            if not os.path.isdir(class_dir):
+                print(f"Warning: no folder for class {name} in {root}")
+                continue
+            for dirpath, _, filenames in os.walk(class_dir):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        self.samples.append((os.path.join(dirpath, filename), label))
+        if limit:
+            self.samples = self.samples[:limit]
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        if self.preprocessor is None:
+            self.preprocessor = InputPreprocessor('cpu', self.mode, transform=app.build_transform())
+        path, label = self.samples[index]
+        try:
+            with Image.open(path) as img:
+                img = img.convert('RGB')
+            rgb = np.asarray(img)
+            roi = retinal_roi(rgb) if self.mode == 'roi' else None
+            start = time.perf_counter()
+            if self.mode == 'torchvision':
+                tensor = self.preprocessor.transform(img)  # As the API did, straight from the PIL image
+            else:
+                tensor = self.preprocessor(rgb, roi)[0]
+            return tensor, label, time.perf_counter() - start
+        except Exception as e:
+            print(f"Skipping unreadable image {path}: {e}")
+            return torch.zeros(3, 224, 224), -1, 0.0
+
+
+def percentiles(values):
+    values = np.asarray(values) * 1000 if len(values) else np.zeros(1)
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+
+def classification_report(matrix, classes):
+    per_class = {}
+    for i, name in enumerate(classes):
+        true_positives = int(matrix[i, i])
+        predicted = int(matrix[:, i].sum())
+        actual = int(matrix[i, :].sum())
+        precision = true_positives / predicted if predicted else 0.0
+        recall = true_positives / actual if actual else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        per_class[name] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': actual}
+    return per_class
+
+
+def evaluate(model, args, mode):
+    """Run the labelled images through `model` with one preprocessing mode; returns the report"""
+    dataset = LabelledScans(args.data_dir, app.CLASSES, mode, args.limit)
+    if not len(dataset):
+        sys.exit(f"No images found under {args.data_dir}")
+    print(f"Evaluating {len(dataset)} images with batch size {args.batch_size}, {args.workers} workers "
+          f"and {mode} preprocessing")
+
+    loader_options = {'prefetch_factor': 4, 'persistent_workers': False} if args.workers > 0 else {}
+    loader = DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers,
+                        pin_memory=app.device.type == 'cuda', **loader_options)
+
+    num_classes = len(app.CLASSES)
+    matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+    batch_latencies, image_latencies, data_waits, preprocess_latencies = [], [], [], []
+    evaluated = skipped = 0
+
+    start = time.perf_counter()
+    waited_from = start
+    with torch.inference_mode():
+        for inputs, labels, preprocess_seconds in loader:
+            data_waits.append(time.perf_counter() - waited_from)
+            batch_start = time.perf_counter()
+            predictions = model(inputs.to(app.device, non_blocking=True)).argmax(dim=1).cpu().numpy()
+            batch_latencies.append(time.perf_counter() - batch_start)
+            image_latencies.append(batch_latencies[-1] / len(inputs))
+
+            labels = labels.numpy()
+            valid = labels >= 0
+            np.add.at(matrix, (labels[valid], predictions[valid]), 1)
+            preprocess_latencies.extend(preprocess_seconds.numpy()[valid].tolist())
+            evaluated += int(valid.sum())
+            skipped += int((~valid).sum())
+            if len(batch_latencies) % 50 == 0:
+                print(f"  {evaluated} images, {evaluated / (time.perf_counter() - start):.1f} img/s")
+            waited_from = time.perf_counter()
+    elapsed = time.perf_counter() - start
+
+    per_class = classification_report(matrix, app.CLASSES)
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'weights': os.path.basename(app.MODEL_WEIGHTS_PATH),
+        'weights_fingerprint': fingerprint_file(app.MODEL_WEIGHTS_PATH),
+        'data_dir': os.path.abspath(args.data_dir),
+        'labels': list(app.CLASSES),
+        'matrix': matrix.tolist(),
+        'per_class': per_class,
+        'accuracy': float(np.trace(matrix) / matrix.sum()) if matrix.sum() else 0.0,
+        'macro_f1': float(np.mean([entry['f1'] for entry in per_class.values()])),
+        'images': evaluated,
+        'skipped': skipped,
+        'throughput': {
+            'images_per_sec': evaluated / elapsed if elapsed else 0.0,
+            'wall_seconds': elapsed,
+            'batch_latency_ms': percentiles(batch_latencies),
+            'per_image_latency_ms': percentiles(image_latencies),
+            'data_wait_ms': percentiles(data_waits),
+            'preprocess_ms': percentiles(preprocess_latencies),
+        },
+        'config': {'batch_size': args.batch_size, 'workers': args.workers, 'device': str(app.device),
+                   'preprocess': mode},
+    }
+
+
+def compare_preprocessing(reports):
+    """Accuracy and preprocessing latency of each mode, relative to the torchvision pipeline"""
+    baseline = reports['torchvision']
+    comparison = {}
+    for mode, report in reports.items():
+        preprocess_ms = report['throughput']['preprocess_ms']
+        comparison[mode] = {
+            'accuracy': report['accuracy'],
+            'macro_f1': report['macro_f1'],
+            'preprocess_ms': preprocess_ms,
+            'accuracy_delta': report['accuracy'] - baseline['accuracy'],
+            'macro_f1_delta': report['macro_f1'] - baseline['macro_f1'],
+            'preprocess_ms_saved': baseline['throughput']['preprocess_ms']['p50'] - preprocess_ms['p50'],
+        }
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', help='Directory with one sub-folder per class')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='DataLoader worker processes')
+    parser.add_argument('--limit', type=int, help='Evaluate at most this many images')
+    parser.add_argument('--preprocess', choices=PREPROCESS_MODES, default=app.PREPROCESS_MODE,
+                        help='Preprocessing for the reported results (default: PREPROCESS_MODE)')
+    parser.add_argument('--compare-preprocessing', action='store_true',
+                        help='Also evaluate every other preprocessing mode and report the differences')
+    parser.add_argument('--output', default=app.EVALUATION_RESULTS_PATH)
+    args = parser.parse_args()
+
+    if not os.path.exists(app.MODEL_WEIGHTS_PATH):
+        sys.exit(f"Model weights not found at {app.MODEL_WEIGHTS_PATH} (set MODEL_WEIGHTS)")
+
+    app.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = app.load_model()
+
+    modes = PREPROCESS_MODES if args.compare_preprocessing else (args.preprocess,)
+    reports = {mode: evaluate(model, args, mode) for mode in modes}
+    report = reports[args.preprocess]
+    if args.compare_preprocessing:
+        report['preprocessing'] = compare_preprocessing(reports)
+
+    # Write atomically so /api/evaluation never serves a partial file
+    tmp_path = args.output + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, args.output)
+
+    per_class = report['per_class']
+    print(f"\nAccuracy {report['accuracy']:.2%} on {report['images']} images ({report['skipped']} skipped), "
+          f"{report['throughput']['images_per_sec']:.1f} img/s with {args.preprocess} preprocessing")
+    print(f"{'class':8s} {'precision':>9s} {'recall':>7s} {'f1':>6s} {'support':>8s}")
+    for name, entry in per_class.items():
+        print(f"{name:8s} {entry['precision']:9.3f} {entry['recall']:7.3f} {entry['f1']:6.3f} {entry['support']:8d}")
+    if args.compare_preprocessing:
+        print(f"\n{'preprocess':12s} {'accuracy':>9s} {'delta':>8s} {'macro f1':>9s} {'p50 ms':>8s} {'saved ms':>9s}")
+        for mode, entry in report['preprocessing'].items():
+            print(f"{mode:12s} {entry['accuracy']:9.2%} {entry['accuracy_delta']:+8.2%} {entry['macro_f1']:9.3f} "
+                  f"{entry['preprocess_ms']['p50']:8.2f} {entry['preprocess_ms_saved']:9.2f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Load test showing /api/predict throughput as the gunicorn worker count grows.
+
+For each worker count, starts `gunicorn -c gunicorn.conf.py app:app` on a
+local port (local storage backend, result cache disabled so every request
+does real work), waits for /api/ready, then keeps `--concurrency` clients
+posting distinct synthetic scans for `--duration` seconds.
+
+    python scripts/load_test.py --workers 1,2,4 --concurrency 16 --duration 30
+
+Prints requests/sec and latency percentiles per worker count and can write
+them to --json.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def synthetic_scans(count, size=768, seed=0):
+    """Fundus-like JPEGs that pass validation: a muted orange disc on black with vessels, each with different noise"""
+    rng = np.random.default_rng(seed)
+    payloads = []
+    for _ in range(count):
+        img = Image.new('RGB', (size, size))
+        draw = ImageDraw.Draw(img)
+        margin = size // 10
+        draw.ellipse([margin, margin, size - margin, size - margin], fill=(170, 130, 110))
+        center = (size // 2 + size // 8, size // 2)
+        for angle in rng.uniform(0, 2 * np.pi, size=16):
+            end = (center[0] + np.cos(angle) * size * 0.35, center[1] + np.sin(angle) * size * 0.35)
+            draw.line([center, end], fill=(120, 30, 20), width=max(1, size // 150))
+        pixels = np.asarray(img).astype(np.int16) + rng.integers(-6, 7, size=(size, size, 3))
+        buffer = io.BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=90)
+        payloads.append(buffer.getvalue())
+    return payloads
+
+
+def multipart_body(payload):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="scan.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode('utf-8') + payload + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/api/ready', timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_clients(base_url, payloads, concurrency, duration):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(index):
+        i = index
+        while time.time() < stop_at:
+            body, content_type = multipart_body(payloads[i % len(payloads)])
+            i += concurrency
+            request = urllib.request.Request(base_url + '/api/predict', data=body,
+                                             headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=120) as response:
+                    response.read()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    timings = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_sec': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+        'p99_ms': float(np.percentile(timings, 99)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts to test')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load per worker count')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--images', type=int, default=64, help='Distinct synthetic scans to cycle through')
+    parser.add_argument('--ready-timeout', type=float, default=180.0)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    payloads = synthetic_scans(args.images)
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+
+    for worker_count in [int(count) for count in args.workers.split(',')]:
+        scratch = tempfile.mkdtemp(prefix='optipro-load-')
+        env = dict(os.environ,
+                   GUNICORN_WORKERS=str(worker_count),
+                   GUNICORN_BIND=f"127.0.0.1:{args.port}",
+                   STORAGE_BACKEND='local',
+                   LOCAL_STORAGE_DIR=os.path.join(scratch, 'storage'),
+                   UPLOAD_SPOOL_DIR=os.path.join(scratch, 'spool'),
+                   RESULT_CACHE_SIZE='0')
+        env.setdefault('ALLOW_UNTRAINED_MODEL', '1')
+        print(f"Starting gunicorn with {worker_count} worker(s)...")
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                  cwd=ROOT, env=env)
+        try:
+            if not wait_until_ready(base_url, args.ready_timeout):
+                print("  server did not become ready, skipping")
+                continue
+            result = run_clients(base_url, payloads, args.concurrency, args.duration)
+            result['workers'] = worker_count
+            results.append(result)
+            print(f"  {result['requests_per_sec']:.2f} req/s, p50 {result['p50_ms']:.0f} ms, "
+                  f"p95 {result['p95_ms']:.0f} ms, p99 {result['p99_ms']:.0f} ms, {result['errors']} errors")
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    if results:
+        baseline = results[0]['requests_per_sec'] or 1.0
+        print()
+        print(f"{'workers':>7s} {'req/s':>8s} {'speedup':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+        for result in results:
+            print(f"{result['workers']:7d} {result['requests_per_sec']:8.2f} "
+                  f"{result['requests_per_sec'] / baseline:8.2f} {result['p50_ms']:8.0f} {result['p99_ms']:8.0f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
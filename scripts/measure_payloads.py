@@ -0,0 +1,117 @@
+"""Before/after measurement of /api/predict response size and serialization time.
+
+Builds the response body for synthetic scans three ways and reports the JSON
+size, JPEG encoding time and json.dumps time of each:
+
+  legacy   the original path: each image encoded at full resolution twice (upload
+           and base64), and on a failed upload the base64 duplicated into the URL field
+  full     RESPONSE_MODE=full: one encode per image at DISPLAY_MAX_SIDE
+  compact  RESPONSE_MODE=compact: as full, with the heatmap fetched from /api/artifacts
+
+    python scripts/measure_payloads.py --sizes 1024,2048 --json payloads.json
+
+Rendering the heatmap overlay is the same in every mode and is not timed.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artifacts import DISPLAY_MAX_SIDE, encode_jpeg, jpeg_data_uri  # noqa: E402
+from load_test import synthetic_scans  # noqa: E402
+
+
+def legacy_encode(image_array):
+    # Reference copy of the original upload_image_to_supabase/image_to_base64 encoding
+    buffer = io.BytesIO()
+    Image.fromarray(image_array.astype('uint8'), 'RGB').save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def overlay(rgb):
+    # A stand-in overlay with the same size and texture as a rendered heatmap
+    height, width = rgb.shape[:2]
+    ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    return np.clip(rgb * 0.6 + ramp * 0.4, 0, 255).astype(np.uint8)
+
+
+def build(mode, rgb, heatmap, uploaded):
+    start = time.perf_counter()
+    if mode == 'legacy':
+        # Upload copy, then a second encode for base64
+        legacy_encode(rgb), legacy_encode(heatmap)
+        original_base64 = 'data:image/jpeg;base64,' + base64.b64encode(legacy_encode(rgb)).decode('utf-8')
+        heatmap_base64 = 'data:image/jpeg;base64,' + base64.b64encode(legacy_encode(heatmap)).decode('utf-8')
+    else:
+        original_base64 = jpeg_data_uri(encode_jpeg(rgb, max_side=DISPLAY_MAX_SIDE))
+        heatmap_base64 = jpeg_data_uri(encode_jpeg(heatmap, max_side=DISPLAY_MAX_SIDE))
+    encode_seconds = time.perf_counter() - start
+
+    scan_id = '0' * 32
+    original_url = f"https://example.supabase.co/storage/v1/object/public/retinal-images/original_{scan_id}.jpg" if uploaded else None
+    heatmap_url = f"https://example.supabase.co/storage/v1/object/public/heatmap-images/heatmap_{scan_id}.jpg" if uploaded else None
+    body = {'success': True, 'prediction': 'CNV', 'confidence': '97.12%', 'scan_id': scan_id}
+    if mode == 'compact':
+        body.update({
+            'image_url': original_url,
+            'image_base64': original_base64,
+            'heatmap_url': heatmap_url or f"/api/artifacts/{scan_id}/heatmap.jpg",
+            'heatmap_path': f"/api/artifacts/{scan_id}/heatmap.jpg",
+        })
+    else:
+        body.update({
+            'image_url': original_url or original_base64,
+            'heatmap_url': heatmap_url or heatmap_base64,
+            'image_base64': original_base64,
+            'heatmap_base64': heatmap_base64,
+        })
+
+    start = time.perf_counter()
+    payload = json.dumps(body)
+    return len(payload), encode_seconds, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1024,2048', help='Comma-separated scan sizes (longest side)')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--json', help='Write results to this file')
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with Image.open(io.BytesIO(synthetic_scans(1, size=size)[0])) as img:
+            rgb = np.asarray(img.convert('RGB'))
+        heatmap = overlay(rgb)
+        for uploaded in (True, False):
+            for mode in ('legacy', 'full', 'compact'):
+                runs = [build(mode, rgb, heatmap, uploaded) for _ in range(args.repeats)]
+                results.append({
+                    'size': size,
+                    'upload': 'ok' if uploaded else 'failed',
+                    'mode': mode,
+                    'body_bytes': runs[0][0],
+                    'encode_ms': float(np.median([run[1] for run in runs]) * 1000),
+                    'dumps_ms': float(np.median([run[2] for run in runs]) * 1000),
+                })
+
+    print(f"{'size':>5s} {'upload':>7s} {'mode':>8s} {'body KB':>9s} {'encode ms':>10s} {'dumps ms':>9s}")
+    for result in results:
+        print(f"{result['size']:5d} {result['upload']:>7s} {result['mode']:>8s} {result['body_bytes'] / 1024:9.1f} "
+              f"{result['encode_ms']:10.1f} {result['dumps_ms']:9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Rebuild the per-doctor stats aggregates from the patients and retinal_scans tables.
+
+The aggregates are maintained incrementally on every write. Run this once
+after adding the doctor_stats tables to an existing database, or whenever the
+aggregates are suspected to have drifted:
+
+    python scripts/rebuild_doctor_stats.py                 # every doctor
+    python scripts/rebuild_doctor_stats.py --doctor <id>   # a single doctor
+
+Uses the same STATS_BACKEND / STATS_SQLITE_PATH / SUPABASE_* settings as the app
+(SUPABASE_SERVICE_ROLE_KEY for Supabase).
+"""
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doctor_stats import create_stats_store  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctor', help='Only rebuild this doctor id')
+    parser.add_argument('--backend', help='Override STATS_BACKEND (supabase or sqlite)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    store = create_stats_store(
+        args.backend or os.getenv('STATS_BACKEND', 'supabase'),
+        supabase_url=os.getenv('SUPABASE_URL'),
+        supabase_key=os.getenv('SUPABASE_SERVICE_ROLE_KEY'),
+        sqlite_path=os.getenv('STATS_SQLITE_PATH', 'doctor_stats.db'),
+    )
+    rebuilt = store.rebuild(args.doctor)
+    print(f"Rebuilt stats for {rebuilt} doctor(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Regression harness for retinal_validator.validate_retinal_image.
+
+Generates a seeded corpus of synthetic images (fundus-like discs, including
+pale ones that get as far as the contour and edge checks, OCT-like B-scans and
+a range of non-retinal images at several resolutions), runs both
+the original full-resolution validator and the downsampled single-histogram
+validator on each one, and reports where their accept/reject decisions differ
+along with the time each one took.
+
+    python scripts/validator_regression.py --per-kind 10
+    python scripts/validator_regression.py --json validator_regression.json
+
+Exits with status 1 if the disagreement rate exceeds --tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retinal_validator import VALIDATION_MAX_SIDE, validate_retinal_image  # noqa: E402
+
+RESOLUTIONS = [(640, 480), (1600, 1200), (4000, 3000)]
+
+
+def reference_validate_retinal_image(img_np):
+    """The original full-resolution validator, kept verbatim as the reference for decisions"""
+    try:
+        height, width = img_np.shape[:2]
+        if width < 100 or height < 100:
+            return False, "Image resolution too low for retinal analysis"
+
+        gray = cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+
+        dark_pixels = np.sum(gray < 40) / gray.size
+        if dark_pixels < 0.15:
+            return False, "Image lacks the characteristic dark background of retinal scans"
+
+        bright_mask = gray > 40
+        bright_ratio = np.sum(bright_mask) / gray.size
+
+        if bright_ratio < 0.05:
+            return False, "Image is too dark to be a valid retinal scan"
+
+        red_channel = img_np[:, :, 0].astype(float)
+        green_channel = img_np[:, :, 1].astype(float)
+        blue_channel = img_np[:, :, 2].astype(float)
+
+        if np.sum(bright_mask) > 0:
+            red_mean = np.mean(red_channel[bright_mask])
+            green_mean = np.mean(green_channel[bright_mask])
+            blue_mean = np.mean(blue_channel[bright_mask])
+
+            color_std = np.std([red_mean, green_mean, blue_mean])
+            if color_std > 60:
+                return False, "Color variation too high for medical imaging"
+
+            if blue_mean > red_mean * 1.2 and green_mean > red_mean * 1.2:
+                return False, "Color profile does not match retinal imaging (too much blue/green)"
+
+        _, thresh = cv2.threshold(gray, 25, 255, cv2.THRESH_BINARY)
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        if len(contours) == 0:
+            return False, "No retinal structure detected in image"
+
+        largest_contour = max(contours, key=cv2.contourArea)
+        contour_area = cv2.contourArea(largest_contour)
+        image_area = width * height
+
+        area_ratio = contour_area / image_area
+        if area_ratio < 0.08:
+            return False, "No significant retinal region found"
+
+        if area_ratio > 0.92:
+            return False, "Image lacks typical retinal scan framing"
+
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+        hist = hist.flatten() / hist.sum()
+
+        dark_region = np.sum(hist[0:40])
+        medium_region = np.sum(hist[40:180])
+
+        if dark_region < 0.1:
+            return False, "Brightness distribution does not match retinal imaging"
+
+        if medium_region < 0.1:
+            return False, "Missing characteristic retinal brightness pattern"
+
+        edges = cv2.Canny(gray, 20, 80)
+        edge_density = np.sum(edges > 0) / edges.size
+
+        if edge_density < 0.01 or edge_density > 0.4:
+            return False, "Edge pattern does not match retinal imaging"
+
+        hsv = cv2.cvtColor(img_np, cv2.COLOR_RGB2HSV)
+        saturation = hsv[:, :, 1]
+        high_saturation = np.sum(saturation > 100) / saturation.size
+
+        if high_saturation > 0.3:
+            return False, "Image appears to be a photograph rather than medical scan"
+
+        return True, "Valid retinal image detected"
+
+    except Exception as e:
+        return False, f"Error processing image: {str(e)}"
+
+
+# Synthetic corpus
+
+def _fundus(rng, width, height):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    center = (width // 2 + int(rng.integers(-width // 20, width // 20 + 1)), height // 2)
+    radius = int(min(width, height) * rng.uniform(0.35, 0.48))
+    base = (int(rng.integers(170, 230)), int(rng.integers(70, 120)), int(rng.integers(20, 60)))
+    cv2.circle(img, center, radius, base, -1)
+
+    # Vessels radiating from the optic disc
+    disc = (center[0] + radius // 3, center[1])
+    thickness = max(1, radius // 60)
+    for angle in rng.uniform(0, 2 * np.pi, size=12):
+        end = (int(disc[0] + np.cos(angle) * radius), int(disc[1] + np.sin(angle) * radius))
+        cv2.line(img, disc, end, (120, 30, 20), thickness)
+    cv2.circle(img, disc, radius // 8, (240, 200, 120), -1)
+
+    # Sensor noise inside the disc only, so the border stays dark
+    noise = rng.normal(0, 8, size=img.shape)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(mask, center, radius, 1, -1)
+    noisy = np.clip(img + noise * mask[:, :, None], 0, 255).astype(np.uint8)
+    return cv2.GaussianBlur(noisy, (5, 5), 0)
+
+
+def _pale_fundus(rng, width, height):
+    """A desaturated fundus that passes the colour and saturation checks, so the
+    contour and edge checks decide. Texture and vessel density vary widely to
+    land on both sides of the edge density limits."""
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    center = (width // 2, height // 2)
+    radius = int(min(width, height) * rng.uniform(0.35, 0.48))
+    red = int(rng.integers(150, 210))
+    base = (red, int(red * rng.uniform(0.7, 0.8)), int(red * rng.uniform(0.6, 0.7)))
+    cv2.circle(img, center, radius, base, -1)
+
+    disc = (center[0] + radius // 3, center[1])
+    vessel = tuple(int(c * 0.7) for c in base)
+    thickness = max(1, int(radius * rng.uniform(0.005, 0.02)))
+    for angle in rng.uniform(0, 2 * np.pi, size=int(rng.integers(4, 60))):
+        end = (int(disc[0] + np.cos(angle) * radius), int(disc[1] + np.sin(angle) * radius))
+        cv2.line(img, disc, end, vessel, thickness)
+
+    # Fine texture inside the disc, from nearly flat to very busy
+    noise = rng.normal(0, rng.uniform(1, 30), size=(height, width, 1))
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.circle(mask, center, radius, 1, -1)
+    textured = np.clip(img + noise * mask[:, :, None], 0, 255).astype(np.uint8)
+    blur = int(rng.choice([1, 3, 5, 9]))
+    return cv2.GaussianBlur(textured, (blur, blur), 0) if blur > 1 else textured
+
+
+def _oct(rng, width, height):
+    rows = np.arange(height, dtype=np.float32)[:, None]
+    cols = np.arange(width, dtype=np.float32)[None, :]
+    # Curved retinal layers across the middle of the B-scan
+    curve = height * 0.5 + height * 0.08 * np.sin(cols / width * np.pi * rng.uniform(1, 3))
+    gray = np.zeros((height, width), dtype=np.float32)
+    for offset, level in [(-0.08, 150), (-0.04, 90), (0.0, 200), (0.05, 120), (0.1, 170)]:
+        band = np.exp(-((rows - curve - offset * height) ** 2) / (2 * (height * 0.015) ** 2))
+        gray += band * level
+    gray += rng.normal(0, 12, size=gray.shape)
+    gray = np.clip(gray, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+
+def _wallpaper(rng, width, height):
+    x = np.linspace(0, 1, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    phase = rng.uniform(0, 2 * np.pi, size=3)
+    channels = [127 + 127 * np.sin(6 * (x + y) + p) for p in phase]
+    return np.clip(np.dstack(channels), 0, 255).astype(np.uint8)
+
+
+def _nature(rng, width, height):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[: height // 2] = (int(rng.integers(60, 110)), int(rng.integers(150, 200)), int(rng.integers(200, 250)))
+    img[height // 2:] = (int(rng.integers(20, 60)), int(rng.integers(120, 170)), int(rng.integers(40, 80)))
+    img[int(height * 0.8):] = 10
+    return img
+
+
+def _document(rng, width, height):
+    img = np.full((height, width, 3), 245, dtype=np.uint8)
+    for y in range(40, height - 40, max(8, height // 40)):
+        x_end = int(width * rng.uniform(0.5, 0.9))
+        cv2.line(img, (40, y), (x_end, y), (20, 20, 20), max(1, height // 400))
+    return img
+
+
+def _noise(rng, width, height):
+    return rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+
+
+def _dark(rng, width, height):
+    return rng.integers(0, 30, size=(height, width, 3), dtype=np.uint8)
+
+
+def _tiny(rng, width, height):
+    return _fundus(rng, 80, 60)
+
+
+KINDS = {
+    'fundus': _fundus,
+    'pale-fundus': _pale_fundus,
+    'oct': _oct,
+    'wallpaper': _wallpaper,
+    'nature': _nature,
+    'document': _document,
+    'noise': _noise,
+    'dark': _dark,
+    'tiny': _tiny,
+}
+
+
+def build_corpus(per_kind, seed):
+    rng = np.random.default_rng(seed)
+    for kind, make in KINDS.items():
+        for i in range(per_kind):
+            width, height = RESOLUTIONS[i % len(RESOLUTIONS)]
+            yield f"{kind}-{i}-{width}x{height}", make(rng, width, height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-kind', type=int, default=6, help='Images generated per synthetic kind')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--max-side', type=int, default=VALIDATION_MAX_SIDE, help='Downsample bound for the new validator')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='Allowed fraction of decision mismatches')
+    parser.add_argument('--json', help='Write per-image results to this file')
+    args = parser.parse_args()
+
+    results = []
+    reference_time = 0.0
+    fast_time = 0.0
+    for name, img in build_corpus(args.per_kind, args.seed):
+        start = time.perf_counter()
+        expected, expected_message = reference_validate_retinal_image(img)
+        reference_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual, actual_message = validate_retinal_image(img, max_side=args.max_side)
+        fast_time += time.perf_counter() - start
+
+        results.append({
+            'image': name,
+            'reference': expected,
+            'reference_message': expected_message,
+            'validator': actual,
+            'validator_message': actual_message,
+            'match': expected == actual,
+        })
+        status = 'ok      ' if expected == actual else 'MISMATCH'
+        print(f"{status} {name:28s} reference={expected!s:5s} validator={actual!s:5s} {actual_message}")
+
+    mismatches = [r for r in results if not r['match']]
+    accepted = sum(r['reference'] for r in results)
+    mismatch_rate = len(mismatches) / len(results)
+    print()
+    print(f"Images: {len(results)} ({accepted} accepted by reference)")
+    print(f"Decision mismatches: {len(mismatches)} ({mismatch_rate:.1%})")
+    print(f"Reference validator: {reference_time * 1000 / len(results):.1f} ms/image")
+    print(f"Downsampled validator: {fast_time * 1000 / len(results):.1f} ms/image "
+          f"({reference_time / max(fast_time, 1e-9):.1f}x faster)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'max_side': args.max_side,
+                'seed': args.seed,
+                'mismatch_rate': mismatch_rate,
+                'reference_ms_per_image': reference_time * 1000 / len(results),
+                'validator_ms_per_image': fast_time * 1000 / len(results),
+                'results': results,
+            }, f, indent=2)
+
+    return 1 if mismatch_rate > args.tolerance else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
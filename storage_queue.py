@@ -0,0 +1,442 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from observability import observe_stage, stage
+
+logger = logging.getLogger(__name__)
+
+
+class SupabaseStorageBackend:
+    """Object storage backed by a Supabase client.
+
+    A single backend (and so a single Supabase client with its HTTP session) is
+    shared by every upload worker, so connections are reused across uploads.
+    """
+
+    def __init__(self, client, base_url):
+        self.client = client
+        self.base_url = base_url.rstrip('/') if base_url else ''
+
+    def upload(self, bucket, key, data, content_type):
+        response = self.client.storage.from_(bucket).upload(key, data, {
+            'content-type': content_type,
+            'upsert': 'true',  # Retries after a partial success must not fail on an existing object
+        })
+        # Older clients report errors on the response instead of raising
+        error = getattr(response, 'error', None)
+        if error:
+            raise RuntimeError(f"Supabase upload failed: {error}")
+
+    def public_url(self, bucket, key):
+        # Public URLs are deterministic, so build them locally instead of a round trip
+        return f"{self.base_url}/storage/v1/object/public/{bucket}/{key}"
+
+
+class AsyncSupabaseStorageBackend:
+    """Supabase Storage over its REST API with an httpx.AsyncClient, for the asyncio upload workers.
+
+    The client (and its connection pool) is created on the event loop that first
+    uploads and shared by every upload task.
+    """
+
+    def __init__(self, base_url, key, timeout=30.0):
+        self.base_url = base_url.rstrip('/') if base_url else ''
+        self.key = key
+        self.timeout = timeout
+        self._client = None
+
+    async def upload_async(self, bucket, key, data, content_type):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=self.timeout, headers={
+                'apikey': self.key,
+                'Authorization': f"Bearer {self.key}",
+            })
+        response = await self._client.post(
+            f"{self.base_url}/storage/v1/object/{bucket}/{key}",
+            content=data,
+            headers={'content-type': content_type, 'x-upsert': 'true'},
+        )
+        if response.status_code >= 400:
+            raise RuntimeError(f"Supabase upload failed: {response.status_code} {response.text[:200]}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def public_url(self, bucket, key):
+        return f"{self.base_url}/storage/v1/object/public/{bucket}/{key}"
+
+
+class LocalStorageBackend:
+    """Filesystem stand-in for object storage, used for local runs and tests.
+
+    `fail_times` makes the first N uploads raise, to exercise retries.
+    """
+
+    def __init__(self, root, base_url='/local-storage', fail_times=0):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+        self.fail_times = fail_times
+        self.upload_calls = 0
+        self._lock = threading.Lock()
+
+    def upload(self, bucket, key, data, content_type):
+        with self._lock:
+            self.upload_calls += 1
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise ConnectionError("Simulated storage outage")
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Keys are content-derived, so the same object can be written by several
+        # workers at once; each writes its own file and renames it into place
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def public_url(self, bucket, key):
+        return f"{self.base_url}/{bucket}/{key}"
+
+
+def _process_alive(pid):
+    """Whether another running process has this pid (our own pid means a previous run's job)"""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UploadQueue:
+    """Write-behind queue that uploads artifacts to object storage in the background.
+
+    Every artifact is spooled to disk before it is queued, so pending uploads
+    survive a restart: `recover()` re-queues whatever is left in the spool
+    directory by processes that are no longer running. Uploads run on a bounded
+    pool of worker threads and are retried with exponential backoff. Callers
+    get the object key and its public URL immediately and can look up progress
+    with `status()`, or block on `wait()`.
+
+    Under an ASGI server, start_async() runs the workers as asyncio tasks on the
+    event loop instead, uploading through the backend's `upload_async` (or the
+    blocking `upload` in a thread if it has none).
+    """
+
+    def __init__(self, backend, spool_dir, workers=4, max_retries=5, backoff_base=0.5,
+                 backoff_max=30.0, max_tracked=10000):
+        self.backend = backend
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_tracked = max_tracked
+        self._queue = queue.Queue()
+        self._status = OrderedDict()
+        self._status_lock = threading.Lock()
+        self._status_changed = threading.Condition(self._status_lock)
+        self._stopping = threading.Event()
+        self._threads = []
+        self._loop = None
+        self._async_queue = None
+        self._async_backend = None
+        self._tasks = []
+        os.makedirs(spool_dir, exist_ok=True)
+
+    def start(self, recover=True):
+        self._stopping.clear()
+        if recover:
+            self.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'storage-upload-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def start_async(self, backend=None, recover=True):
+        """Start the workers as tasks on the running event loop; `backend` overrides the upload transport"""
+        self._stopping.clear()
+        self._async_backend = backend or self.backend
+        self._async_queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        if recover:
+            self.recover()
+        self._tasks = [self._loop.create_task(self._run_async()) for _ in range(self.workers)]
+        return self
+
+    async def stop_async(self):
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if hasattr(self._async_backend, 'aclose'):
+            await self._async_backend.aclose()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enqueue(self, bucket, key, data, content_type='image/jpeg'):
+        """Spool an artifact and queue it for upload; returns its public URL.
+
+        Keys are derived from the content, so a job already pending for the same
+        key (in this process or a live sibling) is left as it is, not rewritten.
+        """
+        job_id = self._job_id(bucket, key)
+        url = self.backend.public_url(bucket, key)
+        if not self._claim(bucket, key):
+            return url
+        meta = self._read_meta(job_id) if os.path.exists(os.path.join(self.spool_dir, job_id + '.json')) else None
+        if meta is not None and _process_alive(meta.get('owner')):
+            # A sibling worker owns it; status() reports it as spooled from the file
+            self._forget(bucket, key)
+            return url
+
+        # Data first, then metadata, each written to a temporary file and renamed
+        # into place: readers never see a partial file, and a crash never leaves
+        # metadata pointing at one
+        data_path = os.path.join(self.spool_dir, job_id + '.bin')
+        tmp_path = f"{data_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, data_path)
+        self._write_meta(job_id, {'bucket': bucket, 'key': key, 'content_type': content_type,
+                                  'owner': os.getpid()})
+
+        self._put(job_id)
+        return url
+
+    def recover(self):
+        """Take over and re-queue the spooled jobs no running process owns; returns how many.
+
+        Each job records the pid of the process that queued it. Server workers
+        sharing a spool can all call this when they start: the spool lock lets
+        one process claim at a time, and jobs whose owner is still alive (being
+        uploaded by a sibling worker) are left alone.
+        """
+        import fcntl
+
+        count = 0
+        with open(os.path.join(self.spool_dir, '.recover.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for name in sorted(os.listdir(self.spool_dir)):
+                if not name.endswith('.json'):
+                    continue
+                job_id = name[:-len('.json')]
+                meta = self._read_meta(job_id)
+                if meta is None or _process_alive(meta.get('owner')):
+                    continue
+                meta['owner'] = os.getpid()
+                self._write_meta(job_id, meta)
+                self._set_status(meta['bucket'], meta['key'], state='queued', attempts=0, error=None)
+                self._put(job_id)
+                count += 1
+        if count:
+            logger.info("Recovered pending uploads", extra={'count': count, 'spool_dir': self.spool_dir})
+        return count
+
+    def status(self, bucket, key):
+        with self._status_lock:
+            entry = self._status.get((bucket, key))
+            if entry:
+                return dict(entry)
+        # Queued by another process sharing the spool (e.g. another server worker)
+        if os.path.exists(os.path.join(self.spool_dir, self._job_id(bucket, key) + '.json')):
+            return {'bucket': bucket, 'key': key, 'url': self.backend.public_url(bucket, key), 'state': 'spooled'}
+        return None
+
+    def wait(self, bucket, key, timeout):
+        """Block until an upload queued by this process has finished or failed, or `timeout` passes.
+
+        Returns its status(), like status() does.
+        """
+        deadline = time.monotonic() + timeout
+        with self._status_changed:
+            while True:
+                entry = self._status.get((bucket, key))
+                remaining = deadline - time.monotonic()
+                if entry is None or entry['state'] in ('uploaded', 'failed') or remaining <= 0:
+                    break
+                self._status_changed.wait(remaining)
+        return self.status(bucket, key)
+
+    def stats(self):
+        with self._status_lock:
+            states = {}
+            for entry in self._status.values():
+                states[entry['state']] = states.get(entry['state'], 0) + 1
+        pending = self._async_queue.qsize() if self._loop is not None else self._queue.qsize()
+        return {'pending': pending, 'workers': self.workers, 'states': states}
+
+    def _put(self, job_id):
+        if self._loop is not None:
+            # enqueue() is called from request and executor threads; asyncio queues are loop-only
+            self._loop.call_soon_threadsafe(self._async_queue.put_nowait, job_id)
+        else:
+            self._queue.put(job_id)
+
+    def _job_id(self, bucket, key):
+        return hashlib.sha1(f"{bucket}/{key}".encode('utf-8')).hexdigest()
+
+    def _write_meta(self, job_id, meta):
+        # Written beside the target and renamed over it, so readers never see a partial file
+        meta_path = os.path.join(self.spool_dir, job_id + '.json')
+        tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _read_meta(self, job_id):
+        try:
+            with open(os.path.join(self.spool_dir, job_id + '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable spool entry", extra={'job_id': job_id, 'error': str(e)})
+            return None
+
+    def _claim(self, bucket, key):
+        """Mark a key queued unless this process already has it pending; returns whether it did"""
+        with self._status_lock:
+            entry = self._status.get((bucket, key))
+            if entry is not None and entry['state'] in ('queued', 'uploading', 'retrying'):
+                return False
+            self._update_status(bucket, key, state='queued', attempts=0, error=None)
+            return True
+
+    def _forget(self, bucket, key):
+        with self._status_lock:
+            self._status.pop((bucket, key), None)
+            self._status_changed.notify_all()
+
+    def _set_status(self, bucket, key, **fields):
+        with self._status_lock:
+            self._update_status(bucket, key, **fields)
+
+    def _update_status(self, bucket, key, **fields):
+        # Callers hold _status_lock
+        entry = self._status.pop((bucket, key), None) or {
+            'bucket': bucket,
+            'key': key,
+            'url': self.backend.public_url(bucket, key),
+        }
+        entry.update(fields)
+        self._status[(bucket, key)] = entry
+        while len(self._status) > self.max_tracked:
+            self._status.popitem(last=False)
+        self._status_changed.notify_all()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            self._process(job_id)
+
+    def _load_job(self, job_id):
+        """(meta, data) of a spooled job, or None if it can no longer be read"""
+        meta = self._read_meta(job_id)
+        if meta is None:
+            return None
+        try:
+            with open(os.path.join(self.spool_dir, job_id + '.bin'), 'rb') as f:
+                return meta, f.read()
+        except OSError as e:
+            self._set_status(meta['bucket'], meta['key'], state='failed', error=str(e))
+            return None
+
+    def _finish_job(self, job_id, meta):
+        self._set_status(meta['bucket'], meta['key'], state='uploaded', error=None)
+        for suffix in ('.bin', '.json'):
+            try:
+                os.remove(os.path.join(self.spool_dir, job_id + suffix))
+            except OSError:
+                pass
+
+    def _give_up(self, meta):
+        # Retries exhausted: keep the spool files so the upload is retried on restart
+        self._set_status(meta['bucket'], meta['key'], state='failed')
+        logger.error("Giving up on upload", extra={'bucket': meta['bucket'], 'key': meta['key'],
+                                                   'attempts': self.max_retries})
+
+    def _backoff(self, attempt):
+        return min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+
+    def _process(self, job_id):
+        job = self._load_job(job_id)
+        if job is None:
+            return
+        meta, data = job
+        bucket, key = meta['bucket'], meta['key']
+
+        for attempt in range(1, self.max_retries + 1):
+            self._set_status(bucket, key, state='uploading', attempts=attempt)
+            try:
+                with stage('storage_upload'):
+                    self.backend.upload(bucket, key, data, meta['content_type'])
+            except Exception as e:
+                self._set_status(bucket, key, state='retrying', error=str(e))
+                if self._stopping.wait(self._backoff(attempt)):
+                    return  # Shutting down; the spool keeps the job for next start
+                continue
+
+            self._finish_job(job_id, meta)
+            return
+
+        self._give_up(meta)
+
+    async def _run_async(self):
+        while not self._stopping.is_set():
+            job_id = await self._async_queue.get()
+            try:
+                await self._process_async(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error processing upload", extra={'job_id': job_id})
+
+    async def _process_async(self, job_id):
+        job = await asyncio.to_thread(self._load_job, job_id)
+        if job is None:
+            return
+        meta, data = job
+        bucket, key = meta['bucket'], meta['key']
+        backend = self._async_backend
+
+        for attempt in range(1, self.max_retries + 1):
+            self._set_status(bucket, key, state='uploading', attempts=attempt)
+            start = time.perf_counter()
+            try:
+                if hasattr(backend, 'upload_async'):
+                    await backend.upload_async(bucket, key, data, meta['content_type'])
+                else:
+                    await asyncio.to_thread(backend.upload, bucket, key, data, meta['content_type'])
+            except Exception as e:
+                self._set_status(bucket, key, state='retrying', error=str(e))
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            finally:
+                observe_stage('storage_upload', time.perf_counter() - start)
+
+            await asyncio.to_thread(self._finish_job, job_id, meta)
+            return
+
+        self._give_up(meta)
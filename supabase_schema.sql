@@ -174,6 +174,133 @@ FROM patients p
 LEFT JOIN retinal_scans rs ON p.id = rs.patient_id
 GROUP BY p.id, p.full_name, p.email, p.phone, p.age, p.gender, p.doctor_id, p.created_at;
 
+-- Per-doctor dashboard aggregates, kept up to date by triggers so the stats
+-- endpoint never scans retinal_scans (see doctor_stats.py)
+CREATE TABLE IF NOT EXISTS doctor_stats (
+    doctor_id UUID PRIMARY KEY REFERENCES doctors(id) ON DELETE CASCADE,
+    total_patients INTEGER NOT NULL DEFAULT 0,
+    total_scans INTEGER NOT NULL DEFAULT 0,
+    cnv_count INTEGER NOT NULL DEFAULT 0,
+    dme_count INTEGER NOT NULL DEFAULT 0,
+    drusen_count INTEGER NOT NULL DEFAULT 0,
+    normal_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Scans per doctor per day, for "recent analyses" without touching old scans
+CREATE TABLE IF NOT EXISTS doctor_daily_scans (
+    doctor_id UUID NOT NULL REFERENCES doctors(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    scan_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (doctor_id, day)
+);
+
+CREATE OR REPLACE FUNCTION apply_scan_to_doctor_stats(target_doctor_id UUID, scan_diagnosis VARCHAR, scan_day DATE, delta INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO doctor_stats (doctor_id) VALUES (target_doctor_id) ON CONFLICT (doctor_id) DO NOTHING;
+    UPDATE doctor_stats SET
+        total_scans = total_scans + delta,
+        cnv_count = cnv_count + CASE WHEN scan_diagnosis = 'CNV' THEN delta ELSE 0 END,
+        dme_count = dme_count + CASE WHEN scan_diagnosis = 'DME' THEN delta ELSE 0 END,
+        drusen_count = drusen_count + CASE WHEN scan_diagnosis = 'DRUSEN' THEN delta ELSE 0 END,
+        normal_count = normal_count + CASE WHEN scan_diagnosis = 'NORMAL' THEN delta ELSE 0 END,
+        updated_at = NOW()
+    WHERE doctor_id = target_doctor_id;
+    INSERT INTO doctor_daily_scans (doctor_id, day, scan_count) VALUES (target_doctor_id, scan_day, delta)
+    ON CONFLICT (doctor_id, day) DO UPDATE SET scan_count = doctor_daily_scans.scan_count + delta;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION update_doctor_stats_for_scan()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_scan_to_doctor_stats(OLD.doctor_id, OLD.diagnosis, (OLD.scan_date AT TIME ZONE 'UTC')::DATE, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_scan_to_doctor_stats(NEW.doctor_id, NEW.diagnosis, (NEW.scan_date AT TIME ZONE 'UTC')::DATE, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE OR REPLACE FUNCTION update_doctor_stats_for_patient()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE doctor_stats SET total_patients = total_patients - 1, updated_at = NOW() WHERE doctor_id = OLD.doctor_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO doctor_stats (doctor_id, total_patients) VALUES (NEW.doctor_id, 1)
+        ON CONFLICT (doctor_id) DO UPDATE SET total_patients = doctor_stats.total_patients + 1, updated_at = NOW();
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+CREATE TRIGGER retinal_scans_doctor_stats
+    AFTER INSERT OR DELETE OR UPDATE OF doctor_id, diagnosis, scan_date ON retinal_scans
+    FOR EACH ROW
+    EXECUTE FUNCTION update_doctor_stats_for_scan();
+
+CREATE TRIGGER patients_doctor_stats
+    AFTER INSERT OR DELETE OR UPDATE OF doctor_id ON patients
+    FOR EACH ROW
+    EXECUTE FUNCTION update_doctor_stats_for_patient();
+
+-- Bulk rebuild of the aggregates from the source tables (all doctors when target_doctor_id is NULL)
+CREATE OR REPLACE FUNCTION rebuild_doctor_stats(target_doctor_id UUID DEFAULT NULL)
+RETURNS INTEGER AS $$
+DECLARE
+    rebuilt INTEGER;
+BEGIN
+    DELETE FROM doctor_stats WHERE target_doctor_id IS NULL OR doctor_id = target_doctor_id;
+    DELETE FROM doctor_daily_scans WHERE target_doctor_id IS NULL OR doctor_id = target_doctor_id;
+
+    INSERT INTO doctor_stats (doctor_id, total_patients, total_scans, cnv_count, dme_count, drusen_count, normal_count)
+    SELECT d.id,
+           (SELECT COUNT(*) FROM patients p WHERE p.doctor_id = d.id),
+           COUNT(rs.id),
+           COUNT(CASE WHEN rs.diagnosis = 'CNV' THEN 1 END),
+           COUNT(CASE WHEN rs.diagnosis = 'DME' THEN 1 END),
+           COUNT(CASE WHEN rs.diagnosis = 'DRUSEN' THEN 1 END),
+           COUNT(CASE WHEN rs.diagnosis = 'NORMAL' THEN 1 END)
+    FROM doctors d
+    LEFT JOIN retinal_scans rs ON rs.doctor_id = d.id
+    WHERE target_doctor_id IS NULL OR d.id = target_doctor_id
+    GROUP BY d.id;
+    GET DIAGNOSTICS rebuilt = ROW_COUNT;
+
+    INSERT INTO doctor_daily_scans (doctor_id, day, scan_count)
+    SELECT doctor_id, (scan_date AT TIME ZONE 'UTC')::DATE, COUNT(*)
+    FROM retinal_scans
+    WHERE target_doctor_id IS NULL OR doctor_id = target_doctor_id
+    GROUP BY doctor_id, (scan_date AT TIME ZONE 'UTC')::DATE;
+
+    RETURN rebuilt;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+ALTER TABLE doctor_stats ENABLE ROW LEVEL SECURITY;
+ALTER TABLE doctor_daily_scans ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Doctors can view their own stats" ON doctor_stats
+    FOR SELECT USING (doctor_id = auth.uid());
+
+CREATE POLICY "Doctors can view their own daily scan counts" ON doctor_daily_scans
+    FOR SELECT USING (doctor_id = auth.uid());
+
+-- The policies above serve the frontend's own session. The Flask API has no user
+-- session: it reads these tables with SUPABASE_SERVICE_ROLE_KEY (which bypasses
+-- RLS) for the doctor named by the verified access token on each request.
+
+-- SECURITY DEFINER functions are callable through the REST API unless revoked;
+-- only the triggers and the service role may change the aggregates
+REVOKE EXECUTE ON FUNCTION apply_scan_to_doctor_stats(UUID, VARCHAR, DATE, INTEGER) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION rebuild_doctor_stats(UUID) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rebuild_doctor_stats(UUID) TO service_role;
+
 -- Insert sample data (optional - for testing)
 -- Note: In production, passwords should be properly hashed
 
@@ -273,3 +400,5 @@ COMMENT ON TABLE retinal_scans IS 'Stores retinal scan results and analysis data
 COMMENT ON TABLE appointments IS 'Stores appointment bookings from patients to doctors';
 COMMENT ON TABLE notifications IS 'Stores notifications for doctors about appointments and other events';
 COMMENT ON VIEW patient_stats IS 'Aggregated statistics for each patient including scan counts';
+COMMENT ON TABLE doctor_stats IS 'Per-doctor dashboard totals maintained by triggers; rebuild with rebuild_doctor_stats()';
+COMMENT ON TABLE doctor_daily_scans IS 'Scans per doctor per day, used for recent analysis counts';
@@ -0,0 +1,64 @@
+"""Shared fixtures: the Flask app, loaded once per session for offline runs.
+
+The app reads its configuration at import, so the environment is set before
+the first import: local storage and spool, SQLite stats, and randomly
+initialized weights (ALLOW_UNTRAINED_MODEL=1) loaded synchronously. Supabase
+points at a closed local port, so nothing leaves the machine.
+"""
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(ROOT, 'frontend', 'public', 'assets')
+SAMPLES = ['Sample Retina.jpeg', 'Sample Retina 2.jpeg', 'Sample Retina 3.jpeg']
+
+sys.path.insert(0, ROOT)
+
+
+def sample_bytes(name=SAMPLES[0]):
+    with open(os.path.join(SAMPLE_DIR, name), 'rb') as f:
+        return f.read()
+
+
+def zip_bytes(entries):
+    """A zip archive of {name: bytes}"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='session')
+def service(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('app')
+    os.environ.update({
+        'MODEL_LOAD_MODE': 'sync',
+        'MODEL_WEIGHTS': str(tmp / 'missing.pth'),
+        'ALLOW_UNTRAINED_MODEL': '1',
+        'INFERENCE_BACKEND': 'eager',
+        'MODEL_CACHE_DIR': str(tmp / 'model_cache'),
+        'SUPABASE_URL': 'http://127.0.0.1:9',
+        'SUPABASE_ANON_KEY': 'offline',
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_STORAGE_DIR': str(tmp / 'storage'),
+        'UPLOAD_SPOOL_DIR': str(tmp / 'spool'),
+        'STATS_BACKEND': 'sqlite',
+        'STATS_SQLITE_PATH': str(tmp / 'stats.db'),
+        'DOCTOR_AUTH': 'unverified',
+        'LOG_LEVEL': 'WARNING',
+    })
+    import app
+
+    assert app.runtime_ready.wait(120), app.runtime_error
+    yield app
+    app.shutdown_services()
+
+
+@pytest.fixture
+def client(service):
+    return service.app.test_client()
@@ -0,0 +1,145 @@
+import io
+import json
+import socket
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from conftest import SAMPLES, sample_bytes, zip_bytes
+
+CLASSES = {'CNV', 'DME', 'DRUSEN', 'NORMAL'}
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line.strip()]
+
+
+def mirrored(data):
+    buffer = io.BytesIO()
+    ImageOps.mirror(Image.open(io.BytesIO(data))).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def noise_jpeg():
+    rgb = np.random.default_rng(0).integers(0, 256, size=(300, 300, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def test_health_and_ready(client):
+    assert client.get('/api/health').status_code == 200
+    assert client.get('/api/ready').status_code == 200
+
+
+def test_predict_keeps_one_gradcam_hook(client, service):
+    scans = [sample_bytes(name) for name in SAMPLES]
+    for scan in scans + [mirrored(scan) for scan in scans]:
+        response = client.post('/api/predict', data={'file': (io.BytesIO(scan), 'scan.jpeg')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['success'] is True
+        assert body['prediction'] in CLASSES
+        assert body['heatmap_url']
+
+    assert service.explainer.hook_count == 1
+    assert client.get('/api/health').get_json()['gradcam_hooks'] == 1
+
+
+def test_repeated_scan_is_served_from_the_cache(client, service):
+    first = client.post('/api/predict', data={'file': (io.BytesIO(sample_bytes()), 'scan.jpeg')},
+                        content_type='multipart/form-data')
+    assert first.status_code == 200
+    assert first.get_json()['model_version'] == service.MODEL_FINGERPRINT
+    repeat = client.post('/api/predict', data={'file': (io.BytesIO(sample_bytes()), 'scan.jpeg')},
+                         content_type='multipart/form-data')
+    assert repeat.get_json()['cache'] == 'hit'
+    assert repeat.get_json()['scan_id'] == first.get_json()['scan_id']
+    assert repeat.get_json()['prediction'] == first.get_json()['prediction']
+
+def test_predict_rejects_non_retinal_image(client):
+    response = client.post('/api/predict', data={'file': (io.BytesIO(noise_jpeg()), 'noise.jpg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['error'] == 'Invalid retinal image'
+    assert len(body['sample_images']) == len(SAMPLES)
+
+    sample = client.get(body['sample_images'][0]['url'])
+    assert sample.status_code == 200
+    assert sample.mimetype == 'image/jpeg'
+    assert client.get('/api/samples').get_json()['sample_images'] == body['sample_images']
+
+
+def test_predict_stream_lines(client):
+    response = client.post('/api/predict/stream', data={'file': (io.BytesIO(sample_bytes(SAMPLES[1])), 'scan.jpeg')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    lines = ndjson(response)
+    assert [line['type'] for line in lines] == ['diagnosis', 'heatmap', 'stored']
+    assert lines[0]['prediction'] in CLASSES
+    assert len({line['scan_id'] for line in lines}) == 1
+
+def test_client_disconnected_peeks_at_the_socket(service):
+    server, client_side = socket.socketpair()
+    try:
+        environ = {'gunicorn.socket': server}
+        assert not service.client_disconnected(environ)
+        client_side.sendall(b'pipelined')
+        assert not service.client_disconnected(environ)
+        assert server.recv(64) == b'pipelined'
+        client_side.close()
+        assert service.client_disconnected(environ)
+    finally:
+        server.close()
+    assert not service.client_disconnected({})
+
+def test_predict_batch_files(client):
+    data = {'files': [(io.BytesIO(sample_bytes(name)), name) for name in SAMPLES[:2]]}
+    response = client.post('/api/predict/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    lines = ndjson(response)
+    results = [line for line in lines if line['type'] == 'result']
+    assert sorted(line['filename'] for line in results) == sorted(SAMPLES[:2])
+    assert all(line['success'] for line in results)
+    assert lines[-1]['type'] == 'summary'
+    assert (lines[-1]['total'], lines[-1]['succeeded'], lines[-1]['failed']) == (2, 2, 0)
+
+
+def test_predict_batch_zip_reports_bad_entries(client):
+    archive = zip_bytes({'study/a.jpeg': sample_bytes(SAMPLES[0]), 'study/b.jpeg': sample_bytes(SAMPLES[2]),
+                         'study/broken.jpg': b'not an image'})
+    data = {'files': [(io.BytesIO(archive), 'study.zip'), (io.BytesIO(b'not a zip'), 'bad.zip')]}
+    response = client.post('/api/predict/batch', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    lines = ndjson(response)
+    outcomes = {line['filename']: line['success'] for line in lines if line['type'] == 'result'}
+    assert outcomes['study/a.jpeg'] and outcomes['study/b.jpeg']
+    assert not outcomes['study/broken.jpg'] and not outcomes['bad.zip']
+    assert (lines[-1]['total'], lines[-1]['succeeded'], lines[-1]['failed']) == (4, 2, 2)
+
+
+def test_doctor_stats_require_a_token(client, service):
+    assert client.get('/api/doctor/stats').status_code == 401
+    headers = {'Authorization': 'Bearer doctor-1'}
+    service.doctor_stats.store.record_patient('p1', 'doctor-1')
+    refused = client.post('/api/scans', json={'patient_id': 'p1', 'diagnosis': 'DME'},
+                          headers={'Authorization': 'Bearer doctor-2'})
+    assert refused.status_code == 403
+    created = client.post('/api/scans', json={'patient_id': 'p1', 'diagnosis': 'DME'}, headers=headers)
+    assert created.status_code == 201
+    assert client.get('/api/doctor/stats', headers=headers).get_json()['scan_distribution']['DME'] == 1
+    assert client.get('/api/doctor/stats/doctor-2', headers=headers).status_code == 403
+
+
+def test_predict_class_overlays(client, service):
+    before = service.scheduler.stats()['total_requests']
+    response = client.post('/api/predict', data={'file': (io.BytesIO(sample_bytes(SAMPLES[2])), 'scan.jpeg'),
+                                                 'overlays': 'all'}, content_type='multipart/form-data')
+    assert response.status_code == 200
+    paths = response.get_json()['class_heatmaps']
+    assert set(paths) == CLASSES
+    assert all(client.get(path).status_code == 200 for path in paths.values())
+    # The per-class pass went through the batcher, not the request thread
+    assert service.scheduler.stats()['total_requests'] > before
@@ -0,0 +1,39 @@
+import pytest
+import torch
+
+from conftest import SAMPLE_DIR
+
+COMPILED_BACKENDS = {
+    'torchscript': (),
+    'onnx': ('onnxruntime', 'onnxscript'),
+    'quantized': (),
+}
+
+
+@pytest.mark.parametrize('name', sorted(COMPILED_BACKENDS))
+@pytest.mark.parametrize('cam_mode', ['cam', 'gradcam'])
+def test_backend_builds_without_falling_back(service, monkeypatch, name, cam_mode):
+    for module in COMPILED_BACKENDS[name]:
+        pytest.importorskip(module)
+    monkeypatch.setenv('INFERENCE_BACKEND', name)
+    monkeypatch.setenv('INFERENCE_CAM_MODE', cam_mode)
+    monkeypatch.setenv('QUANT_CALIBRATION_DIR', SAMPLE_DIR)
+
+    # create_inference_backend serves eager after any error, so check what it built
+    backend = service.create_inference_backend(service.model_registry.active)
+    assert backend.name == name
+    assert backend.cam_mode == cam_mode
+
+    batch = torch.randn(2, 3, 224, 224)
+    results = backend.explain_batch(batch)
+    assert len(results) == 2
+    for class_idx, confidence, heatmap in results:
+        assert 0 <= class_idx < len(service.CLASSES)
+        assert 0 <= confidence <= 100
+        assert heatmap.ndim == 2
+    assert [idx for idx, _ in backend.predict_batch(batch)] == [idx for idx, _, _ in results]
+
+
+def test_result_fingerprint_names_backend_and_preprocessing(service):
+    version = service.model_registry.active
+    assert version.result_fingerprint == f"{version.fingerprint}:eager:{service.preprocessor.mode}"
@@ -0,0 +1,28 @@
+import pytest
+
+from doctor_stats import SQLiteStatsStore
+
+
+def test_aggregates_match_a_rebuild():
+    store = SQLiteStatsStore()
+    store.record_patient('p1', 'd1')
+    store.record_patient('p2', 'd1')
+    for i, diagnosis in enumerate(['DME', 'DME', 'CNV']):
+        store.record_scan({'id': str(i), 'patient_id': 'p1', 'doctor_id': 'd1', 'diagnosis': diagnosis})
+
+    stats = store.fetch_stats('d1')
+    assert (stats['total_patients'], stats['total_scans'], stats['recent_analysis']) == (2, 3, 3)
+    assert stats['scan_distribution'] == {'CNV': 1, 'DME': 2, 'DRUSEN': 0, 'NORMAL': 0}
+    store.rebuild('d1')
+    assert store.fetch_stats('d1') == stats
+
+
+def test_scans_of_another_doctors_patient_are_refused():
+    store = SQLiteStatsStore()
+    store.record_patient('p1', 'd1')
+    with pytest.raises(PermissionError):
+        store.record_scan({'id': 's1', 'patient_id': 'p1', 'doctor_id': 'd2', 'diagnosis': 'DME'})
+    with pytest.raises(PermissionError):
+        store.record_scan({'id': 's2', 'patient_id': 'unknown', 'doctor_id': 'd1', 'diagnosis': 'DME'})
+    assert store.fetch_stats('d2')['total_scans'] == 0
+    assert store.fetch_stats('d1')['total_scans'] == 0
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import torch
+
+from inference_scheduler import BatchScheduler
+
+
+class RecordingExplainer:
+    """Answers every sample with its first pixel and records the batch sizes it ran"""
+
+    def __init__(self, name):
+        self.name = name
+        self.batches = []
+
+    def explain_batch(self, input_batch, class_indices=None, on_diagnosis=None):
+        self.batches.append(('explain', len(input_batch)))
+        return [(0, 100.0, np.zeros((7, 7))) for _ in range(len(input_batch))]
+
+    def class_heatmaps(self, input_batch):
+        self.batches.append(('classes', len(input_batch)))
+        return [np.full((4, 7, 7), float(sample[0, 0, 0])) for sample in input_batch]
+
+
+def test_class_heatmaps_run_on_the_requested_explainer():
+    serving, previous = RecordingExplainer('serving'), RecordingExplainer('previous')
+    scheduler = BatchScheduler(serving, max_wait_ms=50).start()
+    try:
+        futures = [scheduler.submit_class_heatmaps(torch.full((1, 3, 8, 8), float(i)), previous) for i in range(3)]
+        results = [future.result(timeout=10) for future in futures]
+    finally:
+        scheduler.stop()
+
+    assert [result[0, 0, 0] for result in results] == [0.0, 1.0, 2.0]
+    assert all(future.explainer is previous for future in futures)
+    assert not serving.batches
+    assert sum(size for _, size in previous.batches) == 3
+
+
+def test_stop_fails_requests_still_queued():
+    # Never started, so nothing takes the requests off the queue
+    scheduler = BatchScheduler(RecordingExplainer('serving'))
+    futures = [scheduler.submit(torch.zeros(1, 3, 8, 8)) for _ in range(2)]
+    cancelled = scheduler.submit(torch.zeros(1, 3, 8, 8))
+    cancelled.cancel()
+    scheduler.stop()
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=1)
+    assert cancelled.cancelled()
+    assert scheduler.stats()['queue_depth'] == 0
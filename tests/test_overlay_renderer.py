@@ -0,0 +1,20 @@
+import cv2
+import numpy as np
+
+from overlay_renderer import HEATMAP_ALPHA, OverlayRenderer
+
+
+def test_blend_matches_the_float_path_for_every_color_and_pixel():
+    # Row i uses JET color i, column j has pixel value j, so every pair is blended once
+    cam = np.repeat((np.arange(256, dtype=np.float32) / 255)[:, None], 256, axis=1)
+    image = np.repeat(np.arange(256, dtype=np.uint8)[None, :, None], 256, axis=0).repeat(3, axis=2)
+
+    jet = cv2.cvtColor(cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+    expected = np.clip(jet * HEATMAP_ALPHA + image, 0, 255).astype(np.uint8)
+    assert np.array_equal(OverlayRenderer().blend(image, cam), expected)
+
+
+def test_large_scans_render_at_display_size():
+    rgb = np.zeros((3000, 2000, 3), dtype=np.uint8)
+    overlay = OverlayRenderer(max_side=1024).render(rgb, np.ones((7, 7), dtype=np.float32))
+    assert overlay.shape == (1024, 683, 3)
@@ -0,0 +1,24 @@
+from result_cache import ResultCache, _entry_size
+
+
+class RacingResultCache(ResultCache):
+    """Puts a fresh entry for the key while get() is reading it from disk"""
+
+    def __init__(self, fresh, **kwargs):
+        super().__init__(**kwargs)
+        self.fresh = fresh
+
+    def _read_disk(self, key):
+        item = super()._read_disk(key)
+        self.put(key, self.fresh)
+        return item
+
+
+def test_disk_promotion_keeps_a_concurrent_put(tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).put('scan', {'prediction': 'DME'})
+    fresh = {'prediction': 'CNV', 'heatmap': 'x' * 100}
+    cache = RacingResultCache(fresh, disk_dir=str(tmp_path))
+
+    assert cache.get('scan') == fresh
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['hits']) == (1, _entry_size(fresh), 1)
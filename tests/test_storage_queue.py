@@ -0,0 +1,101 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+from storage_queue import LocalStorageBackend, UploadQueue
+
+
+class GatedStorageBackend(LocalStorageBackend):
+    """Holds every upload until `gate` is set"""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.gate = threading.Event()
+
+    def upload(self, bucket, key, data, content_type):
+        self.gate.wait(10)
+        super().upload(bucket, key, data, content_type)
+
+
+def wait_for_state(upload_queue, bucket, key, state, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = upload_queue.status(bucket, key)
+        if status and status['state'] == state:
+            return status
+        time.sleep(0.01)
+    raise AssertionError(f"{bucket}/{key} never reached {state}: {upload_queue.status(bucket, key)}")
+
+
+def spool_job(upload_queue, key, owner):
+    job_id = upload_queue._job_id('b', key)
+    with open(os.path.join(upload_queue.spool_dir, job_id + '.bin'), 'wb') as f:
+        f.write(b'data')
+    with open(os.path.join(upload_queue.spool_dir, job_id + '.json'), 'w') as f:
+        json.dump({'bucket': 'b', 'key': key, 'content_type': 'image/jpeg', 'owner': owner}, f)
+    return job_id
+
+
+def test_failed_uploads_are_retried(tmp_path):
+    backend = LocalStorageBackend(str(tmp_path / 'storage'), fail_times=2)
+    upload_queue = UploadQueue(backend, str(tmp_path / 'spool'), workers=1, backoff_base=0.01).start()
+    upload_queue.enqueue('b', 'scan.jpg', b'data')
+
+    assert wait_for_state(upload_queue, 'b', 'scan.jpg', 'uploaded')['attempts'] == 3
+    upload_queue.stop()
+    assert (tmp_path / 'storage' / 'b' / 'scan.jpg').read_bytes() == b'data'
+    assert not [name for name in os.listdir(tmp_path / 'spool') if not name.startswith('.')]
+
+
+def test_concurrent_enqueues_of_one_key_upload_once(tmp_path):
+    backend = GatedStorageBackend(str(tmp_path / 'storage'))
+    upload_queue = UploadQueue(backend, str(tmp_path / 'spool'), workers=4).start()
+    data = os.urandom(256 * 1024)
+    threads = [threading.Thread(target=upload_queue.enqueue, args=('b', 'scan.jpg', data)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    backend.gate.set()
+
+    assert upload_queue.wait('b', 'scan.jpg', 10)['state'] == 'uploaded'
+    upload_queue.stop()
+    assert backend.upload_calls == 1
+    assert (tmp_path / 'storage' / 'b' / 'scan.jpg').read_bytes() == data
+    assert not [name for name in os.listdir(tmp_path / 'spool') if not name.startswith('.')]
+
+def test_recover_uploads_what_a_previous_run_left_in_the_spool(tmp_path):
+    spool_dir = str(tmp_path / 'spool')
+    outage = LocalStorageBackend(str(tmp_path / 'storage'), fail_times=100)
+    first = UploadQueue(outage, spool_dir, workers=1, max_retries=1).start()
+    first.enqueue('b', 'scan.jpg', b'data')
+    wait_for_state(first, 'b', 'scan.jpg', 'failed')
+    first.stop()
+
+    second = UploadQueue(LocalStorageBackend(str(tmp_path / 'storage')), spool_dir, workers=1).start()
+    wait_for_state(second, 'b', 'scan.jpg', 'uploaded')
+    second.stop()
+    assert (tmp_path / 'storage' / 'b' / 'scan.jpg').read_bytes() == b'data'
+
+
+def test_recover_skips_jobs_owned_by_live_processes(tmp_path):
+    spool_dir = str(tmp_path / 'spool')
+    os.makedirs(spool_dir)
+    live = subprocess.Popen(['sleep', '30'])
+    exited = subprocess.Popen(['true'])
+    exited.wait()
+    try:
+        upload_queue = UploadQueue(LocalStorageBackend(str(tmp_path / 'storage')), spool_dir)
+        orphan = spool_job(upload_queue, 'orphan.jpg', exited.pid)
+        spool_job(upload_queue, 'owned.jpg', live.pid)
+
+        assert upload_queue.recover() == 1
+        assert upload_queue.status('b', 'orphan.jpg')['state'] == 'queued'
+        assert upload_queue.status('b', 'owned.jpg')['state'] == 'spooled'
+        with open(os.path.join(spool_dir, orphan + '.json')) as f:
+            assert json.load(f)['owner'] == os.getpid()
+    finally:
+        live.kill()
+        live.wait()